@@ -0,0 +1,62 @@
+"""
+Per-shop change notifications for the Server-Sent Events stream.
+
+Every subscriber gets its own bounded queue and publishing never waits: a subscriber
+whose queue is full is dropped on the spot and told to resynchronize, so one slow
+terminal cannot hold up sales or other terminals.
+"""
+
+import asyncio
+
+
+class Subscription:
+    def __init__(self, max_queue: int):
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        # Set once the subscriber fell behind; its stream ends after a resync event
+        self.dropped = False
+
+
+class ShopEvents:
+    """Fans change events out to the subscribers of one shop."""
+
+    def __init__(self):
+        self._subscribers = set()
+        self.dropped_subscribers = 0
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self, max_queue: int) -> Subscription:
+        subscription = Subscription(max_queue)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def publish(self, event: dict):
+        if not self._subscribers:
+            return
+        for subscription in list(self._subscribers):
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscription.dropped = True
+                self._subscribers.discard(subscription)
+                self.dropped_subscribers += 1
+
+
+def change_event(sequence: int, collection: str, record_id: str, record) -> dict:
+    """Compact description of a change; clients fetch full records through /sync."""
+    event = {"seq": sequence, "type": collection, "op": "delete" if record is None else "upsert", "id": record_id}
+    if record is None:
+        return event
+    if collection == "inventory":
+        event["stock_quantity"] = record["stock_quantity"]
+    else:
+        event.update(
+            battery_id=record["battery_id"],
+            quantity_sold=record["quantity_sold"],
+            total_amount=record["total_amount"]
+        )
+    return event
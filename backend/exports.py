@@ -0,0 +1,398 @@
+"""
+Streaming sales and inventory exports (CSV, XLSX and PDF).
+
+A report is a lazy sequence of rows plus totals that are accumulated while the rows are
+produced. Each writer turns a report into a generator of byte chunks, flushing every
+``EXPORT_CHUNK_ROWS`` rows, so memory use stays flat however long the history is. XLSX
+and PDF files are written by hand: XLSX as a zip streamed entry by entry, PDF as
+sequential objects with the page tree and cross-reference table written last.
+"""
+
+import csv
+import io
+import re
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+EXPORT_CHUNK_ROWS = 500
+DATE_FORMAT = "%d/%m/%Y"
+TIME_FORMAT = "%I:%M:%S %p"
+FOOTER = "Powered by Murick Battery Management System"
+
+
+def _as_datetime(value) -> datetime:
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+
+def _money(value) -> str:
+    # PDF base fonts have no rupee sign, as in the browser exports
+    return f"Rs {value:,.2f}"
+
+
+class SalesReport:
+    title = "SALES REPORT"
+    columns = (
+        "Date", "Time", "Invoice #", "Battery", "Quantity", "Unit Price (Rs)", "Total Amount (Rs)",
+        "Profit per Unit (Rs)", "Total Profit (Rs)", "Customer Name", "Customer Phone"
+    )
+    # (header, width in characters, right-aligned, cell) for the narrower PDF table
+    pdf_columns = (
+        ("Date", 10, False, lambda row: row[0]),
+        ("Battery", 34, False, lambda row: row[3]),
+        ("Qty", 5, True, lambda row: str(row[4])),
+        ("Price", 16, True, lambda row: _money(row[5])),
+        ("Total", 18, True, lambda row: _money(row[6])),
+        ("Profit", 18, True, lambda row: _money(row[8])),
+        ("Customer", 30, False, lambda row: row[9])
+    )
+
+    def __init__(self, sale_ids, sales: dict, inventory: dict, unknown_battery: dict):
+        self.sale_ids = sale_ids
+        self.sales = sales
+        self.inventory = inventory
+        self.unknown_battery = unknown_battery
+        self.transactions = self.items_sold = 0
+        self.total_amount = self.total_profit = 0
+
+    def rows(self):
+        for sale_id in self.sale_ids:
+            sale = self.sales[sale_id]
+            battery = self.inventory.get(sale["battery_id"], self.unknown_battery)
+            sale_date = _as_datetime(sale["sale_date"])
+            self.transactions += 1
+            self.items_sold += sale["quantity_sold"]
+            self.total_amount += sale["total_amount"]
+            self.total_profit += sale["total_profit"]
+            yield [
+                sale_date.strftime(DATE_FORMAT),
+                sale_date.strftime(TIME_FORMAT),
+                f"#{sale['id'][-8:].upper()}",
+                f"{battery['brand']} {battery['capacity']} {battery['model']}",
+                sale["quantity_sold"],
+                sale["unit_price"],
+                sale["total_amount"],
+                sale["profit_per_unit"],
+                sale["total_profit"],
+                sale.get("customer_name") or "Walk-in Customer",
+                sale.get("customer_phone") or "N/A"
+            ]
+
+    def summary(self):
+        """Only complete once rows() has been exhausted."""
+        average = round(self.total_amount / self.transactions) if self.transactions else 0
+        return [
+            ("Total Transactions", self.transactions),
+            ("Total Items Sold", self.items_sold),
+            ("Total Sales Amount (Rs)", self.total_amount),
+            ("Total Profit (Rs)", self.total_profit),
+            ("Average Sale Amount (Rs)", average)
+        ]
+
+
+class InventoryReport:
+    title = "INVENTORY REPORT"
+    columns = (
+        "Brand", "Capacity", "Model", "Stock Quantity", "Purchase Price (Rs)", "Selling Price (Rs)",
+        "Stock Value (Rs)", "Potential Revenue (Rs)", "Profit per Unit (Rs)", "Low Stock Alert",
+        "Warranty (Months)", "Supplier", "Date Added"
+    )
+    pdf_columns = (
+        ("Brand", 16, False, lambda row: row[0]),
+        ("Capacity", 10, False, lambda row: row[1]),
+        ("Model", 18, False, lambda row: row[2]),
+        ("Stock", 7, True, lambda row: str(row[3])),
+        ("Buy Price", 16, True, lambda row: _money(row[4])),
+        ("Sell Price", 16, True, lambda row: _money(row[5])),
+        ("Stock Value", 18, True, lambda row: _money(row[6])),
+        ("Supplier", 24, False, lambda row: row[11])
+    )
+
+    def __init__(self, item_ids, inventory: dict):
+        self.item_ids = item_ids
+        self.inventory = inventory
+        self.unique_items = self.low_stock_items = 0
+        self.stock_value = self.potential_revenue = 0
+
+    def rows(self):
+        for item_id in self.item_ids:
+            item = self.inventory.get(item_id)
+            if item is None:
+                # Deleted while the export was streaming
+                continue
+            stock_value = item["stock_quantity"] * item["purchase_price"]
+            potential_revenue = item["stock_quantity"] * item["selling_price"]
+            self.unique_items += 1
+            self.stock_value += stock_value
+            self.potential_revenue += potential_revenue
+            self.low_stock_items += item["stock_quantity"] <= item["low_stock_alert"]
+            yield [
+                item["brand"],
+                item["capacity"],
+                item["model"],
+                item["stock_quantity"],
+                item["purchase_price"],
+                item["selling_price"],
+                stock_value,
+                potential_revenue,
+                item["selling_price"] - item["purchase_price"],
+                item["low_stock_alert"],
+                item["warranty_months"],
+                item.get("supplier") or "N/A",
+                _as_datetime(item["date_added"]).strftime(DATE_FORMAT)
+            ]
+
+    def summary(self):
+        return [
+            ("Total Unique Items", self.unique_items),
+            ("Total Stock Value (Rs)", self.stock_value),
+            ("Total Potential Revenue (Rs)", self.potential_revenue),
+            ("Low Stock Items", self.low_stock_items)
+        ]
+
+
+def _batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == EXPORT_CHUNK_ROWS:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ===== CSV =====
+
+def stream_csv(report):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # The byte order mark makes Excel open the file as UTF-8
+    buffer.write("\ufeff")
+    writer.writerow(report.columns)
+    for batch in _batches(report.rows()):
+        writer.writerows(batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    writer.writerow([])
+    writer.writerows(report.summary())
+    yield buffer.getvalue().encode("utf-8")
+
+
+# ===== XLSX =====
+
+class _ChunkSink:
+    """Write-only file object whose contents are handed out and dropped as they are written."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+_XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+_ILLEGAL_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_SHEET_NAMES = ("Report", "Summary")
+
+_CONTENT_TYPES = _XML_HEADER + (
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    + "".join(
+        f'<Override PartName="/xl/worksheets/sheet{n}.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for n in range(1, len(_SHEET_NAMES) + 1)
+    )
+    + '</Types>'
+)
+_ROOT_RELS = _XML_HEADER + (
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/></Relationships>'
+)
+_WORKBOOK = _XML_HEADER + (
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>'
+    + "".join(
+        f'<sheet name="{name}" sheetId="{n}" r:id="rId{n}"/>' for n, name in enumerate(_SHEET_NAMES, 1)
+    )
+    + '</sheets></workbook>'
+)
+_WORKBOOK_RELS = _XML_HEADER + (
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    + "".join(
+        f'<Relationship Id="rId{n}" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        f'Target="worksheets/sheet{n}.xml"/>'
+        for n in range(1, len(_SHEET_NAMES) + 1)
+    )
+    + '</Relationships>'
+)
+_SHEET_START = _XML_HEADER + (
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_SHEET_END = '</sheetData></worksheet>'
+
+
+def _xlsx_row(cells) -> str:
+    parts = []
+    for cell in cells:
+        if isinstance(cell, (int, float)) and not isinstance(cell, bool):
+            parts.append(f"<c><v>{cell}</v></c>")
+        else:
+            text = escape(_ILLEGAL_XML_CHARS.sub("", str(cell)))
+            parts.append(f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+    return "<row>" + "".join(parts) + "</row>"
+
+
+def stream_xlsx(report):
+    sink = _ChunkSink()
+    # An unseekable sink makes zipfile stream every entry with a trailing data descriptor
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as workbook:
+        workbook.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        workbook.writestr("_rels/.rels", _ROOT_RELS)
+        workbook.writestr("xl/workbook.xml", _WORKBOOK)
+        workbook.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        with workbook.open("xl/worksheets/sheet1.xml", "w") as sheet:
+            sheet.write((_SHEET_START + _xlsx_row(report.columns)).encode("utf-8"))
+            for batch in _batches(report.rows()):
+                sheet.write("".join(_xlsx_row(row) for row in batch).encode("utf-8"))
+                yield sink.drain()
+            sheet.write(_SHEET_END.encode("utf-8"))
+        summary = _SHEET_START + "".join(_xlsx_row(pair) for pair in report.summary()) + _SHEET_END
+        workbook.writestr("xl/worksheets/sheet2.xml", summary)
+    yield sink.drain()
+
+
+# ===== PDF =====
+
+PDF_PAGE_WIDTH, PDF_PAGE_HEIGHT = 842, 595  # A4 landscape, in points
+PDF_MARGIN = 36
+PDF_FONT_SIZE = 8
+PDF_LEADING = 10
+PDF_LINES_PER_PAGE = (PDF_PAGE_HEIGHT - 2 * PDF_MARGIN - 2 * PDF_LEADING) // PDF_LEADING
+
+
+def _pdf_text(text: str) -> bytes:
+    text = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return b"(" + text.encode("latin-1", "replace") + b")"
+
+
+def _pdf_table_line(columns, cells) -> str:
+    parts = []
+    for (_, width, right_aligned, _), cell in zip(columns, cells):
+        cell = str(cell)[:width]
+        parts.append(cell.rjust(width) if right_aligned else cell.ljust(width))
+    return " ".join(parts).rstrip()
+
+
+def _pdf_lines(report, shop_config: dict, period):
+    """(text, bold) lines of the whole report; the summary is only built after the rows."""
+    for field in ("shop_name", "proprietor_name", "contact_number", "address"):
+        yield shop_config.get(field) or "", field == "shop_name"
+    yield "", False
+    yield report.title, True
+    yield f"Generated on: {datetime.now().strftime(DATE_FORMAT)}", False
+    if period:
+        yield f"Period: {period}", False
+    yield "", False
+    columns = report.pdf_columns
+    yield _pdf_table_line(columns, [header for header, _, _, _ in columns]), True
+    for row in report.rows():
+        yield _pdf_table_line(columns, [cell(row) for _, _, _, cell in columns]), False
+    yield "", False
+    yield "SUMMARY", True
+    for label, value in report.summary():
+        yield f"{label}: {value:,}" if isinstance(value, (int, float)) else f"{label}: {value}", False
+
+
+def _pdf_page_content(lines) -> bytes:
+    top = PDF_PAGE_HEIGHT - PDF_MARGIN
+    content = [b"BT %d TL %d %d Td" % (PDF_LEADING, PDF_MARGIN, top)]
+    for text, bold in lines:
+        content.append(b"/%s %d Tf %s Tj T*" % (b"F2" if bold else b"F1", PDF_FONT_SIZE, _pdf_text(text)))
+    content.append(b"ET")
+    content.append(b"BT /F1 %d Tf %d %d Td %s Tj ET" % (
+        PDF_FONT_SIZE - 1, PDF_MARGIN, PDF_MARGIN // 2, _pdf_text(FOOTER)
+    ))
+    return b"\n".join(content)
+
+
+def stream_pdf(report, shop_config: dict, period=None):
+    """Writes one page per PDF_LINES_PER_PAGE lines of monospaced text."""
+    offsets = {}
+    position = 0
+
+    def pdf_object(number: int, body: bytes) -> bytes:
+        nonlocal position
+        data = b"%d 0 obj\n%s\nendobj\n" % (number, body)
+        offsets[number] = position
+        position += len(data)
+        return data
+
+    header = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+    position = len(header)
+    # Object 2, the page tree, is written last once every page is known
+    yield header + b"".join([
+        pdf_object(1, b"<< /Type /Catalog /Pages 2 0 R >>"),
+        pdf_object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>"),
+        pdf_object(4, b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier-Bold /Encoding /WinAnsiEncoding >>")
+    ])
+
+    page_numbers = []
+    next_number = 5
+    page = []
+    lines = _pdf_lines(report, shop_config, period)
+    while True:
+        line = next(lines, None)
+        if line is not None:
+            page.append(line)
+        if page and (line is None or len(page) == PDF_LINES_PER_PAGE):
+            content = _pdf_page_content(page)
+            chunk = pdf_object(next_number, b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+            chunk += pdf_object(next_number + 1, (
+                b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+                b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>"
+            ) % (PDF_PAGE_WIDTH, PDF_PAGE_HEIGHT, next_number))
+            page_numbers.append(next_number + 1)
+            next_number += 2
+            page = []
+            yield chunk
+        if line is None:
+            break
+
+    kids = b" ".join(b"%d 0 R" % number for number in page_numbers)
+    tail = pdf_object(2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_numbers)))
+    xref_position = position
+    tail += b"xref\n0 %d\n0000000000 65535 f \n" % next_number
+    tail += b"".join(b"%010d 00000 n \n" % offsets[number] for number in range(1, next_number))
+    tail += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (next_number, xref_position)
+    yield tail
+
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+    "pdf": ("application/pdf", "pdf")
+}
+
+
+def stream_report(report, export_format: str, shop_config: dict, period=None):
+    if export_format == "csv":
+        return stream_csv(report)
+    if export_format == "xlsx":
+        return stream_xlsx(report)
+    return stream_pdf(report, shop_config, period)
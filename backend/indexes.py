@@ -0,0 +1,512 @@
+"""
+In-memory indexes kept alongside the stores in server.py.
+
+The stores stay the source of truth; every index here is updated incrementally by the
+endpoints that mutate the underlying records and can be rebuilt from the stores at startup.
+"""
+
+import asyncio
+import base64
+import bisect
+import time
+import weakref
+from collections import OrderedDict
+from datetime import datetime
+from events import ShopEvents, change_event
+
+SEARCH_FIELDS = ("shop_name", "proprietor_name", "contact_number", "address")
+# Ranking weight of a match in each field; an exact shop id match outranks everything
+FIELD_WEIGHTS = {"shop_id": 16, "shop_name": 8, "proprietor_name": 4, "contact_number": 2, "address": 1}
+GRAM_SIZE = 3
+# Bucket key format per rollup granularity; the keys sort chronologically as strings
+ROLLUP_GRANULARITIES = {"hourly": "%Y-%m-%dT%H", "daily": "%Y-%m-%d", "monthly": "%Y-%m"}
+
+
+def ngrams(text: str, n: int = GRAM_SIZE) -> set:
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class ShopSearchIndex:
+    """Substring search over shop details backed by a trigram inverted index.
+
+    A query only visits the shops that contain every trigram of the search term, then
+    confirms the substring match and ranks the survivors. Terms shorter than a trigram
+    are inherently broad and fall back to scanning the cached lowercase texts.
+    """
+
+    def __init__(self):
+        self._postings = {}  # trigram -> set of shop ids
+        self._fields = {}  # shop id -> {field: lowercase text}
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __contains__(self, shop_id):
+        return shop_id in self._fields
+
+    def add(self, shop_id: str, shop_config: dict):
+        """Indexes a shop, replacing whatever was indexed for it before."""
+        self.remove(shop_id)
+        fields = {field: str(shop_config.get(field) or "").lower() for field in SEARCH_FIELDS}
+        fields["shop_id"] = shop_id.lower()
+        self._fields[shop_id] = fields
+        for gram in ngrams(self._searchable_text(fields)):
+            self._postings.setdefault(gram, set()).add(shop_id)
+
+    def remove(self, shop_id: str):
+        fields = self._fields.pop(shop_id, None)
+        if fields is None:
+            return
+        for gram in ngrams(self._searchable_text(fields)):
+            shop_ids = self._postings.get(gram)
+            if shop_ids is not None:
+                shop_ids.discard(shop_id)
+                if not shop_ids:
+                    del self._postings[gram]
+
+    def search(self, term: str, limit: int = 50, offset: int = 0):
+        """Returns the total number of matches and the ranked shop ids for one page."""
+        term = term.lower()
+        if len(term) < GRAM_SIZE:
+            candidates = self._fields.keys()
+        else:
+            postings = sorted((self._postings.get(gram, set()) for gram in ngrams(term)), key=len)
+            candidates = postings[0].intersection(*postings[1:])
+
+        matches = []
+        for shop_id in candidates:
+            fields = self._fields[shop_id]
+            score = self._score(fields, term)
+            if score:
+                matches.append((-score, fields["shop_name"], shop_id))
+        matches.sort()
+        return len(matches), [shop_id for _, _, shop_id in matches[offset:offset + limit]]
+
+    @staticmethod
+    def _searchable_text(fields: dict) -> str:
+        # The text the linear search matched against, with the shop id kept apart so
+        # no trigram spans the boundary between the address and the id
+        return " ".join(fields[field] for field in SEARCH_FIELDS) + "\x00" + fields["shop_id"]
+
+    @classmethod
+    def _score(cls, fields: dict, term: str) -> float:
+        score = 0
+        for field, text in fields.items():
+            if term in text:
+                weight = FIELD_WEIGHTS[field]
+                score += weight * (3 if text == term else 2 if text.startswith(term) else 1)
+        if not score and term in cls._searchable_text(fields):
+            # Matches spanning two fields still count, just below any single-field match
+            score = 0.5
+        return score
+
+
+class LRUCache:
+    """Keeps the ``capacity`` most recently used records, evicting the least recently used."""
+
+    def __init__(self, capacity: int, on_evict=None):
+        self.capacity = capacity
+        self.on_evict = on_evict
+        self._records = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, key):
+        return key in self._records
+
+    def get(self, key):
+        record = self._records.get(key)
+        if record is None:
+            self.stats["misses"] += 1
+            return None
+        self._records.move_to_end(key)
+        self.stats["hits"] += 1
+        return record
+
+    def peek(self, key):
+        """Like get(), without counting as a use."""
+        return self._records.get(key)
+
+    def put(self, key, record):
+        self._records[key] = record
+        self._records.move_to_end(key)
+        while len(self._records) > self.capacity:
+            evicted_key, evicted = self._records.popitem(last=False)
+            self.stats["evictions"] += 1
+            if self.on_evict is not None:
+                self.on_evict(evicted_key, evicted)
+
+    def pop(self, key):
+        return self._records.pop(key, None)
+
+
+class DashboardAggregates:
+    """Running inventory and sales totals behind /api/dashboard.
+
+    Endpoints that add, change or delete a battery item, or record a sale, report the
+    change here, so reading the dashboard never iterates the stores.
+    """
+
+    TOP_SELLING_SIZE = 5
+
+    def __init__(self):
+        self.total_items = 0
+        self.total_stock = 0
+        self.inventory_value = 0.0
+        self.sales_count = 0
+        self.sales_amount = 0.0
+        self.total_profit = 0.0
+        self.sold_quantities = {}  # battery id -> total quantity sold
+        self.top_selling = []  # battery ids still in inventory, most sold first
+        self._item_ids = set()
+
+    def add_item(self, item: dict):
+        self.total_items += 1
+        self.total_stock += item["stock_quantity"]
+        self.inventory_value += item["stock_quantity"] * item["purchase_price"]
+        self._item_ids.add(item["id"])
+
+    def remove_item(self, item: dict):
+        self.total_items -= 1
+        self.total_stock -= item["stock_quantity"]
+        self.inventory_value -= item["stock_quantity"] * item["purchase_price"]
+        self._item_ids.discard(item["id"])
+
+    def replace_item(self, old_item: dict, new_item: dict):
+        """Accounts for an edit or stock change of an item that stays in inventory."""
+        self.remove_item(old_item)
+        self.add_item(new_item)
+
+    def delete_item(self, item: dict):
+        """Drops a deleted item, promoting the next best seller into the top list."""
+        self.remove_item(item)
+        if item["id"] in self.top_selling:
+            self.top_selling.remove(item["id"])
+            # Only deletions need a scan; sales can only move an item up
+            runners_up = [
+                battery_id for battery_id in self.sold_quantities
+                if battery_id in self._item_ids and battery_id not in self.top_selling
+            ]
+            runners_up.sort(key=self.sold_quantities.get, reverse=True)
+            self.top_selling.extend(runners_up[:self.TOP_SELLING_SIZE - len(self.top_selling)])
+
+    def add_sale(self, sale: dict):
+        self.sales_count += 1
+        self.sales_amount += sale["total_amount"]
+        self.total_profit += sale["total_profit"]
+
+        battery_id = sale["battery_id"]
+        quantity = self.sold_quantities.get(battery_id, 0) + sale["quantity_sold"]
+        self.sold_quantities[battery_id] = quantity
+        if battery_id not in self._item_ids:
+            return
+        # Quantities only grow, so an item outside the top list can never outrank its
+        # last entry without being the one that just sold
+        if battery_id not in self.top_selling:
+            if len(self.top_selling) < self.TOP_SELLING_SIZE:
+                self.top_selling.append(battery_id)
+            elif quantity > self.sold_quantities[self.top_selling[-1]]:
+                self.top_selling[-1] = battery_id
+            else:
+                return
+        self.top_selling.sort(key=self.sold_quantities.get, reverse=True)
+
+
+class LowStockIndex:
+    """Items at or below their low-stock alert, ordered by how far below it they are.
+
+    Kept sorted on every stock or threshold change, so reading the k most urgent
+    items is a slice rather than a scan of the inventory.
+    """
+
+    def __init__(self):
+        self._entries = []  # sorted (stock_quantity - low_stock_alert, item id)
+        self._keys = {}  # item id -> its entry
+
+    def __len__(self):
+        return len(self._entries)
+
+    def update(self, item: dict):
+        """Re-files an item after it was added or its stock or alert level changed."""
+        self.remove(item["id"])
+        if item["stock_quantity"] <= item["low_stock_alert"]:
+            entry = (item["stock_quantity"] - item["low_stock_alert"], item["id"])
+            bisect.insort(self._entries, entry)
+            self._keys[item["id"]] = entry
+
+    def remove(self, item_id: str):
+        entry = self._keys.pop(item_id, None)
+        if entry is not None:
+            del self._entries[bisect.bisect_left(self._entries, entry)]
+
+    def most_urgent(self, limit: int = None) -> list:
+        """Ids of the ``limit`` items furthest below their alert level (all when omitted)."""
+        entries = self._entries if limit is None else self._entries[:limit]
+        return [item_id for _, item_id in entries]
+
+
+def as_datetime(value) -> datetime:
+    """Sale dates are datetimes in memory but ISO strings once they have been persisted."""
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+def empty_sales_totals() -> dict:
+    return {"sales_count": 0, "total_amount": 0.0, "total_profit": 0.0, "quantity_sold": 0}
+
+
+def add_sale_to_totals(totals: dict, sale: dict):
+    totals["sales_count"] += 1
+    totals["total_amount"] += sale["total_amount"]
+    totals["total_profit"] += sale["total_profit"]
+    totals["quantity_sold"] += sale["quantity_sold"]
+
+
+def merge_sales_totals(into: dict, totals: dict):
+    for field, value in totals.items():
+        into[field] += value
+
+
+class SalesRollups:
+    """Hourly, daily and monthly sales totals, broken down by battery and by brand.
+
+    Each recorded sale is added to one bucket per granularity, so a date-range summary
+    reads one bucket per period instead of every sale in the range.
+    """
+
+    def __init__(self):
+        self._buckets = {granularity: {} for granularity in ROLLUP_GRANULARITIES}
+        self._keys = {granularity: [] for granularity in ROLLUP_GRANULARITIES}  # sorted bucket keys
+        self.battery_labels = {}  # battery id -> "Brand Capacity Model" at the time of sale
+
+    def add_sale(self, sale: dict, battery: dict):
+        sale_date = as_datetime(sale["sale_date"])
+        self.battery_labels[sale["battery_id"]] = f"{battery['brand']} {battery['capacity']} {battery['model']}"
+        for granularity, key_format in ROLLUP_GRANULARITIES.items():
+            key = sale_date.strftime(key_format)
+            bucket = self._buckets[granularity].get(key)
+            if bucket is None:
+                bucket = {"totals": empty_sales_totals(), "by_battery": {}, "by_brand": {}}
+                self._buckets[granularity][key] = bucket
+                bisect.insort(self._keys[granularity], key)
+            add_sale_to_totals(bucket["totals"], sale)
+            add_sale_to_totals(bucket["by_battery"].setdefault(sale["battery_id"], empty_sales_totals()), sale)
+            add_sale_to_totals(bucket["by_brand"].setdefault(battery["brand"], empty_sales_totals()), sale)
+
+    def summary(self, granularity: str, start: datetime = None, end: datetime = None) -> dict:
+        """Per-period totals plus range-wide totals by battery and brand.
+
+        A period is included when it overlaps [start, end]; either bound may be omitted.
+        """
+        key_format = ROLLUP_GRANULARITIES[granularity]
+        keys = self._keys[granularity]
+        first = bisect.bisect_left(keys, start.strftime(key_format)) if start else 0
+        last = bisect.bisect_right(keys, end.strftime(key_format)) if end else len(keys)
+
+        periods = []
+        totals = empty_sales_totals()
+        by_battery = {}
+        by_brand = {}
+        for key in keys[first:last]:
+            bucket = self._buckets[granularity][key]
+            periods.append({"period": key, **bucket["totals"]})
+            merge_sales_totals(totals, bucket["totals"])
+            for battery_id, battery_totals in bucket["by_battery"].items():
+                merge_sales_totals(by_battery.setdefault(battery_id, empty_sales_totals()), battery_totals)
+            for brand, brand_totals in bucket["by_brand"].items():
+                merge_sales_totals(by_brand.setdefault(brand, empty_sales_totals()), brand_totals)
+
+        return {
+            "granularity": granularity,
+            "periods": periods,
+            "totals": totals,
+            "by_battery": sorted(
+                ({"battery_id": battery_id, "battery": self.battery_labels.get(battery_id), **battery_totals}
+                 for battery_id, battery_totals in by_battery.items()),
+                key=lambda row: row["total_amount"], reverse=True
+            ),
+            "by_brand": sorted(
+                ({"brand": brand, **brand_totals} for brand, brand_totals in by_brand.items()),
+                key=lambda row: row["total_amount"], reverse=True
+            )
+        }
+
+
+class SaleDateIndex:
+    """Sale ids ordered by (sale_date, id), read newest first with keyset pagination.
+
+    A cursor is the position of the last sale on a page, so fetching the next page
+    costs a binary search plus the page itself, however many sales came before it.
+    """
+
+    def __init__(self):
+        self._entries = []  # sorted (sale_date, sale_id)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, sale: dict):
+        # Sales arrive in date order, so this almost always lands at the end
+        bisect.insort(self._entries, (as_datetime(sale["sale_date"]), sale["id"]))
+
+    def page(self, limit: int, cursor: str = None, start: datetime = None, end: datetime = None):
+        """Returns up to ``limit`` sale ids, newest first, and the cursor for the next page."""
+        lower = bisect.bisect_left(self._entries, (start, "")) if start else 0
+        upper = bisect.bisect_right(self._entries, (end, "\uffff")) if end else len(self._entries)
+        if cursor:
+            upper = min(upper, bisect.bisect_left(self._entries, self.decode_cursor(cursor)))
+
+        first = max(lower, upper - limit)
+        entries = self._entries[first:upper][::-1]
+        next_cursor = self.encode_cursor(entries[-1]) if entries and first > lower else None
+        return [sale_id for _, sale_id in entries], next_cursor
+
+    def iter_range(self, start: datetime = None, end: datetime = None, batch_size: int = 500):
+        """Yields sale ids oldest first, one batch of the index at a time.
+
+        Each batch is found by bisecting past the last entry yielded, so sales recorded
+        while a long export is streaming never shift, repeat or skip entries.
+        """
+        last = None
+        while True:
+            if last is not None:
+                lower = bisect.bisect_right(self._entries, last)
+            else:
+                lower = bisect.bisect_left(self._entries, (start, "")) if start else 0
+            upper = bisect.bisect_right(self._entries, (end, "\uffff")) if end else len(self._entries)
+            batch = self._entries[lower:min(upper, lower + batch_size)]
+            if not batch:
+                return
+            for _, sale_id in batch:
+                yield sale_id
+            last = batch[-1]
+
+    @staticmethod
+    def encode_cursor(entry) -> str:
+        sale_date, sale_id = entry
+        return base64.urlsafe_b64encode(f"{sale_date.isoformat()}|{sale_id}".encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str):
+        """Raises ValueError for a cursor this index did not produce."""
+        try:
+            sale_date, sale_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+            sale_date = datetime.fromisoformat(sale_date)
+            # Sale dates are naive, and comparing an aware datetime with them raises TypeError
+            if sale_date.tzinfo is not None:
+                raise ValueError("Cursor date has a UTC offset")
+            return sale_date, sale_id
+        except (ValueError, UnicodeDecodeError):
+            raise ValueError("Invalid cursor")
+
+
+class ChangeLog:
+    """Per-shop change sequence for delta sync.
+
+    Every record keeps the sequence number of its last change, and a delete leaves a
+    tombstone. Entries are kept in change order, so the changes after a sequence are
+    read backwards from the end. Sequences start at the boot time in microseconds and
+    keep increasing across restarts. The horizon is the sequence once the stores have
+    loaded; a client that last synced before it gets a full reset instead of a delta.
+    """
+
+    def __init__(self):
+        self.sequence = time.time_ns() // 1000
+        self.horizon = self.sequence
+        self._entries = OrderedDict()  # (collection, record id) -> (sequence, record or None)
+
+    def record(self, collection: str, record_id: str, record):
+        """Notes a change to a record; None marks a delete."""
+        self.sequence += 1
+        key = (collection, record_id)
+        self._entries[key] = (self.sequence, record)
+        self._entries.move_to_end(key)
+
+    def mark_horizon(self):
+        self.horizon = self.sequence
+
+    def since(self, sequence: int):
+        """(collection, record id, record) changed after ``sequence``, oldest first.
+
+        Returns None when a reset is needed: ``sequence`` is older than the horizon, or
+        newer than any sequence issued, e.g. after the clock stepped back across a restart.
+        """
+        if sequence < self.horizon or sequence > self.sequence:
+            return None
+        changes = []
+        for (collection, record_id), (changed_at, record) in reversed(self._entries.items()):
+            if changed_at <= sequence:
+                break
+            changes.append((collection, record_id, record))
+        changes.reverse()
+        return changes
+
+    def live_records(self):
+        """Every record that currently exists, for a full reset."""
+        return [
+            (collection, record_id, record)
+            for (collection, record_id), (_, record) in self._entries.items()
+            if record is not None
+        ]
+
+
+class ShopPartition:
+    """One shop's inventory and sales together with every index maintained over them.
+
+    All changes go through these methods so the indexes never drift from the records.
+    """
+
+    def __init__(self):
+        self.inventory = {}  # item id -> battery item
+        self.sales = {}  # sale id -> sale
+        self.dashboard = DashboardAggregates()
+        self.low_stock = LowStockIndex()
+        self.rollups = SalesRollups()
+        self.sale_dates = SaleDateIndex()
+        self.changes = ChangeLog()
+        self.events = ShopEvents()
+        # item id -> asyncio.Lock; a lock only lives while a request holds or awaits it, so
+        # writes to ids that turn out not to exist leave nothing behind
+        self._item_locks = weakref.WeakValueDictionary()
+
+    def item_lock(self, item_id: str) -> asyncio.Lock:
+        """Serializes writes to one item; reads and writes to other items never wait on it."""
+        lock = self._item_locks.get(item_id)
+        if lock is None:
+            lock = self._item_locks[item_id] = asyncio.Lock()
+        return lock
+
+    def add_item(self, item: dict):
+        self.inventory[item["id"]] = item
+        self.dashboard.add_item(item)
+        self.low_stock.update(item)
+        self._changed("inventory", item["id"], item)
+
+    def replace_item(self, item: dict):
+        """Stores a new version of an existing item (an edit or a stock change)."""
+        old_item = self.inventory[item["id"]]
+        self.inventory[item["id"]] = item
+        self.dashboard.replace_item(old_item, item)
+        self.low_stock.update(item)
+        self._changed("inventory", item["id"], item)
+
+    def delete_item(self, item_id: str) -> dict:
+        item = self.inventory.pop(item_id)
+        # Item ids are never reused; anyone still queued on the lock re-checks and finds it gone
+        self._item_locks.pop(item_id, None)
+        self.dashboard.delete_item(item)
+        self.low_stock.remove(item_id)
+        self._changed("inventory", item_id, None)
+        return item
+
+    def add_sale(self, sale: dict, battery: dict):
+        self.sales[sale["id"]] = sale
+        self.dashboard.add_sale(sale)
+        self.rollups.add_sale(sale, battery)
+        self.sale_dates.add(sale)
+        self._changed("sales", sale["id"], sale)
+
+    def _changed(self, collection: str, record_id: str, record):
+        self.changes.record(collection, record_id, record)
+        self.events.publish(change_event(self.changes.sequence, collection, record_id, record))
@@ -0,0 +1,148 @@
+"""
+Bulk inventory import from uploaded CSV and Excel files.
+
+Uploads are read in chunks of ``IMPORT_CHUNK_ROWS`` rows and every chunk is validated
+column by column with vectorized pandas operations against the fields of the item
+model, so a file with thousands of SKUs never goes through per-row validation. Rows
+that fail are reported with their spreadsheet row number; the rest are returned as
+item dicts ready to be stored. pandas is imported on first use so the server starts
+without it.
+"""
+
+from zipfile import BadZipFile
+
+IMPORT_CHUNK_ROWS = 1000
+# Set by the server, never taken from the file. An id column is read but only used to
+# match an existing item of the same shop.
+SERVER_FIELDS = ("shop_id", "date_added")
+EXCEL_EXTENSIONS = (".xlsx", ".xlsm")
+
+
+def normalize_column(name) -> str:
+    """'Stock Quantity' and ' stock_quantity' both name the stock_quantity field."""
+    return str(name).strip().lower().replace(" ", "_")
+
+
+def import_fields(model) -> dict:
+    """Field name -> (type, required, default) for every model field a file may set."""
+    fields = {}
+    for name, field in model.model_fields.items():
+        if name in SERVER_FIELDS:
+            continue
+        annotation = field.annotation
+        kind = next(
+            (t for t in (int, float, str) if annotation is t or t in getattr(annotation, "__args__", ())),
+            str
+        )
+        fields[name] = (kind, field.is_required(), None if field.is_required() else field.default)
+    return fields
+
+
+def _csv_chunks(file):
+    import pandas as pd
+    # Everything is read as text; validate_chunk does the type conversion. Blank lines are
+    # kept (and dropped by validate_chunk) so row numbers still match the file.
+    yield from pd.read_csv(file, chunksize=IMPORT_CHUNK_ROWS, dtype=str, skip_blank_lines=False)
+
+
+def _excel_chunks(file):
+    import pandas as pd
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+    # Read-only mode streams rows from the sheet instead of loading the whole workbook
+    try:
+        workbook = load_workbook(file, read_only=True, data_only=True)
+    except (BadZipFile, InvalidFileException, KeyError):
+        # A damaged workbook, or another kind of file renamed to .xlsx
+        raise ValueError("The uploaded file is not a valid Excel workbook")
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        batch, start = [], 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) == IMPORT_CHUNK_ROWS:
+                yield pd.DataFrame(batch, columns=header, index=range(start, start + len(batch)))
+                start += len(batch)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=header, index=range(start, start + len(batch)))
+    finally:
+        workbook.close()
+
+
+def read_upload_chunks(file, filename: str):
+    """Yields DataFrames of at most IMPORT_CHUNK_ROWS rows, indexed by data row (0 = first)."""
+    extension = filename.lower().rsplit(".", 1)[-1] if "." in filename else ""
+    if "." + extension in EXCEL_EXTENSIONS:
+        return _excel_chunks(file)
+    if extension == "csv":
+        return _csv_chunks(file)
+    raise ValueError("Upload a .csv or .xlsx file")
+
+
+def validate_chunk(chunk, fields: dict):
+    """Validates one chunk and returns (valid rows as dicts, {row number: [errors]})."""
+    import pandas as pd
+    chunk = chunk.rename(columns=normalize_column).dropna(how="all")
+    values = pd.DataFrame(index=chunk.index)
+    problems = []  # (boolean mask over the chunk, message)
+    for name, (kind, required, default) in fields.items():
+        if name not in chunk.columns:
+            values[name] = default
+            continue
+        text = chunk[name].astype("string").str.strip()
+        missing = text.isna() | (text == "")
+        if kind is str:
+            column = text
+        else:
+            column = pd.to_numeric(text, errors="coerce")
+            invalid = ~missing & (column.isna() | (column < 0))
+            if kind is int:
+                invalid |= ~missing & (column % 1 != 0)
+            problems.append((invalid, f"{name} must be a non-negative {'whole number' if kind is int else 'number'}"))
+        if required:
+            problems.append((missing, f"{name} is required"))
+        else:
+            column = column.mask(missing, default)
+        values[name] = column
+
+    rejected = pd.Series(False, index=chunk.index)
+    errors = {}
+    for mask, message in problems:
+        mask = mask.fillna(False).astype(bool)
+        rejected |= mask
+        for position in mask[mask].index:
+            # Spreadsheet row numbers: the header is row 1
+            errors.setdefault(int(position) + 2, []).append(message)
+
+    valid = values[~rejected]
+    for name, (kind, _, _) in fields.items():
+        if kind is int:
+            valid[name] = valid[name].astype("int64")
+        elif kind is float:
+            valid[name] = valid[name].astype("float64")
+    valid = valid.astype(object).where(valid.notna(), None)
+    return valid.to_dict("records"), errors
+
+
+def parse_inventory_upload(file, filename: str, model):
+    """Reads and validates a whole upload, returning (valid rows, per-row errors, rows read).
+
+    Raises ValueError for an unsupported or unreadable file, or a file missing required columns.
+    """
+    fields = import_fields(model)
+    required = [name for name, (_, is_required, _) in fields.items() if is_required]
+    rows, errors, rows_read = [], {}, 0
+    for chunk in read_upload_chunks(file, filename):
+        columns = {normalize_column(column) for column in chunk.columns}
+        missing_columns = [name for name in required if name not in columns]
+        if missing_columns:
+            raise ValueError(f"Missing required columns: {', '.join(missing_columns)}")
+        chunk_rows, chunk_errors = validate_chunk(chunk, fields)
+        rows.extend(chunk_rows)
+        errors.update(chunk_errors)
+        rows_read += len(chunk.dropna(how="all"))
+    return rows, [{"row": row, "errors": messages} for row, messages in sorted(errors.items())], rows_read
@@ -0,0 +1,167 @@
+"""
+MongoDB storage backend (``STORAGE_BACKEND=mongodb``) on top of motor.
+
+Each data store is a collection of documents ``{_id: record id, <indexed fields>, data}``
+where ``data`` is the Fernet-encrypted key and record, the same layout as the SQLite
+backend: the database can index and filter on shop_id, sale_date and battery_id but
+never holds a readable record or key. One motor client, and so one connection pool,
+serves the whole process.
+"""
+
+import asyncio
+import json
+from datetime import datetime
+from bson.binary import Binary
+from cryptography.fernet import InvalidToken
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DeleteOne, ReplaceOne, UpdateOne
+from storage import json_default
+from storage_backends import INDEXED_FIELDS, PUBLIC_FIELDS, STORE_INDEXES, indexed_value
+
+
+class MongoBackend:
+    """All data stores in one MongoDB database, one collection per store.
+
+    A commit is one unordered bulk write per collection, acknowledged only once it is
+    in the server's journal. When the server is a replica set or sharded cluster the
+    whole commit runs in a transaction, so a sale and its stock change are written
+    together or not at all; a standalone mongod writes the collections one after
+    another. ``client_factory`` replaces AsyncIOMotorClient, e.g. with a test fake.
+    """
+
+    name = "mongodb"
+
+    def __init__(self, url: str, db_name: str, cipher, max_pool_size: int = 50, client_factory=None):
+        self.url = url
+        self.db_name = db_name
+        self.cipher = cipher
+        self.max_pool_size = max_pool_size
+        self.client_factory = client_factory or AsyncIOMotorClient
+        self.client = None
+        self.db = None
+        self.transactions = False
+        self.commit_stats = {"commits": 0, "entries": 0, "transactions": 0}
+        self._commits_in_flight = set()  # futures of running commits, see reencrypt()
+
+    async def open(self):
+        """Connects and creates the indexes; motor binds the client to the running loop."""
+        self.client = self.client_factory(self.url, maxPoolSize=self.max_pool_size, journal=True)
+        self.db = self.client[self.db_name]
+        hello = await self.client.admin.command("hello")
+        self.transactions = "setName" in hello or hello.get("msg") == "isdbgrid"
+        for store, indexes in STORE_INDEXES.items():
+            for index in indexes:
+                await self.db[store].create_index([(field, ASCENDING) for field in index])
+
+    def _document(self, store: str, key: str, record: dict) -> dict:
+        document = {"_id": self.cipher.record_id(key)}
+        for field in INDEXED_FIELDS[store]:
+            document[field] = indexed_value(record.get(field))
+        entry = json.dumps({"key": key, "value": record}, default=json_default).encode('utf-8')
+        document["data"] = Binary(self.cipher.encrypt(entry))
+        return document
+
+    async def load(self, store: str) -> dict:
+        records = {}
+        async for document in self.db[store].find({}, {"data": 1}):
+            try:
+                entry = json.loads(self.cipher.decrypt(bytes(document["data"])))
+            except (InvalidToken, json.JSONDecodeError):
+                print(f"⚠️  Skipping unreadable {store} record {document['_id']}")
+                continue
+            records[entry["key"]] = entry["value"]
+        return records
+
+    async def load_public(self, store: str) -> dict:
+        fields = PUBLIC_FIELDS.get(store, ())
+        index = {}
+        async for document in self.db[store].find({}, {field: 1 for field in ("_id",) + fields}):
+            index[document["_id"]] = {field: document.get(field) for field in fields}
+        return index
+
+    async def load_record(self, store: str, key: str):
+        document = await self.db[store].find_one({"_id": self.cipher.record_id(key)}, {"data": 1})
+        return None if document is None else json.loads(self.cipher.decrypt(bytes(document["data"])))["value"]
+
+    async def commit(self, changes):
+        done = asyncio.get_running_loop().create_future()
+        self._commits_in_flight.add(done)
+        try:
+            await self._commit(changes)
+        finally:
+            self._commits_in_flight.discard(done)
+            done.set_result(None)
+
+    async def _commit(self, changes):
+        operations = {}
+        for store, key, record in changes:
+            if record is None:
+                operation = DeleteOne({"_id": self.cipher.record_id(key)})
+            else:
+                document = self._document(store, key, record)
+                operation = ReplaceOne({"_id": document["_id"]}, document, upsert=True)
+            operations.setdefault(store, []).append(operation)
+
+        if self.transactions and len(operations) > 1:
+            async with await self.client.start_session() as session:
+                async with session.start_transaction():
+                    for store, store_operations in operations.items():
+                        await self.db[store].bulk_write(store_operations, ordered=False, session=session)
+            self.commit_stats["transactions"] += 1
+        else:
+            for store, store_operations in operations.items():
+                await self.db[store].bulk_write(store_operations, ordered=False)
+        self.commit_stats["commits"] += 1
+        self.commit_stats["entries"] += len(changes)
+
+    async def has_migration(self, name: str) -> bool:
+        return await self.db["migrations"].find_one({"_id": name}, {"_id": 1}) is not None
+
+    async def record_migration(self, name: str):
+        await self.db["migrations"].replace_one(
+            {"_id": name}, {"_id": name, "applied_at": datetime.now().isoformat()}, upsert=True
+        )
+
+    async def is_empty(self, store: str) -> bool:
+        return await self.db[store].find_one({}, {"_id": 1}) is None
+
+    async def reencrypt(self, store: str, batch_size: int = 500) -> int:
+        """Re-encrypts a store in bulk writes of ``batch_size`` documents.
+
+        Each update only applies if the document still holds the token that was read,
+        so a record committed meanwhile, already under the new key, is never overwritten.
+        """
+        # Commits that encrypted their documents before the key changed must land first
+        await asyncio.gather(*self._commits_in_flight)
+        collection = self.db[store]
+        operations, total = [], 0
+        async for document in collection.find({}, {"data": 1}):
+            try:
+                data = self.cipher.rotate(bytes(document["data"]))
+            except InvalidToken:
+                print(f"⚠️  Skipping unreadable {store} record {document['_id']}")
+                continue
+            operations.append(UpdateOne({"_id": document["_id"], "data": document["data"]}, {"$set": {"data": Binary(data)}}))
+            if len(operations) >= batch_size:
+                await collection.bulk_write(operations, ordered=False)
+                total, operations = total + len(operations), []
+        if operations:
+            await collection.bulk_write(operations, ordered=False)
+            total += len(operations)
+        return total
+
+    async def maintain(self):
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "database": self.db_name,
+            "max_pool_size": self.max_pool_size,
+            "transactions": self.transactions,
+            "commits": self.commit_stats
+        }
+
+    async def close(self):
+        if self.client is not None:
+            self.client.close()
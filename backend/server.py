@@ -1,13 +1,37 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, File, UploadFile, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field
 from typing import List, Optional
 import os
+import time
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import json
-from cryptography.fernet import Fernet, InvalidToken
+import hashlib
+import re
+import unicodedata
+from urllib.parse import quote
+import jwt
+from cryptography.fernet import Fernet
 from passlib.context import CryptContext
+from storage import (
+    load_store, write_snapshot, load_cipher, staged_key, stage_key_rotation, finish_key_rotation,
+    reencrypt_previous_generation, RECORD_ID_ROTATION_WARNING
+)
+from storage_backends import EncryptedFileBackend, SQLiteBackend, DATA_STORES, PUBLIC_FIELDS, import_from_encrypted_files
+from indexes import ShopSearchIndex, ShopPartition, LRUCache, ROLLUP_GRANULARITIES
+from inventory_import import parse_inventory_upload
+from exports import SalesReport, InventoryReport, EXPORT_FORMATS, stream_report
+import asyncio
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from dateutil.relativedelta import relativedelta
+from dotenv import load_dotenv
+from pathlib import Path
+
+load_dotenv(Path(__file__).parent / ".env")
 
 # Initialize FastAPI app
 app = FastAPI(title="Murick Battery SaaS API", version="1.0.0")
@@ -19,47 +43,168 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 # Define data directory and file paths
 DATA_DIR = "data"
-SHOPS_FILE = os.path.join(DATA_DIR, "shops.dat")
-LICENSES_FILE = os.path.join(DATA_DIR, "licenses.dat")
-RECOVERY_CODES_FILE = os.path.join(DATA_DIR, "recovery_codes.dat")
 ADMIN_ACCOUNTS_FILE = os.path.join(DATA_DIR, "admin_accounts.dat")  # New encrypted file
 SECURE_CONFIG_FILE = os.path.join(DATA_DIR, "secure_config.dat")  # New encrypted file
 
+# Data stores, kept in the backend selected by STORAGE_BACKEND (see storage_backends.py)
+SHOPS_STORE = "shops"
+LICENSES_STORE = "licenses"
+RECOVERY_CODES_STORE = "recovery_codes"
+INVENTORY_STORE = "inventory"
+SALES_STORE = "sales"
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "encrypted_files")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", os.path.join(DATA_DIR, "murick.db"))
+
+# MongoDB backend (STORAGE_BACKEND=mongodb); one pooled client serves the whole process
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.environ.get("DB_NAME", "murick")
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", 50))
+
+# Journal writes arriving within this window share one write and fsync per file
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get("GROUP_COMMIT_WINDOW_MS", 5))
+
+# Journal compaction: a store is re-snapshotted once its journal passes either limit
+COMPACTION_MAX_LOG_BYTES = int(os.environ.get("COMPACTION_MAX_LOG_BYTES", 1024 * 1024))
+COMPACTION_MAX_LOG_ENTRIES = int(os.environ.get("COMPACTION_MAX_LOG_ENTRIES", 1000))
+COMPACTION_CHECK_INTERVAL_SECONDS = float(os.environ.get("COMPACTION_CHECK_INTERVAL_SECONDS", 30))
+
+# bcrypt runs on its own bounded pool so password checks never block the event loop
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 4))
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get("PASSWORD_HASH_MAX_QUEUE", 64))
+
+# Change events buffered per SSE connection before a slow client is dropped
+EVENT_QUEUE_SIZE = int(os.environ.get("EVENT_QUEUE_SIZE", 256))
+EVENT_HEARTBEAT_SECONDS = float(os.environ.get("EVENT_HEARTBEAT_SECONDS", 15))
+
+# Shop configurations are decrypted on first access and this many of the hottest kept in memory
+SHOP_CACHE_SIZE = max(1, int(os.environ.get("SHOP_CACHE_SIZE", 1000)))
+
+# Key rotation re-encrypts SQLite and MongoDB stores this many records per write
+KEY_ROTATION_BATCH_SIZE = int(os.environ.get("KEY_ROTATION_BATCH_SIZE", 500))
+
+# Admin session tokens issued by /api/admin/authenticate
+ADMIN_TOKEN_TTL_MINUTES = int(os.environ.get("ADMIN_TOKEN_TTL_MINUTES", 30))
+
 # Load encryption key from file
+ENCRYPTION_KEY_FILE = os.path.join(DATA_DIR, "encryption.key")
+
 def load_encryption_key():
-    key_file = os.path.join(DATA_DIR, "encryption.key")
     try:
-        with open(key_file, 'rb') as f:
+        with open(ENCRYPTION_KEY_FILE, 'rb') as f:
             return f.read()
     except FileNotFoundError:
         print("⚠️  ERROR: Encryption key not found! Run setup_credentials.py first.")
         raise
 
 ENCRYPTION_KEY = load_encryption_key()
-cipher = Fernet(ENCRYPTION_KEY)
+# Holds both keys while a rotation is in progress (see rotate_encryption_key)
+cipher = load_cipher(ENCRYPTION_KEY_FILE)
+# Admin tokens are signed with a key derived from the encryption key unless one is configured
+ADMIN_TOKEN_SECRET = os.environ.get("ADMIN_TOKEN_SECRET") or hashlib.sha256(b"admin-session:" + ENCRYPTION_KEY).hexdigest()
 
 os.makedirs(DATA_DIR, exist_ok=True)
 
 def load_from_encrypted_file(filename: str) -> dict:
-    """Loads and decrypts data from a file, returning empty if it fails."""
-    try:
-        with open(filename, 'rb') as f:
-            encrypted_data = f.read()
-        decrypted_data = cipher.decrypt(encrypted_data)
-        return json.loads(decrypted_data)
-    except (FileNotFoundError, InvalidToken, json.JSONDecodeError):
-        return {}
+    """Loads the encrypted snapshot and replays its journal.
+
+    Falls back to the previous generation if the snapshot is damaged, and raises
+    StoreCorruptedError instead of starting with an empty store if nothing is readable.
+    """
+    return load_store(filename, cipher)
 
 def save_to_encrypted_file(data: dict, filename: str):
-    """Serializes, encrypts, and saves data to a file."""
-    json_data = json.dumps(data, default=str).encode('utf-8')
-    encrypted_data = cipher.encrypt(json_data)
-    with open(filename, 'wb') as f:
-        f.write(encrypted_data)
+    """Serializes, encrypts, and saves a full snapshot of the data to a file."""
+    write_snapshot(data, filename, cipher)
+
+file_storage = EncryptedFileBackend(
+    DATA_DIR, cipher, GROUP_COMMIT_WINDOW_MS / 1000, COMPACTION_MAX_LOG_BYTES, COMPACTION_MAX_LOG_ENTRIES
+)
+if STORAGE_BACKEND == "encrypted_files":
+    storage_backend = file_storage
+elif STORAGE_BACKEND == "sqlite":
+    storage_backend = SQLiteBackend(SQLITE_PATH, cipher, GROUP_COMMIT_WINDOW_MS / 1000)
+elif STORAGE_BACKEND == "mongodb":
+    # Imported here so motor is only needed when MongoDB is actually used
+    from mongo_backend import MongoBackend
+    storage_backend = MongoBackend(MONGO_URL, DB_NAME, cipher, MONGO_MAX_POOL_SIZE)
+else:
+    raise ValueError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}' (expected encrypted_files, sqlite or mongodb)")
+
+# Every store carries a version that grows with each change, and every shop configuration
+# remembers the version of its last change; these back the ETags of conditional GETs
+store_versions = {}
+record_versions = {}
+
+def bump_record_versions(changes):
+    for store, key, _ in changes:
+        store_versions[store] = store_versions.get(store, 0) + 1
+        # Shops are the only records served one by one, so sales and inventory need no entry each
+        if store == SHOPS_STORE:
+            record_versions[(store, key)] = store_versions[store]
+
+async def save_records(*changes):
+    """Persists (store, key, record) changes, a None record deleting the key.
+
+    Returns once the changes are durable; concurrent requests are group-committed.
+    """
+    # Bumped on both sides of the commit so a read racing it is never tagged like the final state
+    bump_record_versions(changes)
+    replaced = index_saved_records(changes)
+    try:
+        await storage_backend.commit(changes)
+    except Exception:
+        # Indexed ahead of the commit, so lookups racing it see the change; it never became durable
+        unindex_records(replaced)
+        raise
+    finally:
+        bump_record_versions(changes)
+
+async def save_record(store: str, key: str, record: Optional[dict]):
+    """Persists a single changed record."""
+    await save_records((store, key, record))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+password_hash_metrics = {"in_flight": 0, "max_in_flight": 0, "completed": 0, "rejected": 0}
+
+def verify_password(plain_password, hashed_password):
+    return pwd_context.verify(plain_password, hashed_password)
+
+def get_password_hash(password):
+    return pwd_context.hash(password)
+
+async def run_password_task(func, *args):
+    """Runs a bcrypt call on the password executor, rejecting work once the queue is full."""
+    if password_hash_metrics["in_flight"] >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE:
+        password_hash_metrics["rejected"] += 1
+        raise HTTPException(status_code=503, detail="Server busy, please try again")
+    password_hash_metrics["in_flight"] += 1
+    password_hash_metrics["max_in_flight"] = max(password_hash_metrics["max_in_flight"], password_hash_metrics["in_flight"])
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        password_hash_metrics["in_flight"] -= 1
+        password_hash_metrics["completed"] += 1
+
+async def verify_password_async(plain_password, hashed_password):
+    return await run_password_task(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await run_password_task(get_password_hash, password)
+
+def password_hash_queue_stats():
+    in_flight = password_hash_metrics["in_flight"]
+    return {
+        **password_hash_metrics,
+        "workers": PASSWORD_HASH_WORKERS,
+        "queue_depth": max(0, in_flight - PASSWORD_HASH_WORKERS),
+        "max_queue": PASSWORD_HASH_MAX_QUEUE
+    }
 
 def initialize_secure_data():
     """Initialize secure data files with default values if they don't exist."""
@@ -107,27 +252,228 @@ def initialize_secure_data():
 # Initialize secure data on startup
 initialize_secure_data()
 
-# Load persisted data from encrypted files at startup
-shop_config_store = load_from_encrypted_file(SHOPS_FILE)
-license_keys_store = load_from_encrypted_file(LICENSES_FILE)
-recovery_codes_store = load_from_encrypted_file(RECOVERY_CODES_FILE)
+# Shops, licenses and recovery codes are indexed by record id (cipher.record_id) at
+# startup without decrypting anything; licenses and recovery codes keep their public
+# fields there. Full records are decrypted one at a time when needed.
+shop_index = {}
+license_index = {}
+recovery_code_index = {}
+public_indexes = {SHOPS_STORE: shop_index, LICENSES_STORE: license_index, RECOVERY_CODES_STORE: recovery_code_index}
 admin_accounts_store = load_from_encrypted_file(ADMIN_ACCOUNTS_FILE)  # Now loaded from encrypted file
 secure_config = load_from_encrypted_file(SECURE_CONFIG_FILE)
 
-# --- END: ENHANCED SECURITY WITH ENCRYPTED CREDENTIALS ---
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# Username index: shop_id -> username -> the user record inside the cached shop config;
+# only kept for shops in shop_config_cache
+shop_user_index = {}
+# (shop_id, username) pairs claimed by requests that are still hashing the password
+reserved_usernames = set()
+# The hottest shop configurations, decrypted on first access (see load_shop_config)
+shop_config_cache = LRUCache(SHOP_CACHE_SIZE, on_evict=lambda shop_id, _: shop_user_index.pop(shop_id, None))
+# One lock per shop, held by every read-modify-write of its configuration and by loads
+# that miss the cache, so an evicted shop is never loaded again while a change is saved
+shop_config_locks = weakref.WeakValueDictionary()
+
+def shop_config_lock(shop_id: str) -> asyncio.Lock:
+    lock = shop_config_locks.get(shop_id)
+    if lock is None:
+        lock = shop_config_locks[shop_id] = asyncio.Lock()
+    return lock
+
+def index_shop_users(shop_id: str):
+    """Rebuilds the username index for one shop from its cached user list."""
+    users_by_name = {}
+    for user in (shop_config_cache.peek(shop_id) or {}).get("users", []):
+        users_by_name.setdefault(user["username"], user)
+    shop_user_index[shop_id] = users_by_name
+
+def find_shop_user(shop_id: str, username: str) -> Optional[dict]:
+    return shop_user_index.get(shop_id, {}).get(username)
+
+def reserve_username(shop_id: str, username: str):
+    """Claims a username before any await, so concurrent requests cannot both take it."""
+    if find_shop_user(shop_id, username) is not None or (shop_id, username) in reserved_usernames:
+        raise HTTPException(status_code=400, detail="Username already exists")
+    reserved_usernames.add((shop_id, username))
+
+def rename_shop_user(shop_id: str, old_username: str, new_username: str):
+    users_by_name = shop_user_index.get(shop_id)
+    if users_by_name is not None:
+        users_by_name[new_username] = users_by_name.pop(old_username)
+
+def cache_shop_config(shop_id: str, shop_config: dict):
+    shop_config_cache.put(shop_id, shop_config)
+    index_shop_users(shop_id)
+
+def shop_exists(shop_id: str) -> bool:
+    return cipher.record_id(shop_id) in shop_index
+
+async def load_shop_config(shop_id: str) -> Optional[dict]:
+    """The shop's configuration, decrypted from storage on first access; None for an unknown shop."""
+    shop_config = shop_config_cache.get(shop_id)
+    if shop_config is not None or not shop_exists(shop_id):
+        return shop_config
+    async with shop_config_lock(shop_id):
+        return await read_shop_config(shop_id)
+
+async def read_shop_config(shop_id: str) -> Optional[dict]:
+    """load_shop_config for a caller that already holds the shop's lock."""
+    shop_config = shop_config_cache.get(shop_id)
+    if shop_config is not None or not shop_exists(shop_id):
+        return shop_config
+    loaded = await storage_backend.load_record(SHOPS_STORE, shop_id)
+    # A request that loaded or saved the shop meanwhile holds the copy everyone must share
+    shop_config = shop_config_cache.peek(shop_id)
+    if shop_config is None and loaded is not None:
+        cache_shop_config(shop_id, loaded)
+        shop_config = loaded
+    return shop_config
+
+def index_saved_records(changes) -> list:
+    """Keeps the record id indexes and the shop cache in step with saved records.
+
+    Returns the (store, key, previous entry, new entry) replaced, for unindex_records().
+    """
+    replaced = []
+    for store, key, record in changes:
+        if store not in public_indexes:
+            continue
+        record_id = cipher.record_id(key)
+        previous = public_indexes[store].get(record_id)
+        if record is None:
+            public_indexes[store].pop(record_id, None)
+        else:
+            public_indexes[store][record_id] = {field: record.get(field) for field in PUBLIC_FIELDS.get(store, ())}
+        replaced.append((store, key, previous, public_indexes[store].get(record_id)))
+        if store == SHOPS_STORE:
+            if record is None:
+                shop_config_cache.pop(key)
+                shop_user_index.pop(key, None)
+            else:
+                cache_shop_config(key, record)
+    return replaced
+
+def unindex_records(replaced):
+    """Puts back the index entries of changes whose commit failed."""
+    for store, key, previous, entry in reversed(replaced):
+        record_id = cipher.record_id(key)
+        # Unless a later save has replaced the entry again
+        if public_indexes[store].get(record_id) is entry:
+            if previous is None:
+                public_indexes[store].pop(record_id, None)
+            else:
+                public_indexes[store][record_id] = previous
+        if store == SHOPS_STORE:
+            # The cached copy may hold the failed change; the next access reads the stored one
+            shop_config_cache.pop(key)
+            shop_user_index.pop(key, None)
+
+# Trigram index behind /api/admin/search-shops, built from every shop on the first search
+shop_search_index = ShopSearchIndex()
+shop_search_index_build = None
+
+async def build_shop_search_index():
+    for shop_id, shop_config in (await storage_backend.load(SHOPS_STORE)).items():
+        # Shops saved since the load started are already indexed with their newer config
+        if shop_id not in shop_search_index:
+            shop_search_index.add(shop_id, shop_config_cache.peek(shop_id) or shop_config)
+
+async def ensure_shop_search_index():
+    global shop_search_index_build
+    if shop_search_index_build is None:
+        shop_search_index_build = asyncio.ensure_future(build_shop_search_index())
+    await shop_search_index_build
+
+async def load_data_stores():
+    """Indexes the data stores in the storage backend and loads inventory and sales."""
+    await storage_backend.open()
+    if storage_backend is not file_storage:
+        await import_from_encrypted_files(storage_backend, file_storage)
+    shop_index.update(await storage_backend.load_public(SHOPS_STORE))
+    license_index.update(await storage_backend.load_public(LICENSES_STORE))
+    recovery_code_index.update(await storage_backend.load_public(RECOVERY_CODES_STORE))
+    load_shop_partitions(await storage_backend.load(INVENTORY_STORE), await storage_backend.load(SALES_STORE))
+
+async def storage_maintenance_loop():
+    """Periodically lets the backend compact journals or checkpoint its log."""
+    while True:
+        await asyncio.sleep(COMPACTION_CHECK_INTERVAL_SECONDS)
+        await storage_backend.maintain()
+
+# Progress of the running or most recent key rotation
+key_rotation = {"state": "idle"}
+key_rotation_task = None
+
+async def rotate_encryption_key():
+    """Re-encrypts every store under the cipher's new key, then retires the old key.
+
+    Requests keep being served throughout: reads accept both keys and every write
+    already uses the new one. A rotation cut short resumes on the next startup.
+    """
+    try:
+        backends = [storage_backend] if storage_backend is file_storage else [storage_backend, file_storage]
+        for backend in backends:
+            for store in DATA_STORES:
+                key_rotation["records"] += await backend.reencrypt(store, KEY_ROTATION_BATCH_SIZE)
+        for data, filename in ((admin_accounts_store, ADMIN_ACCOUNTS_FILE), (secure_config, SECURE_CONFIG_FILE)):
+            if os.path.exists(filename):
+                save_to_encrypted_file(data, filename)
+                reencrypt_previous_generation(filename, cipher)
+        finish_key_rotation(ENCRYPTION_KEY_FILE, cipher)
+    except Exception as e:
+        key_rotation.update(state="failed", error=str(e))
+        print(f"⚠️  Key rotation failed, both keys stay in use until it is retried: {e}")
+        return
+    key_rotation.update(state="completed", finished_at=datetime.now().isoformat())
+    print(f"🔑 Encryption key rotated, {key_rotation['records']} records re-encrypted")
+    print(f"⚠️  {RECORD_ID_ROTATION_WARNING}")
+
+def start_key_rotation():
+    global key_rotation_task
+    key_rotation.update(state="running", started_at=datetime.now().isoformat(), finished_at=None, records=0, error=None)
+    key_rotation_task = asyncio.create_task(rotate_encryption_key())
+
+@app.on_event("startup")
+async def start_storage():
+    await load_data_stores()
+    asyncio.create_task(storage_maintenance_loop())
+    if len(cipher.keys) > 1:
+        print("🔑 Resuming the interrupted encryption key rotation")
+        start_key_rotation()
+
+@app.on_event("shutdown")
+async def stop_storage():
+    await storage_backend.close()
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+# --- END: ENHANCED SECURITY WITH ENCRYPTED CREDENTIALS ---
 
-# In-memory storage for MVP (replace with Firebase/MongoDB later)
-inventory_store = {}
-sales_store = {}
+# In-memory working set, persisted through the storage backend
+# Inventory and sales are partitioned per shop: shop_id -> ShopPartition
+shop_partitions = {}
 user_store = {}
+# Stand-in for sales whose battery has since been deleted from inventory
+UNKNOWN_BATTERY = {"brand": "Unknown", "capacity": "Unknown", "model": "Unknown"}
+# Stored as strings; older records use str(datetime), with a space instead of the 'T'
+DATETIME_FIELDS = ("date_added", "sale_date", "warranty_end_date")
+
+def restore_datetimes(record: dict) -> dict:
+    """Turns a stored record's date strings back into datetimes, as a freshly created record has."""
+    for field in DATETIME_FIELDS:
+        if isinstance(record.get(field), str):
+            record[field] = datetime.fromisoformat(record[field])
+    return record
+
+def load_shop_partitions(inventory: dict, sales: dict):
+    """Rebuilds every shop's inventory, sales and their indexes from the stored records."""
+    for item in inventory.values():
+        restore_datetimes(item)
+        shop_partitions.setdefault(item["shop_id"], ShopPartition()).add_item(item)
+    for sale in sorted(map(restore_datetimes, sales.values()), key=lambda sale: sale["sale_date"]):
+        shop = shop_partitions.setdefault(sale["shop_id"], ShopPartition())
+        shop.add_sale(sale, shop.inventory.get(sale["battery_id"], UNKNOWN_BATTERY))
+    # Clients cannot have seen sequences from this process yet, so older ones get a full reset
+    for shop in shop_partitions.values():
+        shop.changes.mark_horizon()
+
 # Static data (doesn't change)
 BATTERY_BRANDS = [
     {"id": "ags", "name": "AGS", "popular": True},
@@ -140,9 +486,35 @@ BATTERY_BRANDS = [
 ]
 BATTERY_CAPACITIES = ["35Ah", "45Ah", "55Ah", "65Ah", "70Ah", "80Ah", "100Ah", "120Ah", "135Ah", "150Ah", "180Ah", "200Ah"]
 
+# --- Conditional GET ---
+# Version-based tags embed the boot time so a restarted server never reuses one for other content
+ETAG_EPOCH = format(time.time_ns() // 1000, "x")
+
+def content_etag(data) -> str:
+    return '"' + hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()[:32] + '"'
+
+BATTERY_BRANDS_ETAG = content_etag(BATTERY_BRANDS)
+BATTERY_CAPACITIES_ETAG = content_etag(BATTERY_CAPACITIES)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True if an If-None-Match header names this tag (or is '*')."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    # If-None-Match uses weak comparison
+    return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+def shop_etag(shop: ShopPartition) -> str:
+    """Changes with every inventory or sales change of the shop."""
+    return f'"{ETAG_EPOCH}-{shop.changes.sequence}"'
+
 # --- Pydantic Data Models ---
 class BatteryItem(BaseModel):
     id: Optional[str] = None
+    shop_id: Optional[str] = None
     brand: str
     capacity: str
     model: str
@@ -156,6 +528,7 @@ class BatteryItem(BaseModel):
 
 class SaleTransaction(BaseModel):
     id: Optional[str] = None
+    shop_id: Optional[str] = None
     battery_id: str
     quantity_sold: int
     unit_price: float
@@ -166,6 +539,18 @@ class SaleTransaction(BaseModel):
     sale_date: Optional[datetime] = None
     profit_per_unit: float = 0
     total_profit: float = 0
+    receipt_id: Optional[str] = None
+
+class CartLine(BaseModel):
+    battery_id: str
+    quantity_sold: int = Field(..., gt=0)
+    unit_price: float
+
+class CartSale(BaseModel):
+    items: List[CartLine] = Field(..., min_length=1)
+    customer_name: Optional[str] = None
+    customer_phone: Optional[str] = None
+    sold_by: Optional[str] = None
 
 class User(BaseModel):
     uid: str
@@ -206,15 +591,17 @@ class AdminPasswordChange(BaseModel):
     new_password: str
 
 class ShopSearchRequest(BaseModel):
-    admin_key: str
-    username: str
-    password: str
+    admin_key: Optional[str] = None
+    username: Optional[str] = None
+    password: Optional[str] = None
     search_term: str
+    limit: int = Field(50, ge=1, le=500)
+    offset: int = Field(0, ge=0)
 
 class ShopRecoveryRequest(BaseModel):
-    admin_key: str
-    username: str
-    password: str
+    admin_key: Optional[str] = None
+    username: Optional[str] = None
+    password: Optional[str] = None
     shop_id: str
     new_username: str
     new_password: str
@@ -236,10 +623,9 @@ async def health():
 # License Key Management
 @app.post("/api/validate-license")
 async def validate_license_key(license_data: LicenseValidation):
-    license_key = license_data.license_key
-    if license_key not in license_keys_store:
+    license_info = license_index.get(cipher.record_id(license_data.license_key))
+    if license_info is None:
         raise HTTPException(status_code=404, detail="Invalid license key")
-    license_info = license_keys_store[license_key]
     if license_info["used"]:
         raise HTTPException(status_code=400, detail="License key has already been used")
     return {"valid": True, "plan": license_info["plan"], "message": "License key is valid and available"}
@@ -249,41 +635,49 @@ async def validate_license_key(license_data: LicenseValidation):
 async def setup_shop(shop_config: ShopConfig):
     # 1. Validate the license key
     license_key = shop_config.license_key
-    if license_key not in license_keys_store:
+    license_id = cipher.record_id(license_key)
+    if license_id not in license_index:
         raise HTTPException(status_code=404, detail="Invalid license key")
-    license_info = license_keys_store[license_key]
-    if license_info["used"]:
+    if license_index[license_id]["used"]:
         raise HTTPException(status_code=400, detail="License key has already been used")
     
-    # 2. Mark license as used and save the encrypted file
-    license_keys_store[license_key]["used"] = True
-    license_keys_store[license_key]["used_date"] = datetime.now().isoformat()
-    license_keys_store[license_key]["shop_id"] = shop_config.shop_id
-    save_to_encrypted_file(license_keys_store, LICENSES_FILE)
-    
-    # 3. Generate recovery codes and save the encrypted file
-    import secrets
-    recovery_codes = []
-    for i in range(5):
-        code = f"REC-{secrets.token_hex(4).upper()}-{secrets.token_hex(4).upper()}"
-        recovery_codes.append(code)
-        recovery_codes_store[code] = {"shop_id": shop_config.shop_id, "used": False, "generated_date": datetime.now().isoformat()}
-    save_to_encrypted_file(recovery_codes_store, RECOVERY_CODES_FILE)
-    
-    # 4. Prepare the shop data dictionary
-    shop_config.created_date = datetime.now()
-    shop_config_dict = shop_config.dict()
-    shop_config_dict["recovery_codes"] = recovery_codes
-
-    # 5. Hash the user passwords within the dictionary BEFORE saving
-    if "users" in shop_config_dict and shop_config_dict["users"]:
-        for user in shop_config_dict["users"]:
-            if "password" in user and user["password"]: # Check that password is not empty
-                user["password"] = get_password_hash(user["password"])
-    
-    # 6. Save the final, secured shop configuration to the encrypted file
-    shop_config_store[shop_config.shop_id] = shop_config_dict
-    save_to_encrypted_file(shop_config_store, SHOPS_FILE)
+    # 2. Mark license as used and save the encrypted file; the index is claimed before
+    # awaiting anything so a concurrent setup cannot use the same key
+    license_index[license_id]["used"] = True
+    try:
+        license_info = await storage_backend.load_record(LICENSES_STORE, license_key)
+        license_info["used"] = True
+        license_info["used_date"] = datetime.now().isoformat()
+        license_info["shop_id"] = shop_config.shop_id
+        changes = [(LICENSES_STORE, license_key, license_info)]
+    
+        # 3. Generate recovery codes and save the encrypted file
+        import secrets
+        recovery_codes = []
+        for i in range(5):
+            code = f"REC-{secrets.token_hex(4).upper()}-{secrets.token_hex(4).upper()}"
+            recovery_codes.append(code)
+            changes.append((RECOVERY_CODES_STORE, code, {"shop_id": shop_config.shop_id, "used": False, "generated_date": datetime.now().isoformat()}))
+    
+        # 4. Prepare the shop data dictionary
+        shop_config.created_date = datetime.now()
+        shop_config_dict = shop_config.dict()
+        shop_config_dict["recovery_codes"] = recovery_codes
+
+        # 5. Hash the user passwords within the dictionary BEFORE saving
+        if "users" in shop_config_dict and shop_config_dict["users"]:
+            for user in shop_config_dict["users"]:
+                if "password" in user and user["password"]: # Check that password is not empty
+                    user["password"] = await get_password_hash_async(user["password"])
+    
+        # 6. Save the final, secured shop configuration to the encrypted file
+        changes.append((SHOPS_STORE, shop_config.shop_id, shop_config_dict))
+        await save_records(*changes)
+    except BaseException:
+        # Nothing was saved, so the key must stay available
+        license_index[license_id]["used"] = False
+        raise
+    shop_search_index.add(shop_config.shop_id, shop_config_dict)
     
     return {
         "message": "Shop setup completed successfully", 
@@ -294,28 +688,36 @@ async def setup_shop(shop_config: ShopConfig):
     }
     
 @app.get("/api/shop-config/{shop_id}")
-async def get_shop_config(shop_id: str):
-    if shop_id not in shop_config_store:
+async def get_shop_config(shop_id: str, response: Response, if_none_match: Optional[str] = Header(None)):
+    if not shop_exists(shop_id):
         raise HTTPException(status_code=404, detail="Shop not found")
-    return shop_config_store[shop_id]
+    etag = f'"{ETAG_EPOCH}-{record_versions.get((SHOPS_STORE, shop_id), 0)}"'
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    shop_config = await load_shop_config(shop_id)
+    if shop_config is None:
+        raise HTTPException(status_code=404, detail="Shop not found")
+    response.headers["ETag"] = etag
+    return shop_config
 
 @app.put("/api/shop-config/{shop_id}")
 async def update_shop_config(shop_id: str, shop_config: ShopConfig):
-    if shop_id not in shop_config_store:
-        raise HTTPException(status_code=404, detail="Shop not found")
-    
-    original_config = shop_config_store[shop_id]
-    updated_data = shop_config.dict()
-    
-    # Ensure critical data is not overwritten
-    updated_data["shop_id"] = shop_id
-    updated_data["created_date"] = original_config.get("created_date")
-    updated_data["license_key"] = original_config.get("license_key")
-    # IMPORTANT: Also preserve user passwords if they are not being changed
-    updated_data["users"] = original_config.get("users", []) 
-    
-    shop_config_store[shop_id] = updated_data
-    save_to_encrypted_file(shop_config_store, SHOPS_FILE)
+    async with shop_config_lock(shop_id):
+        original_config = await read_shop_config(shop_id)
+        if original_config is None:
+            raise HTTPException(status_code=404, detail="Shop not found")
+        
+        updated_data = shop_config.dict()
+        
+        # Ensure critical data is not overwritten
+        updated_data["shop_id"] = shop_id
+        updated_data["created_date"] = original_config.get("created_date")
+        updated_data["license_key"] = original_config.get("license_key")
+        # IMPORTANT: Also preserve user passwords if they are not being changed
+        updated_data["users"] = original_config.get("users", []) 
+        
+        shop_search_index.add(shop_id, updated_data)
+        await save_record(SHOPS_STORE, shop_id, updated_data)
     return {"message": "Shop configuration updated successfully"}
 
 @app.post("/api/authenticate")
@@ -324,29 +726,27 @@ async def authenticate_user(auth_request: AuthRequest):
     username = auth_request.username
     password = auth_request.password
     
-    if shop_id not in shop_config_store:
+    if await load_shop_config(shop_id) is None:
         raise HTTPException(status_code=404, detail="Shop not found")
     
-    shop_config = shop_config_store[shop_id]
+    user = find_shop_user(shop_id, username)
+    if user is None:
+        # User was not found
+        raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    for user in shop_config.get("users", []):
-        if user["username"] == username:
-            # IMPORTANT: Use verify_password, not a simple == check
-            if verify_password(password, user["password"]):
-                return { "message": "Authentication successful", "user": {"username": user["username"], "name": user["name"]} }
-            else:
-                # Password was wrong for this user
-                raise HTTPException(status_code=401, detail="Invalid credentials")
+    # IMPORTANT: Use verify_password, not a simple == check
+    if await verify_password_async(password, user["password"]):
+        return { "message": "Authentication successful", "user": {"username": user["username"], "name": user["name"]} }
     
-    # User was not found
+    # Password was wrong for this user
     raise HTTPException(status_code=401, detail="Invalid credentials")
 
 @app.get("/api/license-info/{license_key}")
 async def get_license_info(license_key: str):
-    if license_key not in license_keys_store:
+    if cipher.record_id(license_key) not in license_index:
         raise HTTPException(status_code=404, detail="License key not found")
     
-    license_info = license_keys_store[license_key]
+    license_info = await storage_backend.load_record(LICENSES_STORE, license_key)
     return {
         "license_key": license_key,
         "plan": license_info["plan"],
@@ -370,15 +770,15 @@ async def generate_license_key(admin_data: dict):
     import secrets
     license_key = f"MBM-{datetime.now().year}-{plan.upper()}-{secrets.token_hex(3).upper()}"
     
-    license_keys_store[license_key] = {
+    license_info = {
         "used": False,
         "plan": plan,
         "created_date": datetime.now().isoformat(),
         "generated_by": admin_key
     }
     
-    # Save updated license keys to encrypted file
-    save_to_encrypted_file(license_keys_store, LICENSES_FILE)
+    # Save the new license key to the encrypted journal
+    await save_record(LICENSES_STORE, license_key, license_info)
     
     return {
         "license_key": license_key,
@@ -412,14 +812,16 @@ async def authenticate_admin(auth_request: AdminAuthRequest):
     # This is a temporary measure during transition to fully hashed passwords
     password_verified = False
     try:
-        password_verified = verify_password(password, admin_account["password"])
+        password_verified = await verify_password_async(password, admin_account["password"])
+    except HTTPException:
+        raise
     except Exception as e:
         # If verification fails due to hash format, try direct comparison (legacy support)
         password_verified = (password == admin_account["password"])
         
         # If plaintext match succeeds, update to hashed version for future logins
         if password_verified:
-            admin_account["password"] = get_password_hash(password)
+            admin_account["password"] = await get_password_hash_async(password)
             admin_accounts_store[admin_key] = admin_account
             save_to_encrypted_file(admin_accounts_store, ADMIN_ACCOUNTS_FILE)
             print(f"Updated admin password to hashed version for {username}")
@@ -436,9 +838,50 @@ async def authenticate_admin(auth_request: AdminAuthRequest):
             "username": admin_account["username"],
             "name": admin_account["name"],
             "role": admin_account["role"]
-        }
+        },
+        "token": issue_admin_token(admin_key, admin_account),
+        "token_type": "bearer",
+        "expires_in": ADMIN_TOKEN_TTL_MINUTES * 60
     }
 
+def issue_admin_token(admin_key: str, admin_account: dict) -> str:
+    """Signs a short-lived session token for an authenticated admin."""
+    now = datetime.now(timezone.utc)
+    claims = {
+        "sub": admin_key,
+        "username": admin_account["username"],
+        "role": admin_account["role"],
+        # Changing the password invalidates tokens issued before the change
+        "pwd_changed": admin_account.get("last_password_change"),
+        "iat": now,
+        "exp": now + timedelta(minutes=ADMIN_TOKEN_TTL_MINUTES)
+    }
+    return jwt.encode(claims, ADMIN_TOKEN_SECRET, algorithm="HS256")
+
+def verify_admin_token(token: str) -> dict:
+    """Checks an admin session token's signature and expiry without touching bcrypt."""
+    try:
+        claims = jwt.decode(token, ADMIN_TOKEN_SECRET, algorithms=["HS256"])
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Admin authentication failed")
+    admin_account = admin_accounts_store.get(claims.get("sub"))
+    if not admin_account or admin_account.get("last_password_change") != claims.get("pwd_changed"):
+        raise HTTPException(status_code=401, detail="Admin authentication failed")
+    return claims
+
+async def authorize_admin(authorization: Optional[str], admin_key: Optional[str] = None,
+                          username: Optional[str] = None, password: Optional[str] = None):
+    """Accepts a bearer token, or full admin credentials from clients that predate tokens."""
+    if authorization and authorization.lower().startswith("bearer "):
+        return verify_admin_token(authorization[7:].strip())
+    if admin_key and username and password:
+        try:
+            await authenticate_admin(AdminAuthRequest(admin_key=admin_key, username=username, password=password))
+        except HTTPException:
+            raise HTTPException(status_code=401, detail="Admin authentication failed")
+        return {"sub": admin_key, "username": username}
+    raise HTTPException(status_code=401, detail="Admin authentication failed")
+
 @app.post("/api/admin/change-password")
 async def change_admin_password(password_change: AdminPasswordChange):
     """Allow admin to change their password"""
@@ -452,7 +895,9 @@ async def change_admin_password(password_change: AdminPasswordChange):
     # Verify current credentials with fallback to plaintext during transition
     password_verified = False
     try:
-        password_verified = verify_password(password_change.current_password, admin_account["password"])
+        password_verified = await verify_password_async(password_change.current_password, admin_account["password"])
+    except HTTPException:
+        raise
     except Exception as e:
         # If verification fails due to hash format, try direct comparison (legacy support)
         password_verified = (password_change.current_password == admin_account["password"])
@@ -461,7 +906,7 @@ async def change_admin_password(password_change: AdminPasswordChange):
         raise HTTPException(status_code=401, detail="Invalid current credentials")
     
     # Update password with hashed version
-    admin_accounts_store[admin_key]["password"] = get_password_hash(password_change.new_password)
+    admin_accounts_store[admin_key]["password"] = await get_password_hash_async(password_change.new_password)
     admin_accounts_store[admin_key]["last_password_change"] = datetime.now().isoformat()
     
     # Save updated admin accounts to encrypted file
@@ -471,75 +916,94 @@ async def change_admin_password(password_change: AdminPasswordChange):
 
 @app.post("/api/add-user/{shop_id}")
 async def add_user_to_shop(shop_id: str, user_data: dict):
-    if shop_id not in shop_config_store:
+    if await load_shop_config(shop_id) is None:
         raise HTTPException(status_code=404, detail="Shop not found")
     
-    shop_config = shop_config_store[shop_id]
-    
-    # Check if username already exists
-    for existing_user in shop_config.get("users", []):
-        if existing_user["username"] == user_data["username"]:
-            raise HTTPException(status_code=400, detail="Username already exists")
-    
-    if "users" not in shop_config:
-        shop_config["users"] = []
-    
-    # Hash password before storing
-    if "password" in user_data and user_data["password"]:
-        user_data["password"] = get_password_hash(user_data["password"])
-    
-    shop_config["users"].append(user_data)
-    shop_config_store[shop_id] = shop_config
-    save_to_encrypted_file(shop_config_store, SHOPS_FILE)
+    # Check if username already exists, and hold it while the password is hashed
+    reserve_username(shop_id, user_data["username"])
+    try:
+        # Hash password before storing
+        if "password" in user_data and user_data["password"]:
+            user_data["password"] = await get_password_hash_async(user_data["password"])
+        
+        # The shop may have left the cache while hashing, so it is read again under its lock
+        async with shop_config_lock(shop_id):
+            shop_config = await read_shop_config(shop_id)
+            if shop_config is None:
+                raise HTTPException(status_code=404, detail="Shop not found")
+            shop_config.setdefault("users", []).append(user_data)
+            await save_record(SHOPS_STORE, shop_id, shop_config)
+    finally:
+        reserved_usernames.discard((shop_id, user_data["username"]))
     
     return {"message": "User added successfully"}
 
+async def reset_shop_user_credentials(shop_id: str, target_user: str, new_username: str, new_password: str, *changes):
+    """Renames a shop user and sets a new password, then saves the shop together with ``changes``.
+
+    The shop must be loaded; the username index is kept in step.
+    """
+    if find_shop_user(shop_id, target_user) is None:
+        raise HTTPException(status_code=404, detail="User not found in shop")
+    renaming = new_username != target_user
+    if renaming:
+        reserve_username(shop_id, new_username)
+    
+    try:
+        # Hash the new password before touching the record so a failure leaves it unchanged
+        hashed_password = await get_password_hash_async(new_password)
+        # The shop may have left the cache while hashing, so it is read again under its lock
+        async with shop_config_lock(shop_id):
+            shop_config = await read_shop_config(shop_id)
+            user = find_shop_user(shop_id, target_user)
+            if shop_config is None or user is None:
+                raise HTTPException(status_code=404, detail="User not found in shop")
+            user["username"] = new_username
+            user["password"] = hashed_password
+            if renaming:
+                rename_shop_user(shop_id, target_user, new_username)
+            await save_records(*changes, (SHOPS_STORE, shop_id, shop_config))
+    finally:
+        if renaming:
+            reserved_usernames.discard((shop_id, new_username))
+
 # ===== ADMIN OVERRIDE SYSTEM FOR ACCOUNT RECOVERY =====
 
 @app.post("/api/admin/search-shops")
-async def search_shops_for_recovery(search_request: ShopSearchRequest):
-    try:
-        await authenticate_admin(AdminAuthRequest(admin_key=search_request.admin_key, username=search_request.username, password=search_request.password))
-    except HTTPException:
-        raise HTTPException(status_code=401, detail="Admin authentication failed")
+async def search_shops_for_recovery(search_request: ShopSearchRequest, authorization: Optional[str] = Header(None)):
+    await authorize_admin(authorization, search_request.admin_key, search_request.username, search_request.password)
     
-    search_term = search_request.search_term.lower()
+    await ensure_shop_search_index()
+    total_found, shop_ids = shop_search_index.search(search_request.search_term, search_request.limit, search_request.offset)
     matching_shops = []
     
-    for shop_id, shop_config in shop_config_store.items():
-        searchable_text = f"{shop_config.get('shop_name', '')} {shop_config.get('proprietor_name', '')} {shop_config.get('contact_number', '')} {shop_config.get('address', '')}".lower()
-        if search_term in searchable_text or search_term in shop_id.lower():
-            matching_shops.append({
-                "shop_id": shop_id,
-                "shop_name": shop_config.get("shop_name"),
-                "proprietor_name": shop_config.get("proprietor_name"),
-                "contact_number": shop_config.get("contact_number"),
-                "address": shop_config.get("address"),
-                "email": shop_config.get("email"),
-                "users_count": len(shop_config.get("users", [])),
-                "created_date": shop_config.get("created_date")
-            })
+    for shop_id in shop_ids:
+        shop_config = await load_shop_config(shop_id)
+        if shop_config is None:
+            continue
+        matching_shops.append({
+            "shop_id": shop_id,
+            "shop_name": shop_config.get("shop_name"),
+            "proprietor_name": shop_config.get("proprietor_name"),
+            "contact_number": shop_config.get("contact_number"),
+            "address": shop_config.get("address"),
+            "email": shop_config.get("email"),
+            "users_count": len(shop_config.get("users", [])),
+            "created_date": shop_config.get("created_date")
+        })
             
-    return {"shops": matching_shops, "total_found": len(matching_shops)}
+    return {"shops": matching_shops, "total_found": total_found, "limit": search_request.limit, "offset": search_request.offset}
 
 @app.get("/api/admin/shop-details/{shop_id}")
-async def get_shop_details_for_recovery(shop_id: str, admin_key: str, username: str, password: str):
+async def get_shop_details_for_recovery(shop_id: str, authorization: Optional[str] = Header(None)):
     """Admin endpoint to get complete shop details for recovery"""
     # First authenticate admin
-    try:
-        await authenticate_admin(AdminAuthRequest(
-            admin_key=admin_key,
-            username=username,
-            password=password
-        ))
-    except HTTPException:
-        raise HTTPException(status_code=401, detail="Admin authentication failed")
+    await authorize_admin(authorization)
     
-    if shop_id not in shop_config_store:
+    shop_config = await load_shop_config(shop_id)
+    if shop_config is None:
         raise HTTPException(status_code=404, detail="Shop not found")
     
-    shop_config = shop_config_store[shop_id]
-    
     # Return complete shop details for admin
     return {
         "shop_id": shop_id,
@@ -551,71 +1015,40 @@ async def get_shop_details_for_recovery(shop_id: str, admin_key: str, username:
         "license_key": shop_config.get("license_key"),
         "users": shop_config.get("users", []),
         "created_date": shop_config.get("created_date"),
-        "recovery_codes_available": len([code for code in shop_config.get("recovery_codes", []) if not recovery_codes_store.get(code, {}).get("used", True)])
+        "recovery_codes_available": len([code for code in shop_config.get("recovery_codes", []) if not recovery_code_index.get(cipher.record_id(code), {}).get("used", True)])
     }
 
 @app.post("/api/admin/reset-shop-credentials")
-async def reset_shop_credentials(recovery_request: ShopRecoveryRequest):
+async def reset_shop_credentials(recovery_request: ShopRecoveryRequest, authorization: Optional[str] = Header(None)):
     # Admin authentication
-    try:
-        await authenticate_admin(AdminAuthRequest(
-            admin_key=recovery_request.admin_key, username=recovery_request.username, password=recovery_request.password
-        ))
-    except HTTPException:
-        raise HTTPException(status_code=401, detail="Admin authentication failed")
+    await authorize_admin(authorization, recovery_request.admin_key, recovery_request.username, recovery_request.password)
 
     shop_id = recovery_request.shop_id
-    if shop_id not in shop_config_store:
+    if await load_shop_config(shop_id) is None:
         raise HTTPException(status_code=404, detail="Shop not found")
     
-    shop_config = shop_config_store[shop_id]
-    users = shop_config.get("users", [])
-    user_found = False
-
-    for i, user in enumerate(users):
-        if user["username"] == recovery_request.target_user:
-            users[i]["username"] = recovery_request.new_username
-            # Hash the new password
-            users[i]["password"] = get_password_hash(recovery_request.new_password)
-            user_found = True
-            break
-            
-    if not user_found:
-        raise HTTPException(status_code=404, detail="User not found in shop")
-    
-    shop_config["users"] = users
-    shop_config_store[shop_id] = shop_config
-    save_to_encrypted_file(shop_config_store, SHOPS_FILE)
+    await reset_shop_user_credentials(shop_id, recovery_request.target_user, recovery_request.new_username, recovery_request.new_password)
     
     return {"message": "Credentials reset successfully", "new_username": recovery_request.new_username}
 
 @app.post("/api/admin/generate-new-license")
-async def generate_new_license_for_shop(admin_data: dict):
+async def generate_new_license_for_shop(admin_data: dict, authorization: Optional[str] = Header(None)):
     """Admin endpoint to generate new license for existing shop (in case of lost license)"""
-    admin_key = admin_data.get("admin_key")
-    username = admin_data.get("username")
-    password = admin_data.get("password")
     plan = admin_data.get("plan", "basic")
     shop_id = admin_data.get("shop_id")
     
     # Authenticate admin
-    try:
-        await authenticate_admin(AdminAuthRequest(
-            admin_key=admin_key,
-            username=username,
-            password=password
-        ))
-    except HTTPException:
-        raise HTTPException(status_code=401, detail="Admin authentication failed")
+    claims = await authorize_admin(authorization, admin_data.get("admin_key"), admin_data.get("username"), admin_data.get("password"))
+    admin_key = claims["sub"]
     
-    if shop_id and shop_id not in shop_config_store:
+    if shop_id and not shop_exists(shop_id):
         raise HTTPException(status_code=404, detail="Shop not found")
     
     # Generate unique license key
     import secrets
     license_key = f"MBM-{datetime.now().year}-{plan.upper()}-{secrets.token_hex(3).upper()}"
     
-    license_keys_store[license_key] = {
+    license_info = {
         "used": False,
         "plan": plan,
         "created_date": datetime.now().isoformat(),
@@ -624,8 +1057,8 @@ async def generate_new_license_for_shop(admin_data: dict):
         "generated_by": admin_key
     }
     
-    # Save to encrypted file
-    save_to_encrypted_file(license_keys_store, LICENSES_FILE)
+    # Save to encrypted journal
+    await save_record(LICENSES_STORE, license_key, license_info)
     
     return {
         "license_key": license_key,
@@ -643,11 +1076,10 @@ async def use_recovery_code(recovery_request: RecoveryCodeRequest):
     shop_id = recovery_request.shop_id
     
     # Check if recovery code exists and is valid
-    if recovery_code not in recovery_codes_store:
+    code_info = recovery_code_index.get(cipher.record_id(recovery_code))
+    if code_info is None:
         raise HTTPException(status_code=404, detail="Invalid recovery code")
     
-    code_info = recovery_codes_store[recovery_code]
-    
     # Check if code is already used
     if code_info["used"]:
         raise HTTPException(status_code=400, detail="Recovery code has already been used")
@@ -656,45 +1088,35 @@ async def use_recovery_code(recovery_request: RecoveryCodeRequest):
     if code_info["shop_id"] != shop_id:
         raise HTTPException(status_code=400, detail="Recovery code does not belong to this shop")
     
-    # Check if shop exists
-    if shop_id not in shop_config_store:
-        raise HTTPException(status_code=404, detail="Shop not found")
-    
-    shop_config = shop_config_store[recovery_request.shop_id]
-    users = shop_config.get("users", [])
-    user_found = False
-
-    for i, user in enumerate(users):
-        if user["username"] == recovery_request.target_user:
-            users[i]["username"] = recovery_request.new_username
-            # Hash the new password
-            users[i]["password"] = get_password_hash(recovery_request.new_password)
-            user_found = True
-            break
-
-    if not user_found:
-        raise HTTPException(status_code=404, detail="User not found in shop")
-
-    # Mark code as used and save encrypted
-    recovery_codes_store[recovery_request.recovery_code]["used"] = True
-    recovery_codes_store[recovery_request.recovery_code]["used_date"] = datetime.now().isoformat()
-    save_to_encrypted_file(recovery_codes_store, RECOVERY_CODES_FILE)
-
-    # Update shop config and save encrypted
-    shop_config["users"] = users
-    shop_config_store[recovery_request.shop_id] = shop_config
-    save_to_encrypted_file(shop_config_store, SHOPS_FILE)
+    # Claim the code before awaiting anything so a concurrent request cannot use it too;
+    # the claim is released if the reset fails
+    code_info["used"] = True
+    try:
+        # Check if shop exists
+        if await load_shop_config(shop_id) is None:
+            raise HTTPException(status_code=404, detail="Shop not found")
+        
+        # Mark code as used; it is saved encrypted together with the updated shop config
+        code_record = await storage_backend.load_record(RECOVERY_CODES_STORE, recovery_code)
+        code_record["used"] = True
+        code_record["used_date"] = datetime.now().isoformat()
+        await reset_shop_user_credentials(
+            shop_id, recovery_request.target_user, recovery_request.new_username, recovery_request.new_password,
+            (RECOVERY_CODES_STORE, recovery_code, code_record)
+        )
+    except BaseException:
+        code_info["used"] = False
+        raise
     
     return {"message": "Credentials reset successfully", "new_username": recovery_request.new_username}
 
 @app.get("/api/recovery/validate-code/{recovery_code}/{shop_id}")
 async def validate_recovery_code(recovery_code: str, shop_id: str):
     """Validate if a recovery code is valid for a shop"""
-    if recovery_code not in recovery_codes_store:
+    code_info = recovery_code_index.get(cipher.record_id(recovery_code))
+    if code_info is None:
         raise HTTPException(status_code=404, detail="Invalid recovery code")
     
-    code_info = recovery_codes_store[recovery_code]
-    
     if code_info["used"]:
         raise HTTPException(status_code=400, detail="Recovery code has already been used")
     
@@ -704,31 +1126,53 @@ async def validate_recovery_code(recovery_code: str, shop_id: str):
     return {
         "valid": True,
         "shop_id": shop_id,
-        "generated_date": code_info["generated_date"]
+        "generated_date": (await storage_backend.load_record(RECOVERY_CODES_STORE, recovery_code))["generated_date"]
     }
 
 # Battery Brands and Capacities
 @app.get("/api/battery-brands")
-async def get_battery_brands():
+async def get_battery_brands(response: Response, if_none_match: Optional[str] = Header(None)):
+    if etag_matches(if_none_match, BATTERY_BRANDS_ETAG):
+        return not_modified(BATTERY_BRANDS_ETAG)
+    response.headers["ETag"] = BATTERY_BRANDS_ETAG
     return {"brands": BATTERY_BRANDS}
 
 @app.get("/api/battery-capacities")
-async def get_battery_capacities():
+async def get_battery_capacities(response: Response, if_none_match: Optional[str] = Header(None)):
+    if etag_matches(if_none_match, BATTERY_CAPACITIES_ETAG):
+        return not_modified(BATTERY_CAPACITIES_ETAG)
+    response.headers["ETag"] = BATTERY_CAPACITIES_ETAG
     return {"capacities": BATTERY_CAPACITIES}
 
 # Inventory Management
-@app.post("/api/inventory")
-async def add_battery_item(item: BatteryItem):
+def get_shop_partition(shop_id: str) -> ShopPartition:
+    """Returns the shop's own inventory and sales, so requests never touch other shops' data."""
+    if not shop_exists(shop_id):
+        raise HTTPException(status_code=404, detail="Shop not found")
+    if shop_id not in shop_partitions:
+        shop_partitions[shop_id] = ShopPartition()
+    return shop_partitions[shop_id]
+
+@app.post("/api/shops/{shop_id}/inventory")
+async def add_battery_item(shop_id: str, item: BatteryItem):
+    shop = get_shop_partition(shop_id)
     item.id = str(uuid.uuid4())
+    item.shop_id = shop_id
     item.date_added = datetime.now()
-    inventory_store[item.id] = item.dict()
+    shop.add_item(item.dict())
+    await save_record(INVENTORY_STORE, item.id, shop.inventory[item.id])
     return {"message": "Battery item added successfully", "item": item}
 
-@app.get("/api/inventory")
-async def get_inventory():
-    inventory_list = list(inventory_store.values())
-    # Calculate low stock items
-    low_stock_items = [item for item in inventory_list if item["stock_quantity"] <= item["low_stock_alert"]]
+@app.get("/api/shops/{shop_id}/inventory")
+async def get_inventory(shop_id: str, response: Response, if_none_match: Optional[str] = Header(None)):
+    shop = get_shop_partition(shop_id)
+    etag = shop_etag(shop)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    inventory_list = list(shop.inventory.values())
+    # Low stock items, most urgent first
+    low_stock_items = [shop.inventory[item_id] for item_id in shop.low_stock.most_urgent()]
     
     return {
         "inventory": inventory_list,
@@ -737,114 +1181,328 @@ async def get_inventory():
         "low_stock_count": len(low_stock_items)
     }
 
-@app.put("/api/inventory/{item_id}")
-async def update_battery_item(item_id: str, item: BatteryItem):
-    if item_id not in inventory_store:
-        raise HTTPException(status_code=404, detail="Battery item not found")
+def inventory_label(item: dict) -> tuple:
+    """Brand, capacity and model identify an item when an import row carries no known id."""
+    return (item["brand"].lower(), item["capacity"].lower(), item["model"].lower())
+
+@app.post("/api/shops/{shop_id}/inventory/import")
+async def import_inventory(shop_id: str, file: UploadFile = File(...)):
+    """Adds or updates items from a CSV/XLSX upload; invalid rows are reported, not fatal"""
+    shop = get_shop_partition(shop_id)
+    # Parsing and validation are CPU-bound, so they stay off the event loop
+    try:
+        rows, errors, rows_read = await asyncio.get_running_loop().run_in_executor(
+            None, parse_inventory_upload, file.file, file.filename or "", BatteryItem
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Match rows to this shop's items by id, then by brand/capacity/model; later rows win
+    item_ids_by_label = {inventory_label(item): item_id for item_id, item in shop.inventory.items()}
+    records = {}
+    for row in rows:
+        item_id = row.pop("id")
+        if item_id not in shop.inventory:
+            item_id = item_ids_by_label.setdefault(inventory_label(row), str(uuid.uuid4()))
+        records[item_id] = {"id": item_id, "shop_id": shop_id, **row}
+    
+    created = updated = 0
+    async with AsyncExitStack() as locks:
+        for item_id in sorted(item_id for item_id in records if item_id in shop.inventory):
+            await locks.enter_async_context(shop.item_lock(item_id))
+        
+        now = datetime.now()
+        for item_id, record in records.items():
+            record["date_added"] = shop.inventory[item_id]["date_added"] if item_id in shop.inventory else now
+        if records:
+            await save_records(
+                *[(INVENTORY_STORE, item_id, record) for item_id, record in records.items()]
+            )
+        for item_id, record in records.items():
+            if item_id in shop.inventory:
+                shop.replace_item(record)
+                updated += 1
+            else:
+                shop.add_item(record)
+                created += 1
+    
+    return {
+        "message": "Inventory import completed",
+        "rows_read": rows_read,
+        "created": created,
+        "updated": updated,
+        "failed": len(errors),
+        "errors": errors
+    }
+
+@app.get("/api/shops/{shop_id}/inventory/low-stock")
+async def get_low_stock_items(shop_id: str, limit: int = Query(10, ge=1, le=500)):
+    """Items at or below their low stock alert, furthest below it first"""
+    shop = get_shop_partition(shop_id)
+    low_stock_items = []
+    for item_id in shop.low_stock.most_urgent(limit):
+        item = shop.inventory[item_id]
+        low_stock_items.append({**item, "shortfall": item["low_stock_alert"] - item["stock_quantity"]})
     
-    item.id = item_id
-    item.date_added = inventory_store[item_id]["date_added"]
-    inventory_store[item_id] = item.dict()
+    return {
+        "low_stock_items": low_stock_items,
+        "low_stock_count": len(shop.low_stock),
+        "limit": limit
+    }
+
+@app.put("/api/shops/{shop_id}/inventory/{item_id}")
+async def update_battery_item(shop_id: str, item_id: str, item: BatteryItem):
+    shop = get_shop_partition(shop_id)
+    async with shop.item_lock(item_id):
+        if item_id not in shop.inventory:
+            raise HTTPException(status_code=404, detail="Battery item not found")
+        
+        item.id = item_id
+        item.shop_id = shop_id
+        item.date_added = shop.inventory[item_id]["date_added"]
+        await save_record(INVENTORY_STORE, item_id, item.dict())
+        shop.replace_item(item.dict())
     return {"message": "Battery item updated successfully", "item": item}
 
-@app.delete("/api/inventory/{item_id}")
-async def delete_battery_item(item_id: str):
-    if item_id not in inventory_store:
-        raise HTTPException(status_code=404, detail="Battery item not found")
-    
-    del inventory_store[item_id]
+@app.delete("/api/shops/{shop_id}/inventory/{item_id}")
+async def delete_battery_item(shop_id: str, item_id: str):
+    shop = get_shop_partition(shop_id)
+    async with shop.item_lock(item_id):
+        if item_id not in shop.inventory:
+            raise HTTPException(status_code=404, detail="Battery item not found")
+        
+        await save_record(INVENTORY_STORE, item_id, None)
+        shop.delete_item(item_id)
     return {"message": "Battery item deleted successfully"}
 
 # Sales Management
-@app.post("/api/sales")
-async def record_sale(sale: SaleTransaction):
-    # Check if battery exists and has enough stock
-    if sale.battery_id not in inventory_store:
-        raise HTTPException(status_code=404, detail="Battery item not found")
-    
-    battery = inventory_store[sale.battery_id]
-    if battery["stock_quantity"] < sale.quantity_sold:
-        raise HTTPException(status_code=400, detail="Insufficient stock")
-    
-    # Calculate profit
-    purchase_price = battery["purchase_price"]
-    sale.profit_per_unit = sale.unit_price - purchase_price
-    sale.total_profit = sale.profit_per_unit * sale.quantity_sold
-    
-    # Create sale record
-    sale.id = str(uuid.uuid4())
-    sale.sale_date = datetime.now()
-    sale.total_amount = sale.unit_price * sale.quantity_sold
-    
-    # Calculate warranty end date
-    if battery["warranty_months"]:
-        from dateutil.relativedelta import relativedelta
-        sale.warranty_end_date = datetime.now() + relativedelta(months=battery["warranty_months"])
-    
-    # Update inventory stock
-    inventory_store[sale.battery_id]["stock_quantity"] -= sale.quantity_sold
-    
-    # Store sale
-    sales_store[sale.id] = sale.dict()
+def as_local_time(value: Optional[datetime]) -> Optional[datetime]:
+    """Sale dates are naive local times, so query bounds with a UTC offset are converted."""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+@app.post("/api/shops/{shop_id}/sales")
+async def record_sale(shop_id: str, sale: SaleTransaction):
+    shop = get_shop_partition(shop_id)
+    # The stock check, decrement and durable commit for one battery happen under its lock,
+    # so concurrent sales of the same item cannot oversell while other items stay parallel
+    async with shop.item_lock(sale.battery_id):
+        # Check if battery exists and has enough stock
+        if sale.battery_id not in shop.inventory:
+            raise HTTPException(status_code=404, detail="Battery item not found")
+        
+        battery = shop.inventory[sale.battery_id]
+        if battery["stock_quantity"] < sale.quantity_sold:
+            raise HTTPException(status_code=400, detail="Insufficient stock")
+        
+        # Calculate profit
+        purchase_price = battery["purchase_price"]
+        sale.profit_per_unit = sale.unit_price - purchase_price
+        sale.total_profit = sale.profit_per_unit * sale.quantity_sold
+        
+        # Create sale record
+        sale.id = str(uuid.uuid4())
+        sale.shop_id = shop_id
+        sale.sale_date = datetime.now()
+        sale.total_amount = sale.unit_price * sale.quantity_sold
+        
+        # Calculate warranty end date
+        if battery["warranty_months"]:
+            sale.warranty_end_date = datetime.now() + relativedelta(months=battery["warranty_months"])
+        
+        # Persist the sale together with the new stock level, then make both visible
+        updated_battery = {**battery, "stock_quantity": battery["stock_quantity"] - sale.quantity_sold}
+        sale_record = sale.dict()
+        await save_records(
+            (INVENTORY_STORE, sale.battery_id, updated_battery),
+            (SALES_STORE, sale.id, sale_record)
+        )
+        shop.replace_item(updated_battery)
+        shop.add_sale(sale_record, battery)
     
     return {"message": "Sale recorded successfully", "sale": sale}
 
-@app.get("/api/sales")
-async def get_sales():
-    sales_list = list(sales_store.values())
+# Fields printed on a receipt; purchase prices and shop users never leave the server this way
+RECEIPT_BATTERY_FIELDS = ("brand", "capacity", "model", "warranty_months")
+RECEIPT_SHOP_FIELDS = ("shop_name", "proprietor_name", "contact_number", "address", "email", "tax_number")
+
+@app.post("/api/shops/{shop_id}/sales/batch")
+async def record_cart_sale(shop_id: str, cart: CartSale):
+    """Records every line of a counter sale atomically and returns a single receipt"""
+    shop = get_shop_partition(shop_id)
+    battery_ids = sorted({line.battery_id for line in cart.items})
+    async with AsyncExitStack() as locks:
+        # Always locking in id order means two carts sharing batteries cannot deadlock
+        for battery_id in battery_ids:
+            await locks.enter_async_context(shop.item_lock(battery_id))
+        
+        # Validate the whole cart before changing anything
+        requested = {}
+        for line in cart.items:
+            requested[line.battery_id] = requested.get(line.battery_id, 0) + line.quantity_sold
+        errors = []
+        for battery_id, quantity in requested.items():
+            if battery_id not in shop.inventory:
+                errors.append({"battery_id": battery_id, "detail": "Battery item not found"})
+            elif shop.inventory[battery_id]["stock_quantity"] < quantity:
+                errors.append({
+                    "battery_id": battery_id,
+                    "detail": "Insufficient stock",
+                    "requested": quantity,
+                    "available": shop.inventory[battery_id]["stock_quantity"]
+                })
+        if errors:
+            raise HTTPException(status_code=400, detail={"message": "Cart cannot be completed", "errors": errors})
+        
+        # One sale record per line, all sharing the receipt id and sale time
+        receipt_id = str(uuid.uuid4())
+        sale_date = datetime.now()
+        updated_batteries = {battery_id: dict(shop.inventory[battery_id]) for battery_id in battery_ids}
+        sales = []
+        for line in cart.items:
+            battery = shop.inventory[line.battery_id]
+            updated_batteries[line.battery_id]["stock_quantity"] -= line.quantity_sold
+            profit_per_unit = line.unit_price - battery["purchase_price"]
+            sale = SaleTransaction(
+                id=str(uuid.uuid4()),
+                shop_id=shop_id,
+                receipt_id=receipt_id,
+                battery_id=line.battery_id,
+                quantity_sold=line.quantity_sold,
+                unit_price=line.unit_price,
+                total_amount=line.unit_price * line.quantity_sold,
+                customer_name=cart.customer_name,
+                customer_phone=cart.customer_phone,
+                sale_date=sale_date,
+                profit_per_unit=profit_per_unit,
+                total_profit=profit_per_unit * line.quantity_sold
+            )
+            if battery["warranty_months"]:
+                sale.warranty_end_date = sale_date + relativedelta(months=battery["warranty_months"])
+            sales.append(sale.dict())
+        
+        # Every stock change and sale line goes to disk in a single commit
+        await save_records(
+            *[(INVENTORY_STORE, battery_id, battery) for battery_id, battery in updated_batteries.items()],
+            *[(SALES_STORE, sale["id"], sale) for sale in sales]
+        )
+        batteries = {battery_id: shop.inventory[battery_id] for battery_id in battery_ids}
+        for battery in updated_batteries.values():
+            shop.replace_item(battery)
+        for sale in sales:
+            shop.add_sale(sale, batteries[sale["battery_id"]])
+    
+    # Same shape as generateReceiptData() in Receipt.js, plus one entry per cart line
+    shop_config = await load_shop_config(shop_id) or {}
+    receipt = {
+        "sale": {
+            "id": receipt_id,
+            "shop_id": shop_id,
+            "sale_date": sale_date,
+            "customer_name": cart.customer_name,
+            "customer_phone": cart.customer_phone,
+            "sold_by": cart.sold_by,
+            "quantity_sold": sum(sale["quantity_sold"] for sale in sales),
+            "total_amount": sum(sale["total_amount"] for sale in sales)
+        },
+        "items": [
+            {
+                "sale": sale,
+                "battery": {field: batteries[sale["battery_id"]].get(field) for field in RECEIPT_BATTERY_FIELDS}
+            }
+            for sale in sales
+        ],
+        "shopConfig": {field: shop_config.get(field) for field in RECEIPT_SHOP_FIELDS}
+    }
     
-    # Calculate totals
-    total_sales = sum(sale["total_amount"] for sale in sales_list)
-    total_profit = sum(sale["total_profit"] for sale in sales_list)
+    return {"message": "Sale recorded successfully", "sales": sales, "receipt": receipt}
+
+@app.get("/api/shops/{shop_id}/sales")
+async def get_sales(
+    shop_id: str,
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    from_date: Optional[datetime] = Query(None, alias="from"),
+    to_date: Optional[datetime] = Query(None, alias="to"),
+    if_none_match: Optional[str] = Header(None)
+):
+    """Sales newest first, one page at a time; pass next_cursor back to get the next page"""
+    shop = get_shop_partition(shop_id)
+    etag = shop_etag(shop)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    from_date, to_date = as_local_time(from_date), as_local_time(to_date)
+    try:
+        sale_ids, next_cursor = shop.sale_dates.page(limit, cursor, from_date, to_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     
+    # Totals come from the running dashboard counters
     return {
-        "sales": sales_list,
-        "total_sales_count": len(sales_list),
-        "total_sales_amount": total_sales,
-        "total_profit": total_profit
+        "sales": [shop.sales[sale_id] for sale_id in sale_ids],
+        "next_cursor": next_cursor,
+        "limit": limit,
+        "total_sales_count": shop.dashboard.sales_count,
+        "total_sales_amount": shop.dashboard.sales_amount,
+        "total_profit": shop.dashboard.total_profit
     }
 
+@app.get("/api/shops/{shop_id}/sales/summary")
+async def get_sales_summary(
+    shop_id: str,
+    from_date: Optional[datetime] = Query(None, alias="from"),
+    to_date: Optional[datetime] = Query(None, alias="to"),
+    granularity: str = "daily"
+):
+    """Sales totals per period for a date range, answered from the rollups"""
+    shop = get_shop_partition(shop_id)
+    from_date, to_date = as_local_time(from_date), as_local_time(to_date)
+    if granularity not in ROLLUP_GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of: {', '.join(ROLLUP_GRANULARITIES)}")
+    if from_date and to_date and from_date > to_date:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    
+    summary = shop.rollups.summary(granularity, from_date, to_date)
+    summary["from"] = from_date
+    summary["to"] = to_date
+    return summary
+
 # Dashboard Analytics
-@app.get("/api/dashboard")
-async def get_dashboard_stats():
-    inventory_list = list(inventory_store.values())
-    sales_list = list(sales_store.values())
-    
-    # Inventory stats
-    total_inventory_items = len(inventory_list)
-    total_stock_quantity = sum(item["stock_quantity"] for item in inventory_list)
-    low_stock_items = [item for item in inventory_list if item["stock_quantity"] <= item["low_stock_alert"]]
-    total_inventory_value = sum(item["stock_quantity"] * item["purchase_price"] for item in inventory_list)
+@app.get("/api/shops/{shop_id}/dashboard")
+async def get_dashboard_stats(shop_id: str, response: Response, if_none_match: Optional[str] = Header(None)):
+    shop = get_shop_partition(shop_id)
+    etag = shop_etag(shop)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    stats = shop.dashboard
+    
+    # The five items furthest below their alert level
+    low_stock_items = [shop.inventory[item_id] for item_id in shop.low_stock.most_urgent(5)]
     
     # Sales stats
-    total_sales_count = len(sales_list)
-    total_sales_amount = sum(sale["total_amount"] for sale in sales_list)
-    total_profit = sum(sale["total_profit"] for sale in sales_list)
+    total_sales_count = stats.sales_count
+    total_sales_amount = stats.sales_amount
+    total_profit = stats.total_profit
     
     # Top selling batteries
-    battery_sales = {}
-    for sale in sales_list:
-        battery_id = sale["battery_id"]
-        if battery_id in battery_sales:
-            battery_sales[battery_id] += sale["quantity_sold"]
-        else:
-            battery_sales[battery_id] = sale["quantity_sold"]
-    
     top_selling = []
-    for battery_id, quantity in sorted(battery_sales.items(), key=lambda x: x[1], reverse=True)[:5]:
-        if battery_id in inventory_store:
-            battery = inventory_store[battery_id]
-            top_selling.append({
-                "battery": f"{battery['brand']} {battery['capacity']} {battery['model']}",
-                "quantity_sold": quantity
-            })
+    for battery_id in stats.top_selling:
+        battery = shop.inventory[battery_id]
+        top_selling.append({
+            "battery": f"{battery['brand']} {battery['capacity']} {battery['model']}",
+            "quantity_sold": stats.sold_quantities[battery_id]
+        })
     
     return {
         "inventory": {
-            "total_items": total_inventory_items,
-            "total_stock": total_stock_quantity,
-            "low_stock_count": len(low_stock_items),
-            "inventory_value": total_inventory_value
+            "total_items": stats.total_items,
+            "total_stock": stats.total_stock,
+            "low_stock_count": len(shop.low_stock),
+            "inventory_value": stats.inventory_value
         },
         "sales": {
             "total_sales": total_sales_count,
@@ -853,8 +1511,112 @@ async def get_dashboard_stats():
             "average_sale": total_sales_amount / total_sales_count if total_sales_count > 0 else 0
         },
         "top_selling": top_selling,
-        "low_stock_items": low_stock_items[:5]  # Show top 5 low stock items
+        "low_stock_items": low_stock_items  # Show top 5 low stock items
+    }
+
+# Delta Sync
+@app.get("/api/shops/{shop_id}/sync")
+async def sync_shop(shop_id: str, since: int = Query(0, ge=0)):
+    """Inventory and sales changes after sequence ``since``; pass the returned seq next time.
+
+    With reset true the response holds every current record and the client should
+    replace its local copy instead of merging.
+    """
+    shop = get_shop_partition(shop_id)
+    changes = shop.changes.since(since)
+    reset = changes is None
+    if reset:
+        changes = shop.changes.live_records()
+    
+    payload = {
+        "seq": shop.changes.sequence,
+        "reset": reset,
+        "inventory": {"upserts": [], "deletes": []},
+        "sales": {"upserts": [], "deletes": []}
     }
+    for collection, record_id, record in changes:
+        if record is None:
+            payload[collection]["deletes"].append(record_id)
+        else:
+            payload[collection]["upserts"].append(record)
+    return payload
+
+# Live Updates
+@app.get("/api/shops/{shop_id}/events")
+async def stream_shop_events(shop_id: str, request: Request):
+    """Server-Sent Events stream of the shop's inventory and sales changes.
+
+    Each event carries the change sequence; after a 'resync' event (the client fell
+    too far behind) or a reconnect, catch up through /sync.
+    """
+    shop = get_shop_partition(shop_id)
+    subscription = shop.events.subscribe(EVENT_QUEUE_SIZE)
+    
+    async def event_stream():
+        try:
+            yield f"retry: 3000\nevent: ready\ndata: {json.dumps({'seq': shop.changes.sequence})}\n\n"
+            while not subscription.dropped or not subscription.queue.empty():
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), EVENT_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"id: {event['seq']}\nevent: change\ndata: {json.dumps(event)}\n\n"
+            yield f"event: resync\ndata: {json.dumps({'seq': shop.changes.sequence})}\n\n"
+        finally:
+            shop.events.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Exports
+def attachment_header(filename: str) -> str:
+    """Content-Disposition for a download: an ASCII fallback plus the UTF-8 name (RFC 6266/5987)."""
+    ascii_name = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore").decode("ascii")
+    ascii_name = re.sub(r'[^A-Za-z0-9.-]+', "_", ascii_name).strip("_") or "export"
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+async def export_response(shop_id: str, report, export_format: str, period: Optional[str], name: str) -> StreamingResponse:
+    """Streams a report as it is generated; the body is never held in memory as a whole."""
+    shop_config = await load_shop_config(shop_id)
+    if shop_config is None:
+        raise HTTPException(status_code=404, detail="Shop not found")
+    media_type, extension = EXPORT_FORMATS[export_format]
+    filename = f"{shop_config['shop_name'].replace(' ', '_')}_{name}_{datetime.now().strftime('%Y-%m-%d')}.{extension}"
+    return StreamingResponse(
+        stream_report(report, export_format, shop_config, period),
+        media_type=media_type,
+        headers={"Content-Disposition": attachment_header(filename)}
+    )
+
+@app.get("/api/shops/{shop_id}/export/sales")
+async def export_sales(
+    shop_id: str,
+    format: str = Query("csv", pattern="^(csv|xlsx|pdf)$"),
+    from_date: Optional[datetime] = Query(None, alias="from"),
+    to_date: Optional[datetime] = Query(None, alias="to")
+):
+    """Sales oldest first as CSV, XLSX or PDF, optionally limited to a date range"""
+    shop = get_shop_partition(shop_id)
+    from_date, to_date = as_local_time(from_date), as_local_time(to_date)
+    period = "All Time"
+    if from_date or to_date:
+        period = f"{from_date.strftime('%d/%m/%Y') if from_date else 'Start'} to {to_date.strftime('%d/%m/%Y') if to_date else 'Today'}"
+    report = SalesReport(shop.sale_dates.iter_range(from_date, to_date), shop.sales, shop.inventory, UNKNOWN_BATTERY)
+    return await export_response(shop_id, report, format, period, "Sales")
+
+@app.get("/api/shops/{shop_id}/export/inventory")
+async def export_inventory(shop_id: str, format: str = Query("csv", pattern="^(csv|xlsx|pdf)$")):
+    """Current inventory as CSV, XLSX or PDF"""
+    shop = get_shop_partition(shop_id)
+    # Only the ids are copied up front; items are read as the export streams
+    report = InventoryReport(list(shop.inventory), shop.inventory)
+    return await export_response(shop_id, report, format, None, "Inventory")
 
 # User Management (Basic)
 @app.post("/api/users")
@@ -870,24 +1632,32 @@ async def get_user(uid: str):
 
 # ===== SECURITY UTILITIES =====
 
+@app.post("/api/admin/rotate-encryption-key")
+async def rotate_encryption_key_endpoint(authorization: Optional[str] = Header(None)):
+    """Admin endpoint to re-encrypt all data under a new key while the server keeps serving.
+
+    Uses the key staged by ``setup_credentials.py rotate-key`` if there is one, otherwise
+    a new random key. Progress is reported by /api/admin/security-status.
+    """
+    await authorize_admin(authorization)
+    if key_rotation["state"] == "running":
+        raise HTTPException(status_code=409, detail="A key rotation is already running")
+    if len(cipher.keys) == 1:
+        stage_key_rotation(ENCRYPTION_KEY_FILE, staged_key(ENCRYPTION_KEY_FILE) or Fernet.generate_key(), cipher)
+    start_key_rotation()
+    return {"message": "Key rotation started", "warning": RECORD_ID_ROTATION_WARNING, "key_rotation": key_rotation}
+
 @app.get("/api/admin/security-status")
-async def get_security_status(admin_key: str, username: str, password: str):
+async def get_security_status(authorization: Optional[str] = Header(None)):
     """Admin endpoint to check security status"""
-    try:
-        await authenticate_admin(AdminAuthRequest(
-            admin_key=admin_key,
-            username=username,
-            password=password
-        ))
-    except HTTPException:
-        raise HTTPException(status_code=401, detail="Admin authentication failed")
+    await authorize_admin(authorization)
     
     # Count various security metrics
-    total_shops = len(shop_config_store)
-    total_licenses = len(license_keys_store)
-    used_licenses = len([k for k, v in license_keys_store.items() if v.get("used", False)])
-    total_recovery_codes = len(recovery_codes_store)
-    used_recovery_codes = len([k for k, v in recovery_codes_store.items() if v.get("used", False)])
+    total_shops = len(shop_index)
+    total_licenses = len(license_index)
+    used_licenses = len([v for v in license_index.values() if v.get("used", False)])
+    total_recovery_codes = len(recovery_code_index)
+    used_recovery_codes = len([v for v in recovery_code_index.values() if v.get("used", False)])
     
     return {
         "shops": {
@@ -906,6 +1676,14 @@ async def get_security_status(admin_key: str, username: str, password: str):
         },
         "admin_accounts": len(admin_accounts_store),
         "security_files_encrypted": True,
+        "password_hashing": password_hash_queue_stats(),
+        "storage": storage_backend.stats(),
+        "key_rotation": key_rotation,
+        "shop_config_cache": {**shop_config_cache.stats, "cached": len(shop_config_cache), "capacity": shop_config_cache.capacity},
+        "event_streams": {
+            "subscribers": sum(len(shop.events) for shop in shop_partitions.values()),
+            "dropped_slow_clients": sum(shop.events.dropped_subscribers for shop in shop_partitions.values())
+        },
         "last_updated": datetime.now().isoformat()
     }
 
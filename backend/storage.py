@@ -0,0 +1,687 @@
+"""
+Encrypted storage engine for the Murick Battery SaaS backend.
+
+Every store is kept in two files: a snapshot (e.g. ``shops.dat``) and an append-only
+journal next to it (``shops.dat.log``). Both hold one line per record change:
+
+    {"id": <keyed hash of the record key>, "op": "set", "public": {...}, "entry": <Fernet token>}
+
+The token encrypts the record key and value; ``public`` carries the few fields a
+store declares queryable (a license's plan and used flag), so a store can be
+scanned, and a single record found and decrypted, without decrypting the others.
+A mutation appends one line to the journal; on startup the journal is replayed on
+top of the snapshot. Snapshots written before records had their own lines (one token
+over the whole store) are still read, and count as needing a compaction so they are
+rewritten in the new format at the first opportunity.
+
+Snapshots are never rewritten in place: a new one is written to a temporary file,
+fsynced and renamed over the old one, which is kept as ``shops.dat.prev`` together
+with the journal it absorbed (``shops.dat.log.prev``). If the current snapshot cannot
+be read, the previous generation plus the journals reproduce the same state.
+
+The key is rotated without downtime: the new key is staged next to the old one, new
+writes use it straight away while reads accept both, and a re-encrypting compaction
+moves every store over before the old key is retired. Record ids are not re-keyed:
+the id key is kept across rotations (see RECORD_ID_ROTATION_WARNING).
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import time
+from collections import namedtuple
+from datetime import datetime
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+
+JOURNAL_SUFFIX = ".log"
+COMPACTING_SUFFIX = ".compacting"
+PREVIOUS_SUFFIX = ".prev"
+# First line of a snapshot written one record per line
+RECORDS_HEADER = b"MURICK-RECORDS/1\n"
+# Next to the key file: the new key while a rotation is in progress, and the record id key
+NEXT_KEY_SUFFIX = ".next"
+RECORD_ID_KEY_FILENAME = "record_id.key"
+# Shown whenever a rotation starts, since it re-encrypts records but leaves their ids as they are
+RECORD_ID_ROTATION_WARNING = (
+    "Record ids are not re-keyed by a rotation. They are keyed hashes of license keys, recovery codes "
+    "and other record keys, so anyone holding the old key and a copy of the data can still check guessed "
+    "license keys or recovery codes against them. If the old key was stolen, issue new ones."
+)
+
+# Number of entries appended to each journal since it was last rotated
+journal_entry_counts = {}
+# Outcome of the most recent compaction of each store, keyed by snapshot filename
+compaction_stats = {}
+
+
+def derive_record_id_key(key: bytes) -> bytes:
+    return hashlib.sha256(b"record-id:" + key).digest()
+
+
+class RecordCipher:
+    """Fernet for record contents plus a keyed hash that turns record keys into ids.
+
+    Ids keep license keys and recovery codes out of the files in clear while still
+    letting a record be found without decrypting the rest of its store. ``keys`` are
+    tried in order when decrypting and the first one encrypts, so during a key
+    rotation records under either key stay readable. The id key outlives rotations.
+    """
+
+    def __init__(self, keys, id_key: bytes):
+        self.use_keys(keys)
+        self.id_key = id_key
+
+    @classmethod
+    def from_key(cls, key: bytes):
+        return cls([key], derive_record_id_key(key))
+
+    def use_keys(self, keys):
+        self.keys = list(keys)
+        self.fernet = MultiFernet([Fernet(key) for key in self.keys])
+
+    def encrypt(self, data: bytes) -> bytes:
+        return self.fernet.encrypt(data)
+
+    def decrypt(self, token) -> bytes:
+        return self.fernet.decrypt(token)
+
+    def rotate(self, token: bytes) -> bytes:
+        """Re-encrypts a token made with any of the keys under the first one."""
+        return self.fernet.rotate(token)
+
+    def record_id(self, key: str) -> str:
+        return hmac.new(self.id_key, str(key).encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+
+# One parsed record line. ``raw`` is the stored line and ``location`` its (path, offset),
+# both None if it was read from an older format; ``entry`` is the decrypted
+# {"op", "key", "value"} when it was needed.
+RecordLine = namedtuple("RecordLine", "id op public raw entry location")
+
+
+def journal_path(filename: str) -> str:
+    """Path of the append-only journal that belongs to a snapshot file."""
+    return filename + JOURNAL_SUFFIX
+
+
+def compacting_journal_path(filename: str) -> str:
+    """Path a journal is moved to while a compaction folds it into a new snapshot."""
+    return journal_path(filename) + COMPACTING_SUFFIX
+
+
+def previous_snapshot_path(filename: str) -> str:
+    return filename + PREVIOUS_SUFFIX
+
+
+def previous_journal_path(filename: str) -> str:
+    return journal_path(filename) + PREVIOUS_SUFFIX
+
+
+class StoreCorruptedError(Exception):
+    """Neither the current nor the previous generation of a store can be decrypted."""
+
+
+def json_default(value):
+    """Serializes datetimes the way the API returns them (ISO 8601), anything else as a string."""
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def encode_record_line(cipher, key: str, value=None, op: str = "set", public_fields=()) -> bytes:
+    """Encodes a single record change as one line: id and public fields in clear, the rest encrypted."""
+    entry = json.dumps({"op": op, "key": key, "value": value}, default=json_default).encode('utf-8')
+    line = {"id": cipher.record_id(key), "op": op}
+    if op == "set" and public_fields:
+        line["public"] = {field: value.get(field) for field in public_fields}
+    line["entry"] = cipher.encrypt(entry).decode('ascii')
+    return json.dumps(line, default=json_default).encode('utf-8') + b"\n"
+
+
+def _line_from_entry(cipher, entry: dict, public_fields) -> RecordLine:
+    """A line for an entry read from an older format; it is only encoded again if rewritten."""
+    public = None
+    if entry["op"] == "set" and public_fields:
+        public = {field: entry["value"].get(field) for field in public_fields}
+    return RecordLine(cipher.record_id(entry["key"]), entry["op"], public, None, entry, None)
+
+
+def _encoded_line(line: RecordLine, cipher, public_fields) -> bytes:
+    if line.raw is not None:
+        return line.raw
+    return encode_record_line(cipher, line.entry["key"], line.entry["value"], line.op, public_fields)
+
+
+def _parse_record_line(raw: bytes, cipher, public_fields, decrypt: bool, location=None) -> RecordLine:
+    """Parses one stored line; raises InvalidToken or ValueError if it is damaged."""
+    line = json.loads(raw)
+    entry = json.loads(cipher.decrypt(line["entry"])) if decrypt else None
+    return RecordLine(line["id"], line["op"], line.get("public"), raw + b"\n", entry, location)
+
+
+def decrypt_record_line(line: RecordLine, cipher) -> dict:
+    """The decrypted {"op", "key", "value"} of a line."""
+    if line.entry is not None:
+        return line.entry
+    return json.loads(cipher.decrypt(json.loads(line.raw)["entry"]))
+
+
+def _read_snapshot_lines(path: str, cipher, public_fields, decrypt: bool):
+    """Returns the snapshot's record lines, or None if the file does not exist."""
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    with f:
+        if f.read(len(RECORDS_HEADER)) != RECORDS_HEADER:
+            # A whole store encrypted as a single token
+            f.seek(0)
+            data = json.loads(cipher.decrypt(f.read()))
+            return [_line_from_entry(cipher, {"op": "set", "key": key, "value": value}, public_fields)
+                    for key, value in data.items()]
+        lines, offset = [], len(RECORDS_HEADER)
+        for raw in f:
+            if raw.strip():
+                lines.append(_parse_record_line(raw.strip(), cipher, public_fields, decrypt, (path, offset)))
+            offset += len(raw)
+        return lines
+
+
+def _read_journal_lines(path: str, cipher, public_fields, decrypt: bool) -> list:
+    lines = []
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return lines
+    offset = 0
+    with f:
+        for raw in f:
+            location, offset = (path, offset), offset + len(raw)
+            raw = raw.strip()
+            if not raw:
+                continue
+            try:
+                lines.append(_parse_record_line(raw, cipher, public_fields, decrypt, location))
+            except (InvalidToken, ValueError, KeyError):
+                # Only a torn write at the tail can produce this; earlier entries are intact
+                print(f"⚠️  Skipping unreadable journal entry in {path}")
+    return lines
+
+
+def _read_store_lines(filename: str, cipher, public_fields=(), decrypt: bool = False, journals=None):
+    """Returns (snapshot lines, journal lines) in replay order.
+
+    When the snapshot is missing or unreadable but a previous generation exists, that
+    generation and its journal are read instead. A store that exists but cannot be
+    read raises StoreCorruptedError rather than coming back empty. ``decrypt`` also
+    checks every snapshot token, so a damaged one falls back instead of failing later.
+    """
+    if journals is None:
+        journals = [compacting_journal_path(filename), journal_path(filename)]
+    try:
+        snapshot = _read_snapshot_lines(filename, cipher, public_fields, decrypt)
+    except (InvalidToken, ValueError, KeyError):
+        print(f"⚠️  {filename} is unreadable, falling back to its previous generation")
+        if not os.path.exists(previous_snapshot_path(filename)):
+            raise StoreCorruptedError(f"{filename} cannot be decrypted and has no previous generation")
+        snapshot = None
+
+    if snapshot is None:
+        try:
+            snapshot = _read_snapshot_lines(previous_snapshot_path(filename), cipher, public_fields, decrypt)
+        except (InvalidToken, ValueError, KeyError):
+            raise StoreCorruptedError(f"Neither {filename} nor its previous generation can be decrypted")
+        if snapshot is None:
+            # A store that has never been snapshotted
+            snapshot = []
+        else:
+            journals = [previous_journal_path(filename)] + journals
+
+    journal_lines = []
+    for path in journals:
+        journal_lines.extend(_read_journal_lines(path, cipher, public_fields, decrypt))
+    return snapshot, journal_lines
+
+
+def apply_journal_entry(data: dict, entry: dict):
+    if entry["op"] == "delete":
+        data.pop(entry["key"], None)
+    else:
+        data[entry["key"]] = entry["value"]
+
+
+def load_store(filename: str, cipher, public_fields=()) -> dict:
+    """Loads and decrypts a whole store: its snapshot with the journals replayed on top."""
+    snapshot, journal = _read_store_lines(filename, cipher, public_fields, decrypt=True)
+    data = {}
+    for line in snapshot + journal:
+        apply_journal_entry(data, line.entry)
+    journal_entry_counts[filename] = len(journal)
+    return data
+
+
+def locate_records(filename: str, cipher, public_fields=()):
+    """Returns ({record id: public fields}, {record id: (path, offset)}) without decrypting records.
+
+    The location is that of each record's latest line; records only found in an older
+    format have none.
+    """
+    snapshot, journal = _read_store_lines(filename, cipher, public_fields)
+    index, locations = {}, {}
+    for line in snapshot + journal:
+        if line.op == "delete":
+            index.pop(line.id, None)
+            locations.pop(line.id, None)
+            continue
+        index[line.id] = line.public or {}
+        if line.location is None:
+            locations.pop(line.id, None)
+        else:
+            locations[line.id] = line.location
+    return index, locations
+
+
+def load_public_fields(filename: str, cipher, public_fields=()) -> dict:
+    """Record id -> public fields of every record, without decrypting any record."""
+    return locate_records(filename, cipher, public_fields)[0]
+
+
+def read_record_at(location, cipher, key: str):
+    """Decrypts the record whose line starts at ``location``.
+
+    Raises LookupError when the line there is not that record, e.g. because a
+    compaction has since rewritten the file; callers then fall back to load_record().
+    """
+    path, offset = location
+    try:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            line = json.loads(f.readline())
+        if line["id"] != cipher.record_id(key) or line["op"] != "set":
+            raise LookupError(key)
+        entry = json.loads(cipher.decrypt(line["entry"]))
+    except (OSError, ValueError, KeyError, TypeError, InvalidToken):
+        raise LookupError(key)
+    if entry["key"] != key:
+        raise LookupError(key)
+    return entry["value"]
+
+
+def load_record(filename: str, cipher, key: str, public_fields=()):
+    """Decrypts only the latest version of one record; None if it does not exist."""
+    record_id = cipher.record_id(key)
+    latest = None
+    snapshot, journal = _read_store_lines(filename, cipher, public_fields)
+    for line in snapshot + journal:
+        if line.id == record_id:
+            latest = line
+    if latest is None or latest.op == "delete":
+        return None
+    return decrypt_record_line(latest, cipher)["value"]
+
+
+def _fsync_directory(filename: str):
+    """Makes renames durable; Windows cannot open directories and does not need this."""
+    if os.name == "nt":
+        return
+    fd = os.open(os.path.dirname(filename) or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _install_snapshot(lines, filename: str, folded_journals):
+    """Atomically replaces a snapshot, keeping the old one as the previous generation.
+
+    ``folded_journals`` are the journal files whose entries the new snapshot already
+    contains. They become the previous generation's journal, so the ``.prev`` snapshot
+    plus ``.log.prev`` always reproduce the current snapshot.
+    """
+    temp_path = filename + ".tmp"
+    records = 0
+    with open(temp_path, 'wb') as f:
+        f.write(RECORDS_HEADER)
+        for line in lines:
+            f.write(line)
+            records += 1
+        f.flush()
+        os.fsync(f.fileno())
+
+    if os.path.exists(previous_journal_path(filename)):
+        os.remove(previous_journal_path(filename))
+    if os.path.exists(filename):
+        os.replace(filename, previous_snapshot_path(filename))
+    os.replace(temp_path, filename)
+
+    folded_journals = [path for path in folded_journals if os.path.exists(path)]
+    if len(folded_journals) == 1:
+        os.replace(folded_journals[0], previous_journal_path(filename))
+    elif folded_journals:
+        with open(previous_journal_path(filename), 'wb') as f:
+            for path in folded_journals:
+                with open(path, 'rb') as journal:
+                    f.write(journal.read())
+        for path in folded_journals:
+            os.remove(path)
+    _fsync_directory(filename)
+    return records
+
+
+def write_snapshot(data: dict, filename: str, cipher, public_fields=()):
+    """Encrypts and saves a full snapshot, one line per record, retiring the journals it replaces."""
+    lines = (encode_record_line(cipher, key, value, "set", public_fields) for key, value in data.items())
+    _install_snapshot(lines, filename, [compacting_journal_path(filename), journal_path(filename)])
+    journal_entry_counts[filename] = 0
+
+
+class GroupCommit:
+    """Durable batched writes with group commit.
+
+    Changes committed within ``window_seconds`` of each other are written together in
+    a worker thread, and every caller resumes only once its changes are durable.
+    Batches are written strictly one after another, so storage order always matches
+    commit order. Subclasses turn changes into writes.
+    """
+
+    # Errors that fail the callers of a batch instead of escaping the flush task
+    write_errors = (OSError,)
+
+    def __init__(self, window_seconds: float, executor=None):
+        self.window_seconds = window_seconds
+        self.executor = executor
+        self._pending = []  # (prepared change, future)
+        self._flush_task = None
+        self._write_lock = None
+        self.stats = {"batches": 0, "entries": 0, "fsyncs": 0, "largest_batch": 0}
+
+    async def commit(self, changes):
+        """Writes ``(store, key, record)`` changes, where a record of None deletes the key."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        for change in changes:
+            self._pending.append((self.prepare(change), future))
+        if self._flush_task is None:
+            self._flush_task = loop.create_task(self._flush_after_window())
+        await future
+
+    async def between_batches(self, function, *args):
+        """Runs ``function`` on the event loop while no batch is being written."""
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        async with self._write_lock:
+            return function(*args)
+
+    async def flush(self):
+        """Returns once every change committed before the call has been written."""
+        if self._flush_task is not None:
+            await self._flush_task
+        if self._write_lock is not None:
+            async with self._write_lock:
+                pass
+
+    def prepare(self, change):
+        """Runs on the event loop when a change is committed."""
+        return change
+
+    def write_batch(self, batch) -> int:
+        """Makes the prepared changes durable and returns the number of fsyncs it took."""
+        raise NotImplementedError
+
+    def batch_written(self, batch):
+        pass
+
+    async def _flush_after_window(self):
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        await asyncio.sleep(self.window_seconds)
+        pending, self._pending = self._pending, []
+        self._flush_task = None
+        batch = [change for change, _ in pending]
+        async with self._write_lock:
+            try:
+                fsyncs = await asyncio.get_running_loop().run_in_executor(self.executor, self.write_batch, batch)
+            except self.write_errors as e:
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+        self.batch_written(batch)
+        self.stats["batches"] += 1
+        self.stats["entries"] += len(batch)
+        self.stats["fsyncs"] += fsyncs
+        self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+        for _, future in pending:
+            if not future.done():
+                future.set_result(None)
+
+
+class GroupCommitJournal(GroupCommit):
+    """Group-committed journal appends, with a single write and fsync per journal file.
+
+    Changes are ``(filename, key, record, public_fields)``. ``on_appended(filename, line,
+    location)`` is called on the event loop for every line once it is durable.
+    """
+
+    def __init__(self, cipher, window_seconds: float, on_appended=None):
+        super().__init__(window_seconds)
+        self.cipher = cipher
+        self.on_appended = on_appended
+
+    def prepare(self, change):
+        filename, key, record, public_fields = change
+        op = "delete" if record is None else "set"
+        # The last slot receives the line's location in write_batch
+        return [filename, encode_record_line(self.cipher, key, record, op, public_fields), None]
+
+    def write_batch(self, batch) -> int:
+        changes_by_file = {}
+        for change in batch:
+            changes_by_file.setdefault(change[0], []).append(change)
+        for filename, changes in changes_by_file.items():
+            path = journal_path(filename)
+            with open(path, 'ab') as f:
+                offset = f.seek(0, os.SEEK_END)
+                for change in changes:
+                    change[2] = (path, offset)
+                    offset += len(change[1])
+                f.write(b"".join(change[1] for change in changes))
+                f.flush()
+                os.fsync(f.fileno())
+        return len(changes_by_file)
+
+    def batch_written(self, batch):
+        for filename, line, location in batch:
+            journal_entry_counts[filename] = journal_entry_counts.get(filename, 0) + 1
+            if self.on_appended is not None:
+                self.on_appended(filename, line, location)
+
+
+# ===== SNAPSHOT COMPACTION =====
+
+def is_legacy_snapshot(filename: str) -> bool:
+    """True if the snapshot is a single token over the whole store rather than one line per record."""
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(RECORDS_HEADER)) != RECORDS_HEADER
+    except FileNotFoundError:
+        return False
+
+
+def journal_needs_compaction(filename: str, max_bytes: int, max_entries: int) -> bool:
+    """True once the journal has grown past either limit, a compaction was interrupted
+    or the snapshot is still in the whole-store format."""
+    if os.path.exists(compacting_journal_path(filename)) or is_legacy_snapshot(filename):
+        return True
+    try:
+        size = os.path.getsize(journal_path(filename))
+    except FileNotFoundError:
+        return False
+    return size >= max_bytes or journal_entry_counts.get(filename, 0) >= max_entries
+
+
+def _rotate_journal(filename: str):
+    """Moves the live journal aside so new appends start a fresh one."""
+    live, rotated = journal_path(filename), compacting_journal_path(filename)
+    if not os.path.exists(live):
+        return
+    if os.path.exists(rotated):
+        # Left over from an interrupted compaction: keep both, in order
+        with open(live, 'rb') as src, open(rotated, 'ab') as dst:
+            dst.write(src.read())
+        os.remove(live)
+    else:
+        os.replace(live, rotated)
+
+
+def _write_compacted_snapshot(filename: str, cipher, public_fields, reencrypt: bool = False) -> int:
+    """Merges the snapshot with the rotated journal, keeping the latest line of each record."""
+    snapshot, journal = _read_store_lines(filename, cipher, public_fields, journals=[compacting_journal_path(filename)])
+    latest = {}
+    for line in snapshot + journal:
+        if line.op == "delete":
+            latest.pop(line.id, None)
+        else:
+            latest[line.id] = _encoded_line(line, cipher, public_fields)
+    lines = latest.values()
+    if reencrypt:
+        lines = (_reencrypt_line(line, cipher) for line in lines)
+    return _install_snapshot(lines, filename, [compacting_journal_path(filename)])
+
+
+async def compact_store(filename: str, cipher, public_fields=(), reencrypt: bool = False, writer=None) -> dict:
+    """Folds a store's journal into a fresh snapshot.
+
+    Lines are merged by record id without decrypting them, in a worker thread. Only
+    the journal rotated out at the start is folded in; appends that arrive meanwhile
+    go to a fresh journal. ``writer`` is the GroupCommitJournal appending to the store:
+    the journal is only rotated between its batches, so a batch that already opened
+    it cannot land in it after the merge has read it. With ``reencrypt`` every line
+    is re-encrypted under the cipher's first key on its way into the snapshot.
+    """
+    started = time.perf_counter()
+    if writer is not None:
+        await writer.between_batches(_rotate_journal, filename)
+    else:
+        _rotate_journal(filename)
+    entries = journal_entry_counts.get(filename, 0)
+    journal_entry_counts[filename] = 0
+    records = await asyncio.get_running_loop().run_in_executor(
+        None, _write_compacted_snapshot, filename, cipher, public_fields, reencrypt
+    )
+    stats = {
+        "entries_compacted": entries,
+        "records": records,
+        "snapshot_bytes": os.path.getsize(filename),
+        "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+        "compacted_at": datetime.now().isoformat()
+    }
+    compaction_stats[filename] = stats
+    return stats
+
+
+# ===== KEY ROTATION =====
+
+def next_key_path(key_file: str) -> str:
+    return key_file + NEXT_KEY_SUFFIX
+
+
+def record_id_key_path(key_file: str) -> str:
+    return os.path.join(os.path.dirname(key_file), RECORD_ID_KEY_FILENAME)
+
+
+def _write_key_file(path: str, data: bytes):
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    _fsync_directory(path)
+
+
+def load_cipher(key_file: str) -> RecordCipher:
+    """The cipher for the key in ``key_file``, led by the new key while a rotation is in progress.
+
+    Record ids are keyed with the id key saved by the first rotation, or derived from
+    the key itself when the key has never been rotated.
+    """
+    with open(key_file, 'rb') as f:
+        keys = [f.read()]
+    if os.path.exists(next_key_path(key_file)):
+        with open(next_key_path(key_file), 'rb') as f:
+            keys.insert(0, f.read())
+    cipher = RecordCipher(keys, derive_record_id_key(keys[-1]))
+    if os.path.exists(record_id_key_path(key_file)):
+        with open(record_id_key_path(key_file), 'rb') as f:
+            cipher.id_key = cipher.decrypt(f.read())
+    return cipher
+
+
+def staged_key(key_file: str):
+    """The new key of a rotation that has been started but not finished, or None."""
+    try:
+        with open(next_key_path(key_file), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def stage_key_rotation(key_file: str, new_key: bytes, cipher):
+    """Starts rotating to ``new_key``: from here on the cipher encrypts with it.
+
+    The new key is saved next to the old one before anything is encrypted with it, and
+    the id key is saved wrapped in the new key, so a restart mid-rotation can read
+    every record and compute the same record ids.
+    """
+    _write_key_file(next_key_path(key_file), new_key)
+    cipher.use_keys([new_key] + [key for key in cipher.keys if key != new_key])
+    _write_key_file(record_id_key_path(key_file), cipher.encrypt(cipher.id_key))
+
+
+def finish_key_rotation(key_file: str, cipher):
+    """Retires the old key once nothing is encrypted with it any more."""
+    os.replace(next_key_path(key_file), key_file)
+    _fsync_directory(key_file)
+    cipher.use_keys(cipher.keys[:1])
+
+
+def _reencrypt_line(raw: bytes, cipher) -> bytes:
+    """The same stored line with its token re-encrypted under the cipher's first key."""
+    raw = raw.strip()
+    if not raw.startswith(b"{"):
+        # A whole store encrypted as a single token
+        return cipher.rotate(raw) + b"\n"
+    line = json.loads(raw)
+    line["entry"] = cipher.rotate(line["entry"].encode('ascii')).decode('ascii')
+    return json.dumps(line, default=str).encode('utf-8') + b"\n"
+
+
+def _reencrypt_file(path: str, cipher):
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    temp_path = path + ".tmp"
+    with f, open(temp_path, 'wb') as out:
+        if f.read(len(RECORDS_HEADER)) == RECORDS_HEADER:
+            out.write(RECORDS_HEADER)
+        else:
+            f.seek(0)
+        for raw in f:
+            if not raw.strip():
+                continue
+            try:
+                out.write(_reencrypt_line(raw, cipher))
+            except (InvalidToken, ValueError, KeyError):
+                print(f"⚠️  Dropping unreadable entry from {path}")
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(temp_path, path)
+    _fsync_directory(path)
+
+
+def reencrypt_previous_generation(filename: str, cipher):
+    """Re-encrypts a store's ``.prev`` snapshot and journal under the cipher's first key."""
+    _reencrypt_file(previous_snapshot_path(filename), cipher)
+    _reencrypt_file(previous_journal_path(filename), cipher)
@@ -0,0 +1,411 @@
+"""
+Storage backends for the data stores: shops, licenses, recovery codes, inventory and sales.
+
+A backend loads a whole store as ``{key: record}`` and persists changes as batches of
+``(store, key, record)`` tuples, where a None record deletes the key. commit() returns
+once the batch is durable. load_public() returns the PUBLIC_FIELDS of every record by
+record id without decrypting the records, and load_record() decrypts a single one.
+reencrypt() moves a store over to the cipher's first key during a key rotation while
+commits carry on. STORAGE_BACKEND selects the backend: ``encrypted_files`` (the
+default, see storage.py), ``sqlite`` or ``mongodb`` (mongo_backend.py). open() is
+awaited once before the first load. Admin accounts and the secure config always stay
+in their own encrypted files.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from cryptography.fernet import InvalidToken
+from storage import (
+    load_store, locate_records, load_record, read_record_at, GroupCommit, GroupCommitJournal,
+    journal_needs_compaction, is_legacy_snapshot, compact_store, compaction_stats, StoreCorruptedError,
+    journal_path, compacting_journal_path, previous_snapshot_path, reencrypt_previous_generation, json_default
+)
+
+DATA_STORES = ("shops", "licenses", "recovery_codes", "inventory", "sales")
+# Fields stored in clear next to each encrypted record, so they can be read without decrypting it
+PUBLIC_FIELDS = {
+    "licenses": ("plan", "used"),
+    "recovery_codes": ("shop_id", "used")
+}
+
+
+class EncryptedFileBackend:
+    """One Fernet-encrypted snapshot plus append-only journal per store (``<store>.dat``).
+
+    load_public() also remembers where each record's latest line is, and journal
+    appends keep that up to date, so load_record() reads a single line instead of
+    scanning the store. Scans run in a worker thread so they never block the event loop.
+    """
+
+    name = "encrypted_files"
+
+    def __init__(self, data_dir: str, cipher, window_seconds: float, max_log_bytes: int, max_log_entries: int):
+        self.data_dir = data_dir
+        self.cipher = cipher
+        self.journal = GroupCommitJournal(cipher, window_seconds, on_appended=self._appended)
+        self.max_log_bytes = max_log_bytes
+        self.max_log_entries = max_log_entries
+        self.locations = {}  # store -> {record id: (path, offset)}, for stores loaded through load_public()
+        self.location_misses = 0
+        self._scans = {}  # store -> [lines appended during each running scan]
+        self._compaction_lock = None
+
+    def path(self, store: str) -> str:
+        return os.path.join(self.data_dir, store + ".dat")
+
+    def exists(self, store: str) -> bool:
+        """True if the store has any file, including a journal that was never compacted."""
+        filename = self.path(store)
+        paths = (filename, journal_path(filename), compacting_journal_path(filename), previous_snapshot_path(filename))
+        return any(os.path.exists(path) for path in paths)
+
+    async def open(self):
+        """Rewrites snapshots still in the whole-store format, one line per record.
+
+        Until then every load_record() would decrypt the whole store.
+        """
+        for store in DATA_STORES:
+            filename = self.path(store)
+            if is_legacy_snapshot(filename):
+                async with self._compaction():
+                    stats = await self._compact(store)
+                print(f"Converted {filename} to one line per record ({stats['records']} records)")
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def _locate(self, store: str):
+        """locate_records() in a worker thread, with the lines appended meanwhile applied on top."""
+        appended = []
+        self._scans.setdefault(store, []).append(appended)
+        try:
+            index, locations = await self._run(locate_records, self.path(store), self.cipher, PUBLIC_FIELDS.get(store, ()))
+        finally:
+            self._scans[store].remove(appended)
+        for record_id, location in appended:
+            if location is None:
+                locations.pop(record_id, None)
+            else:
+                locations[record_id] = location
+        return index, locations
+
+    async def load(self, store: str) -> dict:
+        return await self._run(load_store, self.path(store), self.cipher, PUBLIC_FIELDS.get(store, ()))
+
+    async def load_public(self, store: str) -> dict:
+        index, self.locations[store] = await self._locate(store)
+        return index
+
+    async def load_record(self, store: str, key: str):
+        location = self.locations.get(store, {}).get(self.cipher.record_id(key))
+        if location is not None:
+            try:
+                return read_record_at(location, self.cipher, key)
+            except LookupError:
+                self.location_misses += 1
+        return await self._run(load_record, self.path(store), self.cipher, key, PUBLIC_FIELDS.get(store, ()))
+
+    def _appended(self, filename: str, line: bytes, location):
+        store = os.path.basename(filename)[:-len(".dat")]
+        scans = self._scans.get(store)
+        if store not in self.locations and not scans:
+            return
+        header = json.loads(line)
+        if header["op"] == "delete":
+            location = None
+        for appended in scans or ():
+            appended.append((header["id"], location))
+        if store not in self.locations:
+            return
+        if location is None:
+            self.locations[store].pop(header["id"], None)
+        else:
+            self.locations[store][header["id"]] = location
+
+    async def commit(self, changes):
+        await self.journal.commit([
+            (self.path(store), key, record, PUBLIC_FIELDS.get(store, ())) for store, key, record in changes
+        ])
+
+    def _compaction(self) -> asyncio.Lock:
+        # Keeps maintain() and reencrypt() from compacting the same store at once
+        if self._compaction_lock is None:
+            self._compaction_lock = asyncio.Lock()
+        return self._compaction_lock
+
+    async def _compact(self, store: str, reencrypt: bool = False) -> dict:
+        filename = self.path(store)
+        stats = await compact_store(filename, self.cipher, PUBLIC_FIELDS.get(store, ()), reencrypt, self.journal)
+        if store in self.locations:
+            # Lines moved into the new snapshot; appends made meanwhile are found again by the scan
+            _, self.locations[store] = await self._locate(store)
+        return stats
+
+    async def maintain(self):
+        """Folds oversized journals into fresh snapshots."""
+        for store in DATA_STORES:
+            filename = self.path(store)
+            if not journal_needs_compaction(filename, self.max_log_bytes, self.max_log_entries):
+                continue
+            try:
+                async with self._compaction():
+                    stats = await self._compact(store)
+                print(f"Compacted {filename}: {stats['entries_compacted']} journal entries in {stats['duration_ms']} ms")
+            except (OSError, StoreCorruptedError) as e:
+                print(f"⚠️  Compaction of {filename} failed: {e}")
+
+    async def reencrypt(self, store: str, batch_size: int = None) -> int:
+        """Re-encrypts a store with a compaction, then its previous generation.
+
+        Lines stream through a worker thread one at a time, so ``batch_size`` does not
+        apply. Journal writes already prepared under the old key are flushed first.
+        """
+        if not self.exists(store):
+            return 0
+        filename = self.path(store)
+        await self.journal.flush()
+        async with self._compaction():
+            stats = await self._compact(store, reencrypt=True)
+            await self._run(reencrypt_previous_generation, filename, self.cipher)
+        return stats["records"]
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "group_commit": self.journal.stats,
+            "record_location_misses": self.location_misses,
+            "storage_compaction": {os.path.basename(filename): stats for filename, stats in compaction_stats.items()}
+        }
+
+    async def close(self):
+        pass
+
+
+# Plain fields kept next to each encrypted record so the database can index and filter on them
+INDEXED_FIELDS = {
+    "shops": (),
+    "licenses": PUBLIC_FIELDS["licenses"],
+    "recovery_codes": PUBLIC_FIELDS["recovery_codes"],
+    "inventory": ("shop_id",),
+    "sales": ("shop_id", "battery_id", "sale_date")
+}
+# SQLite keeps booleans as 0 and 1; these columns are read back as bools
+BOOLEAN_COLUMNS = ("used",)
+STORE_INDEXES = {
+    "inventory": [("shop_id",)],
+    "sales": [("shop_id", "sale_date"), ("shop_id", "battery_id")]
+}
+
+
+def indexed_value(value):
+    # Matches how records are serialized, so sale_date sorts the same as in the JSON
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def encode_row(cipher, store: str, key: str, record: dict) -> tuple:
+    """(id, indexed columns..., data) of a record's row. The key itself is only stored encrypted."""
+    data = cipher.encrypt(json.dumps({"key": key, "value": record}, default=json_default).encode('utf-8'))
+    columns = tuple(indexed_value(record.get(column)) for column in INDEXED_FIELDS[store])
+    return (cipher.record_id(key),) + columns + (data,)
+
+
+def insert_statement(store: str) -> str:
+    names = ("id",) + INDEXED_FIELDS[store] + ("data",)
+    return f"INSERT OR REPLACE INTO {store} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})"
+
+
+class SQLiteGroupCommit(GroupCommit):
+    """Group commit where each batch is one SQLite transaction."""
+
+    write_errors = (sqlite3.Error, OSError)
+
+    def __init__(self, backend, window_seconds: float):
+        super().__init__(window_seconds, executor=backend.executor)
+        self.backend = backend
+
+    def prepare(self, change):
+        store, key, record = change
+        cipher = self.backend.cipher
+        return store, cipher.record_id(key), None if record is None else encode_row(cipher, store, key, record)
+
+    def write_batch(self, batch) -> int:
+        connection = self.backend.connection
+        with connection:
+            for store, record_id, row in batch:
+                if row is None:
+                    connection.execute(f"DELETE FROM {store} WHERE id = ?", (record_id,))
+                else:
+                    connection.execute(insert_statement(store), row)
+        return 1
+
+
+class SQLiteBackend:
+    """All data stores in one SQLite database in WAL mode, one table per store.
+
+    Each row holds the Fernet-encrypted record plus the plain columns it is indexed on
+    (shop_id, sale_date, battery_id). Rows are keyed by record id, so license keys and
+    recovery codes never appear in clear in the database. A commit batch is a single transaction, so a sale
+    and its stock change are written together or not at all. Every statement runs on a
+    single worker thread that owns the connection.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str, cipher, window_seconds: float):
+        self.path = path
+        self.cipher = cipher
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self.connection = self.executor.submit(self._connect).result()
+        self.writer = SQLiteGroupCommit(self, window_seconds)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # FULL keeps every committed transaction across a power loss, which commit() promises
+        connection.execute("PRAGMA synchronous=FULL")
+        connection.execute("CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY, applied_at TEXT NOT NULL)")
+        for store, columns in INDEXED_FIELDS.items():
+            # Untyped columns have no affinity, so values are stored as given (bools as 0 and 1)
+            definitions = ["id TEXT PRIMARY KEY"] + list(columns) + ["data BLOB NOT NULL"]
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {store} ({', '.join(definitions)})")
+            for index in STORE_INDEXES.get(store, []):
+                connection.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_{store}_{'_'.join(index)} ON {store} ({', '.join(index)})"
+                )
+        connection.commit()
+        return connection
+
+    async def open(self):
+        pass
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    def _load(self, store: str) -> dict:
+        records = {}
+        for record_id, data in self.connection.execute(f"SELECT id, data FROM {store}"):
+            try:
+                entry = json.loads(self.cipher.decrypt(data))
+            except (InvalidToken, json.JSONDecodeError):
+                print(f"⚠️  Skipping unreadable {store} record {record_id}")
+                continue
+            records[entry["key"]] = entry["value"]
+        return records
+
+    async def load(self, store: str) -> dict:
+        return await self._run(self._load, store)
+
+    def _load_public(self, store: str) -> dict:
+        fields = PUBLIC_FIELDS.get(store, ())
+        query = f"SELECT {', '.join(('id',) + fields)} FROM {store}"
+        return {
+            row[0]: {
+                field: bool(value) if field in BOOLEAN_COLUMNS and value is not None else value
+                for field, value in zip(fields, row[1:])
+            }
+            for row in self.connection.execute(query)
+        }
+
+    async def load_public(self, store: str) -> dict:
+        return await self._run(self._load_public, store)
+
+    def _load_record(self, store: str, key: str):
+        query = f"SELECT data FROM {store} WHERE id = ?"
+        row = self.connection.execute(query, (self.cipher.record_id(key),)).fetchone()
+        return None if row is None else json.loads(self.cipher.decrypt(row[0]))["value"]
+
+    async def load_record(self, store: str, key: str):
+        return await self._run(self._load_record, store, key)
+
+    async def commit(self, changes):
+        await self.writer.commit(changes)
+
+    def _has_migration(self, name: str) -> bool:
+        return self.connection.execute("SELECT 1 FROM migrations WHERE name = ?", (name,)).fetchone() is not None
+
+    async def has_migration(self, name: str) -> bool:
+        return await self._run(self._has_migration, name)
+
+    def _record_migration(self, name: str):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO migrations (name, applied_at) VALUES (?, ?)", (name, datetime.now().isoformat())
+            )
+
+    async def record_migration(self, name: str):
+        await self._run(self._record_migration, name)
+
+    def _is_empty(self, store: str) -> bool:
+        return self.connection.execute(f"SELECT 1 FROM {store} LIMIT 1").fetchone() is None
+
+    async def is_empty(self, store: str) -> bool:
+        return await self._run(self._is_empty, store)
+
+    def _reencrypt_batch(self, store: str, after: str, batch_size: int):
+        rows = self.connection.execute(
+            f"SELECT id, data FROM {store} WHERE id > ? ORDER BY id LIMIT ?", (after, batch_size)
+        ).fetchall()
+        updates = []
+        for record_id, data in rows:
+            try:
+                updates.append((self.cipher.rotate(data), record_id))
+            except InvalidToken:
+                print(f"⚠️  Skipping unreadable {store} record {record_id}")
+        with self.connection:
+            self.connection.executemany(f"UPDATE {store} SET data = ? WHERE id = ?", updates)
+        return rows[-1][0] if rows else None, len(updates)
+
+    async def reencrypt(self, store: str, batch_size: int = 500) -> int:
+        """Re-encrypts a store in transactions of ``batch_size`` rows.
+
+        Batches run on the connection's thread between commit batches, so no commit can
+        land between reading a row and rewriting it.
+        """
+        await self.writer.flush()
+        after, total = "", 0
+        while after is not None:
+            after, count = await self._run(self._reencrypt_batch, store, after, batch_size)
+            total += count
+        return total
+
+    def _checkpoint(self):
+        # The pragma returns a row, which must be read or the statement blocks later commits
+        self.connection.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+
+    async def maintain(self):
+        # Keeps the WAL from growing between SQLite's own automatic checkpoints
+        await self._run(self._checkpoint)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "database": os.path.basename(self.path), "group_commit": self.writer.stats}
+
+    async def close(self):
+        await self._run(self.connection.close)
+        self.executor.shutdown(wait=False)
+
+
+# Recorded by a database backend once the encrypted files have been copied into it
+IMPORT_MIGRATION = "import_from_encrypted_files"
+
+
+async def import_from_encrypted_files(backend, source: EncryptedFileBackend):
+    """Copies the stores from the encrypted files into ``backend``, once.
+
+    A migration marker in the database makes later boots skip the import, so emptying
+    a table never brings the old files back. Stores that already hold data are left
+    alone, which covers databases filled before the marker existed.
+    """
+    if await backend.has_migration(IMPORT_MIGRATION):
+        return
+    for store in DATA_STORES:
+        if not source.exists(store) or not await backend.is_empty(store):
+            continue
+        records = await source.load(store)
+        if records:
+            await backend.commit([(store, key, record) for key, record in records.items()])
+            print(f"📦 Imported {len(records)} {store} records from {source.path(store)} into {backend.name}")
+    await backend.record_migration(IMPORT_MIGRATION)
@@ -9,6 +9,7 @@ class MurickBatteryAPITester:
         self.base_url = base_url
         self.tests_run = 0
         self.tests_passed = 0
+        self.admin_token = None
         self.battery_id = None
         self.sale_id = None
         self.shop_id_1 = None
@@ -16,10 +17,10 @@ class MurickBatteryAPITester:
         self.test_users = []
         self.generated_license_key = None
 
-    def run_test(self, name, method, endpoint, expected_status, data=None, check_response=None):
+    def run_test(self, name, method, endpoint, expected_status, data=None, check_response=None, headers=None):
         """Run a single API test"""
         url = f"{self.base_url}/{endpoint}"
-        headers = {'Content-Type': 'application/json'}
+        headers = {'Content-Type': 'application/json', **(headers or {})}
 
         self.tests_run += 1
         print(f"\n🔍 Testing {name}...")
@@ -136,7 +137,7 @@ class MurickBatteryAPITester:
         success, response = self.run_test(
             "Add Battery to Inventory",
             "POST",
-            "api/inventory",
+            f"api/shops/{self.shop_id_1}/inventory",
             200,
             data=battery_data
         )
@@ -156,7 +157,7 @@ class MurickBatteryAPITester:
         return self.run_test(
             "Get Inventory",
             "GET",
-            "api/inventory",
+            f"api/shops/{self.shop_id_1}/inventory",
             200,
             check_response=check_inventory
         )
@@ -179,7 +180,7 @@ class MurickBatteryAPITester:
         success, response = self.run_test(
             "Record Sale",
             "POST",
-            "api/sales",
+            f"api/shops/{self.shop_id_1}/sales",
             200,
             data=sale_data
         )
@@ -211,7 +212,7 @@ class MurickBatteryAPITester:
         return self.run_test(
             "Get Sales",
             "GET",
-            "api/sales",
+            f"api/shops/{self.shop_id_1}/sales",
             200,
             check_response=check_sales
         )
@@ -225,7 +226,7 @@ class MurickBatteryAPITester:
         return self.run_test(
             "Dashboard Analytics",
             "GET",
-            "api/dashboard",
+            f"api/shops/{self.shop_id_1}/dashboard",
             200,
             check_response=check_dashboard
         )
@@ -235,7 +236,7 @@ class MurickBatteryAPITester:
         success, response = self.run_test(
             "Check Stock Update After Sale",
             "GET",
-            "api/inventory",
+            f"api/shops/{self.shop_id_1}/inventory",
             200
         )
         
@@ -912,11 +913,16 @@ class MurickBatteryAPITester:
         )
         
         if success:
+            self.admin_token = response.get('token')
             print(f"   Admin Name: {response['admin']['name']}")
             print(f"   Admin Role: {response['admin']['role']}")
         
         return success, response
 
+    def admin_headers(self):
+        """Bearer header for admin endpoints, using the token from admin authentication"""
+        return {'Authorization': f"Bearer {self.admin_token}"}
+
     def test_admin_authentication_invalid_key(self):
         """Test admin authentication with invalid admin key"""
         admin_auth_data = {
@@ -1057,8 +1063,9 @@ class MurickBatteryAPITester:
         success, response = self.run_test(
             "Admin Get Shop Details",
             "GET",
-            f"api/admin/shop-details/{self.shop_id_1}?admin_key=MURICK_ADMIN_2024&username=murick_admin&password=MurickAdmin@2024",
+            f"api/admin/shop-details/{self.shop_id_1}",
             200,
+            headers=self.admin_headers(),
             check_response=check_shop_details
         )
         
@@ -1074,8 +1081,9 @@ class MurickBatteryAPITester:
         return self.run_test(
             "Admin Get Shop Details - Invalid Shop",
             "GET",
-            "api/admin/shop-details/nonexistent_shop?admin_key=MURICK_ADMIN_2024&username=murick_admin&password=MurickAdmin@2024",
-            404  # Should fail with 404
+            "api/admin/shop-details/nonexistent_shop",
+            404,  # Should fail with 404
+            headers=self.admin_headers()
         )
 
     def test_admin_get_shop_details_invalid_auth(self):
@@ -1087,8 +1095,9 @@ class MurickBatteryAPITester:
         return self.run_test(
             "Admin Get Shop Details - Invalid Auth",
             "GET",
-            f"api/admin/shop-details/{self.shop_id_1}?admin_key=INVALID&username=wrong&password=wrong",
-            401  # Should fail with 401
+            f"api/admin/shop-details/{self.shop_id_1}",
+            401,  # Should fail with 401
+            headers={'Authorization': 'Bearer invalid-token'}
         )
 
     def test_admin_reset_shop_credentials_success(self):
@@ -1295,8 +1304,9 @@ class MurickBatteryAPITester:
         success, response = self.run_test(
             "Verify Recovery Codes Generated During Setup",
             "GET",
-            f"api/admin/shop-details/{self.shop_id_1}?admin_key=MURICK_ADMIN_2024&username=murick_admin&password=MurickAdmin@2024",
-            200
+            f"api/admin/shop-details/{self.shop_id_1}",
+            200,
+            headers=self.admin_headers()
         )
         
         if success:
@@ -1320,8 +1330,9 @@ class MurickBatteryAPITester:
         success, shop_details = self.run_test(
             "Get Shop Details for Recovery Code",
             "GET",
-            f"api/admin/shop-details/{self.shop_id_1}?admin_key=MURICK_ADMIN_2024&username=murick_admin&password=MurickAdmin@2024",
-            200
+            f"api/admin/shop-details/{self.shop_id_1}",
+            200,
+            headers=self.admin_headers()
         )
         
         if not success:
@@ -533,6 +533,7 @@ function AccountRecoveryScreen({ onBack }) {
 function AdminRecoveryScreen({ onBack }) {
   const [step, setStep] = useState(1); // 1: admin login, 2: search shop, 3: reset credentials
   const [adminAuth, setAdminAuth] = useState({ adminKey: '', username: '', password: '' });
+  const [adminToken, setAdminToken] = useState(null);
   const [searchTerm, setSearchTerm] = useState('');
   const [searchResults, setSearchResults] = useState([]);
   const [selectedShop, setSelectedShop] = useState(null);
@@ -558,6 +559,10 @@ function AdminRecoveryScreen({ onBack }) {
       });
 
       if (response.ok) {
+        const data = await response.json();
+        // Later admin requests carry this short-lived token instead of the password
+        setAdminToken(data.token);
+        setAdminAuth({ ...adminAuth, password: '' });
         setStep(2);
         setError('');
       } else {
@@ -584,12 +589,8 @@ function AdminRecoveryScreen({ onBack }) {
     try {
       const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/admin/search-shops`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        // AFTER
+        headers: { 'Content-Type': 'application/json', 'Authorization': `Bearer ${adminToken}` },
         body: JSON.stringify({
-          admin_key: adminAuth.adminKey,
-          username: adminAuth.username,
-          password: adminAuth.password,
           search_term: searchTerm
         }),
       });
@@ -619,11 +620,8 @@ function AdminRecoveryScreen({ onBack }) {
     try {
       const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/admin/reset-shop-credentials`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', 'Authorization': `Bearer ${adminToken}` },
         body: JSON.stringify({
-          admin_key: adminAuth.adminKey,
-          username: adminAuth.username,
-          password: adminAuth.password,
           shop_id: selectedShop.shop_id,
           new_username: newCredentials.username,
           new_password: newCredentials.password,
@@ -1,7 +1,10 @@
 import React from 'react';
 
 // Receipt Component
-export function Receipt({ sale, battery, shopConfig, onPrint, onClose }) {
+export function Receipt({ sale, battery, items, shopConfig, onPrint, onClose }) {
+  // A cart receipt from /sales/batch lists every line; a single sale is its own only line
+  const lines = items || [{ sale, battery }];
+
   const currentDate = new Date(sale.sale_date).toLocaleDateString('en-PK', {
     weekday: 'long',
     year: 'numeric',
@@ -82,20 +85,22 @@ export function Receipt({ sale, battery, shopConfig, onPrint, onClose }) {
         <div className="border-t border-b border-dashed border-gray-300 py-3 mb-4">
           <div className="text-sm font-semibold mb-2">ITEMS PURCHASED</div>
           
-          <div className="mb-3">
-            <div className="font-medium text-gray-800">
-              {battery.brand} {battery.capacity} {battery.model}
-            </div>
-            <div className="flex justify-between text-sm mt-1">
-              <span>Qty: {sale.quantity_sold} × ₨{sale.unit_price.toLocaleString()}</span>
-              <span className="font-semibold">₨{sale.total_amount.toLocaleString()}</span>
-            </div>
-            {battery.warranty_months && (
-              <div className="text-xs text-gray-600 mt-1">
-                Warranty: {battery.warranty_months} months
+          {lines.map((line) => (
+            <div key={line.sale.id} className="mb-3">
+              <div className="font-medium text-gray-800">
+                {line.battery.brand} {line.battery.capacity} {line.battery.model}
               </div>
-            )}
-          </div>
+              <div className="flex justify-between text-sm mt-1">
+                <span>Qty: {line.sale.quantity_sold} × ₨{line.sale.unit_price.toLocaleString()}</span>
+                <span className="font-semibold">₨{line.sale.total_amount.toLocaleString()}</span>
+              </div>
+              {line.battery.warranty_months && (
+                <div className="text-xs text-gray-600 mt-1">
+                  Warranty: {line.battery.warranty_months} months
+                </div>
+              )}
+            </div>
+          ))}
         </div>
 
         {/* Totals */}
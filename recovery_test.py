@@ -9,12 +9,13 @@ class AccountRecoveryTester:
         self.base_url = base_url
         self.tests_run = 0
         self.tests_passed = 0
+        self.admin_token = None
         self.existing_shop_id = "shop_a42e0a33"  # From previous test run
 
-    def run_test(self, name, method, endpoint, expected_status, data=None, check_response=None):
+    def run_test(self, name, method, endpoint, expected_status, data=None, check_response=None, headers=None):
         """Run a single API test"""
         url = f"{self.base_url}/{endpoint}"
-        headers = {'Content-Type': 'application/json'}
+        headers = {'Content-Type': 'application/json', **(headers or {})}
 
         self.tests_run += 1
         print(f"\n🔍 Testing {name}...")
@@ -96,11 +97,16 @@ class AccountRecoveryTester:
         )
         
         if success:
+            self.admin_token = response.get('token')
             print(f"   Admin Name: {response['admin']['name']}")
             print(f"   Admin Role: {response['admin']['role']}")
         
         return success, response
 
+    def admin_headers(self):
+        """Bearer header for admin endpoints, using the token from admin authentication"""
+        return {'Authorization': f"Bearer {self.admin_token}"}
+
     def test_admin_search_shops_success(self):
         """Test admin shop search functionality"""
         search_data = {
@@ -142,8 +148,9 @@ class AccountRecoveryTester:
         success, response = self.run_test(
             "Admin Get Shop Details",
             "GET",
-            f"api/admin/shop-details/{self.existing_shop_id}?admin_key=MURICK_ADMIN_2024&username=murick_admin&password=Admin@2024!Secure",
+            f"api/admin/shop-details/{self.existing_shop_id}",
             200,
+            headers=self.admin_headers(),
             check_response=check_shop_details
         )
         
@@ -160,8 +167,9 @@ class AccountRecoveryTester:
         success, shop_details = self.run_test(
             "Get Shop Details for Credential Reset",
             "GET",
-            f"api/admin/shop-details/{self.existing_shop_id}?admin_key=MURICK_ADMIN_2024&username=murick_admin&password=Admin@2024!Secure",
-            200
+            f"api/admin/shop-details/{self.existing_shop_id}",
+            200,
+            headers=self.admin_headers()
         )
         
         if not success or not shop_details.get('users'):
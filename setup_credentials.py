@@ -14,6 +14,15 @@ from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from passlib.context import CryptContext
+import sys
+
+# Stores are read and written with the server's storage engine
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from storage import (
+    StoreCorruptedError, load_cipher, load_store, write_snapshot, next_key_path, record_id_key_path,
+    staged_key, stage_key_rotation, RECORD_ID_ROTATION_WARNING
+)
+from storage_backends import PUBLIC_FIELDS
 
 # Password hashing context
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -34,8 +43,8 @@ SALT_FILE = os.path.join(DATA_DIR, "salt.key")
 # Ensure data directory exists
 os.makedirs(DATA_DIR, exist_ok=True)
 
-def generate_encryption_key(master_password=None):
-    """Generate a secure encryption key using a master password or random generation."""
+def derive_key_from_password(master_password):
+    """Derive a Fernet key from a master password with PBKDF2 and the saved salt."""
     # Generate a random salt if it doesn't exist
     if not os.path.exists(SALT_FILE):
         salt = secrets.token_bytes(16)
@@ -45,6 +54,17 @@ def generate_encryption_key(master_password=None):
         with open(SALT_FILE, 'rb') as f:
             salt = f.read()
     
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=100000,
+    )
+    return base64.urlsafe_b64encode(kdf.derive(master_password.encode()))
+
+def generate_encryption_key(master_password=None):
+    """Generate a secure encryption key using a master password or random generation."""
+    
     # If no master password provided, generate a random key
     if not master_password:
         # Generate a random key if it doesn't exist
@@ -59,13 +79,7 @@ def generate_encryption_key(master_password=None):
                 key = f.read()
     else:
         # Derive key from master password
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(master_password.encode()))
+        key = derive_key_from_password(master_password)
         
         # Save the derived key
         with open(KEY_FILE, 'wb') as f:
@@ -74,6 +88,21 @@ def generate_encryption_key(master_password=None):
     
     return key
 
+def prompt_master_password():
+    """Ask for a new master password twice; returns None if it is rejected."""
+    master_password = getpass.getpass("Enter a strong master password: ")
+    confirm_password = getpass.getpass("Confirm master password: ")
+    
+    if master_password != confirm_password:
+        print("❌ Passwords don't match! Try again.")
+        return None
+        
+    if len(master_password) < 8:
+        print("❌ Master password too short! Use at least 8 characters.")
+        return None
+    
+    return master_password
+
 # Initialize or load encryption key
 def get_encryption_key():
     """Get the encryption key, prompting for master password if needed."""
@@ -91,15 +120,8 @@ def get_encryption_key():
             if choice == 'r':
                 return generate_encryption_key()
             elif choice == 'p':
-                master_password = getpass.getpass("Enter a strong master password: ")
-                confirm_password = getpass.getpass("Confirm master password: ")
-                
-                if master_password != confirm_password:
-                    print("❌ Passwords don't match! Try again.")
-                    continue
-                    
-                if len(master_password) < 8:
-                    print("❌ Master password too short! Use at least 8 characters.")
+                master_password = prompt_master_password()
+                if master_password is None:
                     continue
                     
                 return generate_encryption_key(master_password)
@@ -116,63 +138,56 @@ def is_first_time_setup():
 # Initialize encryption
 FIRST_TIME_SETUP = is_first_time_setup()
 ENCRYPTION_KEY = get_encryption_key()
-cipher = Fernet(ENCRYPTION_KEY)
+# Reads with both keys while a key rotation is in progress
+cipher = load_cipher(KEY_FILE)
+
+def public_fields(filename: str):
+    """The fields the server keeps in clear next to each record of this store."""
+    return PUBLIC_FIELDS.get(os.path.basename(filename)[:-len(".dat")], ())
 
 def save_to_encrypted_file(data: dict, filename: str):
-    """Serializes, encrypts, and saves data to a file."""
+    """Encrypts and saves data with the server's storage engine, replacing its journal."""
     os.makedirs(DATA_DIR, exist_ok=True)
-    json_data = json.dumps(data, default=str).encode('utf-8')
-    encrypted_data = cipher.encrypt(json_data)
-    with open(filename, 'wb') as f:
-        f.write(encrypted_data)
+    write_snapshot(data, filename, cipher, public_fields(filename))
 
 def load_from_encrypted_file(filename: str) -> dict:
-    """Loads and decrypts data from a file, returning empty if it fails."""
+    """Loads and decrypts a store with the server's journal replayed, returning empty if it is missing."""
     try:
-        with open(filename, 'rb') as f:
-            encrypted_data = f.read()
+        return load_store(filename, cipher, public_fields(filename))
+    except StoreCorruptedError:
+        # If this is not a first-time setup, inform the user about the key mismatch
+        if not FIRST_TIME_SETUP:
+            print("\n❌ ERROR: Cannot decrypt existing data with the current encryption key.")
+            print("This usually happens when:")
+            print("  1. You've created a new encryption key but have existing encrypted files")
+            print("  2. The encryption key file has been corrupted or replaced")
+            print("  3. A key rotation is in progress and encryption.key.next has been removed")
+            print("\nPossible solutions:")
+            print("  1. Restore your original encryption.key, record_id.key and salt.key files from backup")
+            print("  2. If you don't have a backup, you'll need to delete the existing encrypted files")
+            print("     and set up the system from scratch.")
+            print("\nWould you like to:")
+            choice = input("  1. Exit and try to restore your key files\n  2. Delete existing encrypted files and start fresh\nChoice (1/2): ")
         
-        # If this is not a first-time setup and we get an InvalidToken error,
-        # inform the user about the key mismatch
-        try:
-            decrypted_data = cipher.decrypt(encrypted_data)
-            return json.loads(decrypted_data)
-        except Exception as e:
-            if not FIRST_TIME_SETUP and 'InvalidToken' in str(e):
-                print("\n❌ ERROR: Cannot decrypt existing data with the current encryption key.")
-                print("This usually happens when:")
-                print("  1. You've created a new encryption key but have existing encrypted files")
-                print("  2. The encryption key file has been corrupted or replaced")
-                print("\nPossible solutions:")
-                print("  1. Restore your original encryption.key and salt.key files from backup")
-                print("  2. If you don't have a backup, you'll need to delete the existing encrypted files")
-                print("     and set up the system from scratch.")
-                print("\nWould you like to:")
-                choice = input("  1. Exit and try to restore your key files\n  2. Delete existing encrypted files and start fresh\nChoice (1/2): ")
-                
-                if choice == '1':
-                    print("Exiting. Please restore your original key files and try again.")
-                    exit(1)
-                elif choice == '2':
-                    confirm = input("⚠️  WARNING: This will delete all existing data. Type 'DELETE' to confirm: ")
-                    if confirm == 'DELETE':
-                        # Delete all encrypted files
-                        for file_path in [ADMIN_ACCOUNTS_FILE, LICENSES_FILE, SECURE_CONFIG_FILE]:
-                            if os.path.exists(file_path):
-                                os.remove(file_path)
-                                print(f"Deleted {file_path}")
-                        print("\n✅ All encrypted files have been deleted. Please restart the setup process.")
-                        exit(0)
-                    else:
-                        print("Deletion cancelled. Exiting.")
-                        exit(1)
+            if choice == '1':
+                print("Exiting. Please restore your original key files and try again.")
+                exit(1)
+            elif choice == '2':
+                confirm = input("⚠️  WARNING: This will delete all existing data. Type 'DELETE' to confirm: ")
+                if confirm == 'DELETE':
+                    # Delete all encrypted files
+                    for file_path in [ADMIN_ACCOUNTS_FILE, LICENSES_FILE, SECURE_CONFIG_FILE]:
+                        if os.path.exists(file_path):
+                            os.remove(file_path)
+                            print(f"Deleted {file_path}")
+                    print("\n✅ All encrypted files have been deleted. Please restart the setup process.")
+                    exit(0)
                 else:
-                    print("Invalid choice. Exiting.")
+                    print("Deletion cancelled. Exiting.")
                     exit(1)
-            
-            # For other exceptions, return empty dict
-            return {}
-    except FileNotFoundError:
+            else:
+                print("Invalid choice. Exiting.")
+                exit(1)
         return {}
 
 def setup_admin_credentials():
@@ -431,14 +446,20 @@ def create_key_backup(backup_dir=None):
             print(f"❌ Error creating backup directory: {e}")
             return False
     
-    backup_filename = f"murick_encryption_key_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.key"
-    backup_path = os.path.join(backup_dir, backup_filename)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    backup_path = os.path.join(backup_dir, f"murick_encryption_key_backup_{timestamp}.key")
     
     try:
         with open(KEY_FILE, 'rb') as src, open(backup_path, 'wb') as dst:
             dst.write(src.read())
         
         print(f"✅ Encryption key backed up to: {backup_path}")
+        # Written by the first key rotation; records cannot be looked up without it
+        if os.path.exists(record_id_key_path(KEY_FILE)):
+            id_key_backup_path = os.path.join(backup_dir, f"murick_record_id_key_backup_{timestamp}.key")
+            with open(record_id_key_path(KEY_FILE), 'rb') as src, open(id_key_backup_path, 'wb') as dst:
+                dst.write(src.read())
+            print(f"✅ Record id key backed up to: {id_key_backup_path}")
         print("⚠️  IMPORTANT: Store this backup in a secure location!")
         print("⚠️  Anyone with access to this key can decrypt your data!")
         return True
@@ -446,6 +467,44 @@ def create_key_backup(backup_dir=None):
         print(f"❌ Error backing up encryption key: {e}")
         return False
 
+def rotate_encryption_key():
+    """Stage a new encryption key; the server re-encrypts all data under it."""
+    print("\n🔑 Encryption Key Rotation")
+    print("=" * 40)
+    
+    if staged_key(KEY_FILE) is not None:
+        print("A key rotation is already in progress.")
+        print("Start the server, or call POST /api/admin/rotate-encryption-key, to finish it.")
+        return False
+    
+    while True:
+        choice = input("Rotate to a random key (r) or a key from a new master password (p)? ").lower()
+        if choice == 'r':
+            new_key = Fernet.generate_key()
+            break
+        elif choice == 'p':
+            master_password = prompt_master_password()
+            if master_password is None:
+                continue
+            new_key = derive_key_from_password(master_password)
+            break
+        else:
+            print("Invalid choice. Please enter 'r' or 'p'.")
+    
+    if new_key in cipher.keys:
+        print("❌ The new key is the same as the current one!")
+        return False
+    
+    stage_key_rotation(KEY_FILE, new_key, cipher)
+    print(f"✅ New key staged in {next_key_path(KEY_FILE)}")
+    print("The server re-encrypts every store under it in the background, while it keeps serving:")
+    print("  - a stopped server does so as soon as it starts")
+    print("  - a running server starts when an admin calls POST /api/admin/rotate-encryption-key")
+    print("⚠️  Until the rotation completes, keep both encryption.key and encryption.key.next.")
+    print("⚠️  Back up record_id.key together with your encryption key from now on.")
+    print(f"⚠️  {RECORD_ID_ROTATION_WARNING}")
+    return True
+
 def create_security_guide():
     """Create a security guide document for shop owners"""
     guide_filename = "SECURITY_GUIDE.md"
@@ -484,7 +543,11 @@ If it is stolen, an attacker could potentially decrypt your sensitive informatio
    - Perform regular backups of your entire system
 
 4. **If You Suspect a Security Breach**
-   - Immediately generate a new encryption key using setup_credentials.py
+   - Immediately rotate the encryption key: `python setup_credentials.py rotate-key`
+     (existing data is re-encrypted under the new key while the server keeps running)
+   - Rotation does not change record ids, which are keyed hashes of license keys and recovery
+     codes. Whoever holds the stolen key and a copy of your data can still check guesses against
+     them, so issue new license keys and recovery codes in place of those not yet used
    - Change all admin passwords
    - Check for unauthorized shops or license usage
    - Contact Murick support for assistance
@@ -493,6 +556,8 @@ If it is stolen, an attacker could potentially decrypt your sensitive informatio
 
 The system uses Fernet symmetric encryption (AES-128 in CBC mode with PKCS7 padding).
 The encryption key is either randomly generated or derived from a master password using PBKDF2.
+Records are looked up by an HMAC-SHA256 of their key. Its id key is derived from your first
+encryption key, kept in `data/record_id.key` after the first rotation, and never rotated.
 
 **DO NOT MODIFY** the encryption key file manually or attempt to change the encryption
 algorithm without guidance from Murick support.
@@ -635,4 +700,7 @@ ENCRYPTION_KEY = load_encryption_key()"""
         return False
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if sys.argv[1:] == ["rotate-key"]:
+        rotate_encryption_key()
+    else:
+        main()
\ No newline at end of file
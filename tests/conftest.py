@@ -0,0 +1,60 @@
+import asyncio
+import os
+import sys
+
+import pytest
+from cryptography.fernet import Fernet
+from fastapi.testclient import TestClient
+
+# The backend modules import each other as top-level modules (see backend/server.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from storage import RecordCipher  # noqa: E402
+
+SHOP_ID = "SHOP-TEST01-000001"
+
+
+@pytest.fixture
+def cipher():
+    """A throwaway cipher with a fresh key."""
+    return RecordCipher.from_key(Fernet.generate_key())
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """A freshly imported server on an empty data directory, holding one shop with no users."""
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "encryption.key").write_bytes(Fernet.generate_key())
+    monkeypatch.chdir(tmp_path)
+    # server.py keeps its state in module globals, so every test gets its own import
+    sys.modules.pop("server", None)
+    import server
+
+    run(server.load_data_stores())
+    run(server.save_record(server.SHOPS_STORE, SHOP_ID, {"shop_id": SHOP_ID, "shop_name": "Test Shop", "users": []}))
+    return server
+
+
+@pytest.fixture
+def client(server):
+    return TestClient(server.app)
+
+
+def battery(stock_quantity=5, **fields):
+    """The body of a request adding a battery item."""
+    return {
+        "brand": "AGS", "capacity": "55Ah", "model": "NS60", "purchase_price": 100.0,
+        "selling_price": 150.0, "stock_quantity": stock_quantity, **fields
+    }
+
+
+def add_item(client, stock_quantity=5, **fields):
+    """Adds a battery to the test shop through the API and returns the stored item."""
+    response = client.post(f"/api/shops/{SHOP_ID}/inventory", json=battery(stock_quantity, **fields))
+    assert response.status_code == 200
+    return response.json()["item"]
@@ -0,0 +1,108 @@
+"""
+In-process stand-in for the small part of motor that MongoBackend uses.
+
+Collections are dicts keyed by _id. replace_one replaces by _id, bulk_write understands
+pymongo's ReplaceOne, DeleteOne and $set UpdateOnes filtered on _id plus exact field
+values, and create_index records the index under MongoDB's default name. The server
+reports itself as a standalone mongod, so no transactions are used.
+"""
+
+import copy
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self._documents = iter(documents)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._documents)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection:
+    def __init__(self):
+        self.documents = {}
+        self.indexes = {"_id_": {"key": [("_id", 1)]}}
+        self.bulk_writes = 0
+
+    @staticmethod
+    def _project(document, projection):
+        if not projection:
+            return copy.deepcopy(document)
+        return {field: copy.deepcopy(value) for field, value in document.items() if field == "_id" or projection.get(field)}
+
+    async def create_index(self, keys, **kwargs):
+        name = kwargs.get("name") or "_".join(f"{field}_{direction}" for field, direction in keys)
+        self.indexes[name] = {"key": list(keys)}
+        return name
+
+    async def index_information(self):
+        return copy.deepcopy(self.indexes)
+
+    def _matching(self, filter):
+        if not filter:
+            return list(self.documents.values())
+        assert set(filter) == {"_id"}, "the fake only supports finds by _id"
+        return [self.documents[filter["_id"]]] if filter["_id"] in self.documents else []
+
+    def find(self, filter=None, projection=None):
+        return FakeCursor([self._project(document, projection) for document in self._matching(filter)])
+
+    async def find_one(self, filter=None, projection=None):
+        for document in self._matching(filter):
+            return self._project(document, projection)
+        return None
+
+    async def replace_one(self, filter, replacement, upsert=False):
+        assert set(filter) == {"_id"}, "the fake only supports replacing by _id"
+        if filter["_id"] in self.documents or upsert:
+            self.documents[filter["_id"]] = copy.deepcopy(replacement)
+
+    async def bulk_write(self, requests, ordered=True, session=None):
+        self.bulk_writes += 1
+        for request in requests:
+            key = request._filter["_id"]
+            if type(request).__name__ == "DeleteOne":
+                self.documents.pop(key, None)
+            elif type(request).__name__ == "UpdateOne":
+                document = self.documents.get(key)
+                if document is not None and all(document.get(field) == value for field, value in request._filter.items()):
+                    document.update(copy.deepcopy(request._doc["$set"]))
+            elif key in self.documents or request._upsert:
+                self.documents[key] = copy.deepcopy(request._doc)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, FakeCollection())
+
+    async def command(self, name):
+        assert name == "hello"
+        return {"isWritablePrimary": True, "maxWireVersion": 17}
+
+
+class FakeMotorClient:
+    """Drop-in for AsyncIOMotorClient; instances made for the same URL share their data."""
+
+    servers = {}
+
+    def __init__(self, url, **options):
+        self.url = url
+        self.options = options
+        self.databases = self.servers.setdefault(url, {})
+        self.admin = FakeDatabase()
+        self.closed = False
+
+    def __getitem__(self, name):
+        return self.databases.setdefault(name, FakeDatabase())
+
+    def close(self):
+        self.closed = True
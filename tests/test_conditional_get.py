@@ -0,0 +1,97 @@
+"""
+Tests for ETags and 304 Not Modified on the read-heavy endpoints.
+"""
+
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+from tests.conftest import SHOP_ID, add_item, run
+
+OTHER_SHOP_ID = "SHOP-TEST02-000002"
+SHOP_ENDPOINTS = [f"/api/shops/{SHOP_ID}/{path}" for path in ("inventory", "sales", "dashboard")]
+
+
+def get(client, path, etag=None):
+    return client.get(path, headers={"If-None-Match": etag} if etag else {})
+
+
+def assert_not_modified(client, path, etag, if_none_match=None):
+    response = get(client, path, if_none_match or etag)
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+
+@pytest.mark.parametrize("path", ["/api/battery-brands", "/api/battery-capacities"])
+def test_static_lists_answer_any_matching_if_none_match(client, path):
+    response = get(client, path)
+    etag = response.headers["ETag"]
+    assert response.status_code == 200 and response.json()
+    for if_none_match in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        assert_not_modified(client, path, etag, if_none_match)
+    assert get(client, path, '"other"').status_code == 200
+
+
+@pytest.mark.parametrize("path", SHOP_ENDPOINTS)
+def test_shop_data_tags_change_with_the_shop_only(server, client, path):
+    item = add_item(client, 3)
+    etag = get(client, path).headers["ETag"]
+    assert_not_modified(client, path, etag)
+
+    # Another shop's changes leave this shop's tag alone
+    run(server.save_record(server.SHOPS_STORE, OTHER_SHOP_ID, {"shop_id": OTHER_SHOP_ID, "users": []}))
+    assert client.post(f"/api/shops/{OTHER_SHOP_ID}/inventory", json={**item, "id": None}).status_code == 200
+    assert_not_modified(client, path, etag)
+
+    client.post(f"/api/shops/{SHOP_ID}/sales", json={
+        "battery_id": item["id"], "quantity_sold": 1, "unit_price": 150.0, "total_amount": 150.0
+    })
+    response = get(client, path, etag)
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_shop_config_tag_changes_when_the_config_is_saved(server, client):
+    path = f"/api/shop-config/{SHOP_ID}"
+    etag = get(client, path).headers["ETag"]
+    assert_not_modified(client, path, etag)
+    add_item(client, 3)
+    assert_not_modified(client, path, etag)
+
+    config = {"shop_name": "Renamed", "proprietor_name": "Ali", "contact_number": "0300", "address": "Lahore", "license_key": "x"}
+    assert client.put(path, json={"shop_id": SHOP_ID, **config}).status_code == 200
+    response = get(client, path, etag)
+    assert response.status_code == 200
+    assert response.json()["shop_name"] == "Renamed"
+    assert_not_modified(client, path, response.headers["ETag"])
+    assert get(client, "/api/shop-config/SHOP-NONE", etag).status_code == 404
+
+
+def test_a_failed_save_still_changes_the_shop_config_tag(server, client):
+    async def failing_commit(changes):
+        raise OSError("disk full")
+
+    path = f"/api/shop-config/{SHOP_ID}"
+    etag = get(client, path).headers["ETag"]
+    shop_config = run(server.load_shop_config(SHOP_ID))
+    server.storage_backend.commit = failing_commit
+    with pytest.raises(OSError):
+        run(server.save_record(server.SHOPS_STORE, SHOP_ID, {**shop_config, "shop_name": "Renamed"}))
+    del server.storage_backend.commit
+    # A read racing the commit may have been tagged with the failed change
+    response = get(client, path, etag)
+    assert response.status_code == 200
+    assert response.json()["shop_name"] == "Test Shop"
+
+
+def test_tags_from_before_a_restart_never_match(client):
+    etags = {path: get(client, path).headers["ETag"] for path in SHOP_ENDPOINTS + [f"/api/shop-config/{SHOP_ID}"]}
+
+    sys.modules.pop("server")
+    import server as restarted
+    run(restarted.load_data_stores())
+    restarted_client = TestClient(restarted.app)
+    for path, etag in etags.items():
+        assert get(restarted_client, path, etag).status_code == 200
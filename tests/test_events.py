@@ -0,0 +1,121 @@
+"""
+Tests for the Server-Sent Events stream of inventory and sales changes.
+"""
+
+import json
+
+import httpx
+
+from events import ShopEvents, change_event
+from tests.conftest import SHOP_ID, add_item, battery, run
+
+
+class FakeRequest:
+    def __init__(self):
+        self.disconnected = False
+
+    async def is_disconnected(self):
+        return self.disconnected
+
+
+def parse_event(chunk: str) -> dict:
+    fields = dict(line.split(": ", 1) for line in chunk.strip().split("\n") if not line.startswith(":"))
+    return {"event": fields.get("event"), "id": fields.get("id"), "data": json.loads(fields["data"])}
+
+
+def test_a_full_queue_drops_only_that_subscriber():
+    events = ShopEvents()
+    slow, fast = events.subscribe(2), events.subscribe(10)
+    for seq in range(3):
+        events.publish({"seq": seq})
+    assert slow.dropped and not fast.dropped
+    assert slow.queue.qsize() == 2 and fast.queue.qsize() == 3
+    assert len(events) == 1 and events.dropped_subscribers == 1
+
+
+def test_change_events_are_compact():
+    sale = {"id": "S1", "battery_id": "B1", "quantity_sold": 2, "total_amount": 300.0, "customer_name": "Ali"}
+    assert change_event(7, "sales", "S1", sale) == {
+        "seq": 7, "type": "sales", "op": "upsert", "id": "S1", "battery_id": "B1", "quantity_sold": 2, "total_amount": 300.0
+    }
+    assert change_event(8, "inventory", "B1", {"id": "B1", "stock_quantity": 3, "purchase_price": 100.0}) == {
+        "seq": 8, "type": "inventory", "op": "upsert", "id": "B1", "stock_quantity": 3
+    }
+    assert change_event(9, "inventory", "B1", None) == {"seq": 9, "type": "inventory", "op": "delete", "id": "B1"}
+
+
+def test_stream_carries_every_change_after_ready(server, client):
+    item = add_item(client, 3)
+
+    async def scenario():
+        response = await server.stream_shop_events(SHOP_ID, FakeRequest())
+        stream = response.body_iterator
+        ready = parse_event(await stream.__anext__())
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as http:
+            sale = (await http.post(f"/api/shops/{SHOP_ID}/sales", json={
+                "battery_id": item["id"], "quantity_sold": 1, "unit_price": 150.0, "total_amount": 150.0
+            })).json()["sale"]
+            await http.delete(f"/api/shops/{SHOP_ID}/inventory/{item['id']}")
+            changes = [parse_event(await stream.__anext__()) for _ in range(3)]
+            delta = (await http.get(f"/api/shops/{SHOP_ID}/sync", params={"since": ready["data"]["seq"]})).json()
+        await stream.aclose()
+        return ready, sale, changes, delta
+
+    ready, sale, changes, delta = run(scenario())
+    assert ready["event"] == "ready"
+    assert [change["event"] for change in changes] == ["change"] * 3
+    assert [(change["data"]["type"], change["data"]["op"], change["data"]["id"]) for change in changes] == [
+        ("inventory", "upsert", item["id"]), ("sales", "upsert", sale["id"]), ("inventory", "delete", item["id"])
+    ]
+    assert changes[0]["data"]["stock_quantity"] == 2
+    # Event ids are the change sequences, so /sync picks up exactly where the stream is
+    assert [int(change["id"]) for change in changes] == [change["data"]["seq"] for change in changes]
+    assert changes[-1]["data"]["seq"] == delta["seq"]
+    assert delta["inventory"]["deletes"] == [item["id"]]
+    assert not server.get_shop_partition(SHOP_ID).events
+
+
+def test_slow_client_gets_the_queued_changes_then_resync(server, client, monkeypatch):
+    monkeypatch.setattr(server, "EVENT_QUEUE_SIZE", 2)
+    items = []
+
+    async def scenario():
+        response = await server.stream_shop_events(SHOP_ID, FakeRequest())
+        stream = response.body_iterator
+        chunks = [await stream.__anext__()]
+        # Three changes while the client reads nothing: one more than its queue holds
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as http:
+            for i in range(3):
+                response = await http.post(f"/api/shops/{SHOP_ID}/inventory", json=battery(3, model=f"M{i}"))
+                items.append(response.json()["item"])
+        chunks += [chunk async for chunk in stream]
+        return [parse_event(chunk) for chunk in chunks]
+
+    events = run(scenario())
+    assert [event["event"] for event in events] == ["ready", "change", "change", "resync"]
+    assert [event["data"]["id"] for event in events[1:3]] == [item["id"] for item in items[:2]]
+    # The resync tells the client where to sync from; the dropped change is in the delta
+    delta = client.get(f"/api/shops/{SHOP_ID}/sync", params={"since": events[2]["data"]["seq"]}).json()
+    assert delta["reset"] is False
+    assert [item["id"] for item in delta["inventory"]["upserts"]] == [items[2]["id"]]
+    assert events[3]["data"]["seq"] == delta["seq"]
+    assert server.get_shop_partition(SHOP_ID).events.dropped_subscribers == 1
+
+
+def test_idle_stream_sends_heartbeats_and_ends_when_the_client_leaves(server, monkeypatch):
+    monkeypatch.setattr(server, "EVENT_HEARTBEAT_SECONDS", 0.01)
+    request = FakeRequest()
+
+    async def scenario():
+        response = await server.stream_shop_events(SHOP_ID, request)
+        stream = response.body_iterator
+        await stream.__anext__()
+        heartbeat = await stream.__anext__()
+        request.disconnected = True
+        rest = [chunk async for chunk in stream]
+        return heartbeat, rest
+
+    heartbeat, rest = run(scenario())
+    assert heartbeat == ": keep-alive\n\n"
+    assert rest == []
+    assert not server.get_shop_partition(SHOP_ID).events
@@ -0,0 +1,126 @@
+"""
+Tests for the streamed sales and inventory exports.
+"""
+
+import csv
+import io
+import re
+from datetime import datetime, timedelta
+
+from openpyxl import load_workbook
+
+import exports
+from tests.conftest import SHOP_ID, add_item, run
+
+
+def sell(client, item, quantity, customer_name=None):
+    sale = {"battery_id": item["id"], "quantity_sold": quantity, "unit_price": 150.0, "total_amount": 150.0 * quantity}
+    response = client.post(f"/api/shops/{SHOP_ID}/sales", json={**sale, "customer_name": customer_name})
+    assert response.status_code == 200
+    return response.json()["sale"]
+
+
+def csv_rows(response):
+    assert response.content.startswith(b"\xef\xbb\xbf")
+    return list(csv.reader(io.StringIO(response.content.decode("utf-8-sig"))))
+
+
+def test_sales_csv_lists_every_sale_and_the_totals(client):
+    item = add_item(client, 10)
+    sales = [sell(client, item, 1, "Ali"), sell(client, item, 2)]
+    response = client.get(f"/api/shops/{SHOP_ID}/export/sales")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/csv; charset=utf-8"
+
+    rows = csv_rows(response)
+    assert rows[0] == list(exports.SalesReport.columns)
+    assert [row[2] for row in rows[1:3]] == [f"#{sale['id'][-8:].upper()}" for sale in sales]
+    assert rows[1][3:5] + rows[1][9:] == ["AGS 55Ah NS60", "1", "Ali", "N/A"]
+    assert rows[2][9] == "Walk-in Customer"
+    assert rows[3] == []
+    assert rows[4:] == [
+        ["Total Transactions", "2"], ["Total Items Sold", "3"], ["Total Sales Amount (Rs)", "450.0"],
+        ["Total Profit (Rs)", "150.0"], ["Average Sale Amount (Rs)", "225"]
+    ]
+
+
+def test_sales_export_is_limited_to_the_date_range(client):
+    sell(client, add_item(client, 10), 1)
+    tomorrow = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%dT00:00:00")
+    rows = csv_rows(client.get(f"/api/shops/{SHOP_ID}/export/sales", params={"from": tomorrow}))
+    assert rows[1:3] == [[], ["Total Transactions", "0"]]
+    rows = csv_rows(client.get(f"/api/shops/{SHOP_ID}/export/sales", params={"to": tomorrow}))
+    assert rows[2:4] == [[], ["Total Transactions", "1"]]
+
+
+def test_reports_are_written_in_chunks(monkeypatch):
+    monkeypatch.setattr(exports, "EXPORT_CHUNK_ROWS", 2)
+    inventory = {
+        f"B{i}": {
+            "brand": "AGS", "capacity": "55Ah", "model": f"M{i}", "stock_quantity": i, "purchase_price": 100.0,
+            "selling_price": 150.0, "low_stock_alert": 5, "warranty_months": 12, "date_added": "2026-01-15T10:00:00"
+        }
+        for i in range(5)
+    }
+    # An item deleted while the export streams is skipped
+    report = exports.InventoryReport(list(inventory) + ["deleted"], inventory)
+    chunks = list(exports.stream_csv(report))
+    # Three chunks of rows, then the summary
+    assert len(chunks) == 4
+    rows = list(csv.reader(io.StringIO(b"".join(chunks).decode("utf-8-sig"))))
+    assert [row[2] for row in rows[1:6]] == [f"M{i}" for i in range(5)]
+    assert rows[7] == ["Total Unique Items", "5"]
+
+    report = exports.InventoryReport(list(inventory), inventory)
+    assert len(list(exports.stream_xlsx(report))) == 4
+
+
+def test_inventory_xlsx_opens_with_both_sheets(client):
+    add_item(client, 2)
+    add_item(client, 8, model="NS70", supplier="Acme")
+    response = client.get(f"/api/shops/{SHOP_ID}/export/inventory", params={"format": "xlsx"})
+    assert response.status_code == 200
+    workbook = load_workbook(io.BytesIO(response.content))
+    report, summary = workbook.worksheets
+    rows = list(report.iter_rows(values_only=True))
+    assert rows[0] == exports.InventoryReport.columns
+    assert sorted((row[2], row[3], row[6], row[11]) for row in rows[1:]) == [("NS60", 2, 200, "N/A"), ("NS70", 8, 800, "Acme")]
+    assert list(summary.iter_rows(values_only=True)) == [
+        ("Total Unique Items", 2), ("Total Stock Value (Rs)", 1000), ("Total Potential Revenue (Rs)", 1500),
+        ("Low Stock Items", 1)
+    ]
+
+
+def test_pdf_pages_and_cross_reference_table_are_consistent(client):
+    item = add_item(client, 200)
+    for _ in range(60):
+        sell(client, item, 1)
+    response = client.get(f"/api/shops/{SHOP_ID}/export/sales", params={"format": "pdf"})
+    assert response.status_code == 200
+    pdf = response.content
+    assert pdf.startswith(b"%PDF-1.4") and pdf.endswith(b"%%EOF\n")
+    assert b"(SALES REPORT)" in pdf and b"(Total Transactions: 60)" in pdf
+    assert int(re.search(rb"/Count (\d+)", pdf).group(1)) == 2
+
+    # Every xref entry points at the start of its object
+    xref = int(re.search(rb"startxref\n(\d+)", pdf).group(1))
+    assert pdf[xref:].startswith(b"xref\n")
+    offsets = re.findall(rb"(\d{10}) 00000 n ", pdf[xref:])
+    for number, offset in enumerate(offsets, start=1):
+        assert pdf[int(offset):].startswith(b"%d 0 obj\n" % number)
+
+
+def test_filename_keeps_the_shop_name(server, client):
+    shop_config = run(server.load_shop_config(SHOP_ID))
+    run(server.save_record(server.SHOPS_STORE, SHOP_ID, {**shop_config, "shop_name": "Ali's Büttery \"Shop\""}))
+    disposition = client.get(f"/api/shops/{SHOP_ID}/export/inventory").headers["content-disposition"]
+    today = datetime.now().strftime("%Y-%m-%d")
+    assert disposition == (
+        f"attachment; filename=\"Ali_s_Buttery_Shop_Inventory_{today}.csv\"; "
+        f"filename*=UTF-8''Ali%27s_B%C3%BCttery_%22Shop%22_Inventory_{today}.csv"
+    )
+
+
+def test_unknown_format_and_shop_are_rejected(client):
+    assert client.get(f"/api/shops/{SHOP_ID}/export/sales", params={"format": "docx"}).status_code == 422
+    assert client.get("/api/shops/SHOP-NONE/export/inventory").status_code == 404
@@ -0,0 +1,38 @@
+"""
+Tests for the in-memory indexes behind the sales endpoints.
+"""
+
+import base64
+from datetime import datetime, timedelta
+
+import pytest
+
+from indexes import SaleDateIndex
+
+
+def sale_date_index(count):
+    index = SaleDateIndex()
+    start = datetime(2026, 1, 1, 9, 0)
+    for i in range(count):
+        index.add({"id": f"S{i}", "sale_date": start + timedelta(hours=i)})
+    return index
+
+
+def test_pages_follow_the_cursor_newest_first():
+    index = sale_date_index(5)
+    first, cursor = index.page(2)
+    second, cursor = index.page(2, cursor)
+    third, cursor = index.page(2, cursor)
+    assert (first, second, third, cursor) == (["S4", "S3"], ["S2", "S1"], ["S0"], None)
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"no separator").decode(),
+    base64.urlsafe_b64encode(b"2026-13-01T00:00:00|S1").decode(),
+    # Well formed, but with a UTC offset no cursor of this index has
+    base64.urlsafe_b64encode(b"2026-01-01T12:00:00+00:00|S1").decode()
+])
+def test_foreign_cursors_are_rejected(cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        sale_date_index(5).page(2, cursor)
@@ -0,0 +1,100 @@
+"""
+Tests for the CSV/XLSX bulk inventory import.
+"""
+
+import io
+
+from openpyxl import Workbook
+
+import inventory_import
+from tests.conftest import SHOP_ID, add_item, run
+
+HEADER = "Brand,Capacity,Model,Purchase Price,Selling Price,Stock Quantity,warranty_months,supplier,id\n"
+
+
+def upload(client, content, filename="inventory.csv"):
+    return client.post(f"/api/shops/{SHOP_ID}/inventory/import", files={"file": (filename, content, "application/octet-stream")})
+
+
+def inventory(client):
+    return {item["id"]: item for item in client.get(f"/api/shops/{SHOP_ID}/inventory").json()["inventory"]}
+
+
+def test_bad_rows_are_reported_and_the_rest_imported(server, client):
+    content = HEADER + (
+        "Exide,70Ah,X1,80,120,5,6,Supplier,\n"
+        "Exide,70Ah,X2,abc,120,5,6,Supplier,\n"  # row 3: price is not a number
+        "\n"                                      # row 4: blank, skipped but still counted
+        ",70Ah,X3,80,120,5.5,6,Supplier,\n"       # row 5: no brand and a fractional stock
+        "Osaka,100Ah,O1,90,120,-1,,,\n"           # row 6: negative stock
+        "Osaka,100Ah,O2,90,120,7,,,\n"
+    )
+    response = upload(client, content)
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["rows_read"], result["created"], result["updated"], result["failed"]) == (5, 2, 0, 3)
+    assert result["errors"] == [
+        {"row": 3, "errors": ["purchase_price must be a non-negative number"]},
+        {"row": 5, "errors": ["brand is required", "stock_quantity must be a non-negative whole number"]},
+        {"row": 6, "errors": ["stock_quantity must be a non-negative whole number"]}
+    ]
+
+    items = sorted(inventory(client).values(), key=lambda item: item["model"])
+    assert [(item["model"], item["stock_quantity"]) for item in items] == [("O2", 7), ("X1", 5)]
+    # Optional columns left empty take the model's defaults
+    assert (items[0]["warranty_months"], items[0]["supplier"]) == (12, None)
+    assert {item["shop_id"] for item in items} == {SHOP_ID}
+    assert set(run(server.storage_backend.load(server.INVENTORY_STORE))) == {item["id"] for item in items}
+
+
+def test_rows_match_existing_items_by_id_then_label(client):
+    existing = add_item(client, 3)
+    other = add_item(client, 1, model="NS70")
+    content = HEADER + (
+        "ags,55ah,ns60,110,160,20,,,\n"                  # same label as existing, in other case
+        f"AGS,55Ah,Renamed,1,2,4,24,,{other['id']}\n"   # by id, even though the label changed
+        "Osaka,100Ah,O1,90,120,7,,,not-an-item-id\n"     # an unknown id makes a new item
+        "AGS,55Ah,NS60,120,170,25,,,\n"                  # a later row for the same item wins
+    )
+    result = upload(client, content).json()
+    assert (result["created"], result["updated"], result["failed"]) == (1, 2, 0)
+
+    items = inventory(client)
+    assert len(items) == 3
+    assert (items[existing["id"]]["stock_quantity"], items[existing["id"]]["purchase_price"]) == (25, 120.0)
+    assert items[existing["id"]]["date_added"] == existing["date_added"]
+    assert (items[other["id"]]["model"], items[other["id"]]["stock_quantity"]) == ("Renamed", 4)
+    assert "not-an-item-id" not in items
+
+
+def test_missing_required_columns_reject_the_file(client):
+    response = upload(client, "brand,model\nAGS,NS60\n")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Missing required columns: capacity, purchase_price, selling_price, stock_quantity"
+    assert inventory(client) == {}
+
+
+def test_unsupported_and_damaged_files_are_rejected(client):
+    assert upload(client, "brand\n", filename="inventory.txt").json() == {"detail": "Upload a .csv or .xlsx file"}
+    for content in (b"not a zip file", b"PK\x03\x04 truncated"):
+        response = upload(client, content, filename="inventory.xlsx")
+        assert response.status_code == 400
+        assert response.json()["detail"] == "The uploaded file is not a valid Excel workbook"
+    assert inventory(client) == {}
+
+
+def test_excel_workbook_is_imported(client, monkeypatch):
+    monkeypatch.setattr(inventory_import, "IMPORT_CHUNK_ROWS", 100)
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(["Brand", "Capacity", "Model", "Purchase Price", "Selling Price", "Stock Quantity"])
+    for i in range(250):
+        sheet.append(["AGS", f"{i}Ah", "NS", 10, 20, i if i != 230 else -1])
+    content = io.BytesIO()
+    workbook.save(content)
+
+    result = upload(client, content.getvalue(), filename="inventory.xlsx").json()
+    # Rows are validated in chunks, and row numbers stay right past the first ones
+    assert (result["rows_read"], result["created"], result["failed"]) == (250, 249, 1)
+    assert result["errors"] == [{"row": 232, "errors": ["stock_quantity must be a non-negative whole number"]}]
+    assert len(inventory(client)) == 249
@@ -0,0 +1,197 @@
+"""
+Tests for the MongoDB storage backend.
+
+They run against the in-process fake in fake_motor.py unless MONGO_TEST_URL points at
+a local mongod, e.g. ``MONGO_TEST_URL=mongodb://localhost:27017 pytest tests``; each
+test then uses its own throwaway database.
+"""
+
+import asyncio
+import json
+import os
+import uuid
+
+import pytest
+from cryptography.fernet import Fernet
+
+from tests.fake_motor import FakeMotorClient
+from mongo_backend import MongoBackend
+from storage import RecordCipher, write_snapshot
+from storage_backends import DATA_STORES, EncryptedFileBackend, import_from_encrypted_files
+from tests.conftest import SHOP_ID, run
+
+MONGO_TEST_URL = os.environ.get("MONGO_TEST_URL")
+
+
+@pytest.fixture
+def make_backend(cipher):
+    """Returns a factory of backends that all point at the same fresh database."""
+    db_name = f"murick_test_{uuid.uuid4().hex[:8]}"
+    url = MONGO_TEST_URL or f"mongodb://fake-{db_name}"
+    client_factory = None if MONGO_TEST_URL else FakeMotorClient
+
+    def make():
+        return MongoBackend(url, db_name, cipher, max_pool_size=8, client_factory=client_factory)
+
+    yield make
+
+    if MONGO_TEST_URL:
+        async def drop():
+            backend = make()
+            await backend.open()
+            await backend.client.drop_database(db_name)
+            await backend.close()
+        asyncio.run(drop())
+
+
+def sale(sale_id, battery_id="B1", sale_date="2026-01-15 10:00:00"):
+    return {
+        "id": sale_id, "shop_id": SHOP_ID, "battery_id": battery_id, "quantity_sold": 1,
+        "sale_price": 150.0, "total_amount": 150.0, "profit": 50.0, "sale_date": sale_date
+    }
+
+
+def test_commit_and_load_round_trip(make_backend):
+    async def scenario():
+        backend = make_backend()
+        await backend.open()
+        item = {"id": "B1", "shop_id": SHOP_ID, "brand": "AGS", "stock_quantity": 4}
+        await backend.commit([("inventory", "B1", item), ("sales", "S1", sale("S1"))])
+        await backend.close()
+
+        # A new client sees everything the first one committed
+        reopened = make_backend()
+        await reopened.open()
+        assert await reopened.load("inventory") == {"B1": item}
+        assert await reopened.load("sales") == {"S1": sale("S1")}
+        assert await reopened.load("shops") == {}
+        await reopened.close()
+
+    run(scenario())
+
+
+def test_commit_replaces_and_deletes(make_backend):
+    async def scenario():
+        backend = make_backend()
+        await backend.open()
+        await backend.commit([("licenses", "K1", {"key": "K1", "used": False}), ("licenses", "K2", {"key": "K2", "used": False})])
+        await backend.commit([("licenses", "K1", {"key": "K1", "used": True}), ("licenses", "K2", None)])
+        assert await backend.load("licenses") == {"K1": {"key": "K1", "used": True}}
+        assert await backend.is_empty("licenses") is False
+        assert await backend.is_empty("recovery_codes") is True
+        await backend.close()
+
+    run(scenario())
+
+
+def test_public_fields_and_single_record_loads(make_backend, cipher):
+    async def scenario():
+        backend = make_backend()
+        await backend.open()
+        await backend.commit([
+            ("licenses", "MBM-1", {"plan": "basic", "used": False, "created_date": "2026-01-01"}),
+            ("licenses", "MBM-2", {"plan": "premium", "used": True, "shop_id": SHOP_ID})
+        ])
+        assert await backend.load_public("licenses") == {
+            cipher.record_id("MBM-1"): {"plan": "basic", "used": False},
+            cipher.record_id("MBM-2"): {"plan": "premium", "used": True}
+        }
+        assert await backend.load_record("licenses", "MBM-2") == {"plan": "premium", "used": True, "shop_id": SHOP_ID}
+        assert await backend.load_record("licenses", "MBM-3") is None
+        await backend.close()
+
+    run(scenario())
+
+
+def test_records_are_encrypted_and_indexed_fields_plain(make_backend, cipher):
+    async def scenario():
+        backend = make_backend()
+        await backend.open()
+        await backend.commit([("sales", "S1", sale("S1", battery_id="B7"))])
+        document = await backend.db["sales"].find_one({}, None)
+        assert document["shop_id"] == SHOP_ID
+        assert document["battery_id"] == "B7"
+        assert document["sale_date"] == "2026-01-15 10:00:00"
+        assert b"total_amount" not in bytes(document["data"])
+        assert cipher.decrypt(bytes(document["data"]))
+        await backend.close()
+
+    run(scenario())
+
+
+def test_compound_indexes_and_pool_size(make_backend):
+    async def scenario():
+        backend = make_backend()
+        await backend.open()
+        sales_indexes = [index["key"] for index in (await backend.db["sales"].index_information()).values()]
+        inventory_indexes = [index["key"] for index in (await backend.db["inventory"].index_information()).values()]
+        assert [("shop_id", 1), ("sale_date", 1)] in [list(key) for key in sales_indexes]
+        assert [("shop_id", 1), ("battery_id", 1)] in [list(key) for key in sales_indexes]
+        assert [("shop_id", 1)] in [list(key) for key in inventory_indexes]
+        if not MONGO_TEST_URL:
+            assert backend.client.options["maxPoolSize"] == 8
+        assert backend.stats()["max_pool_size"] == 8
+        await backend.close()
+
+    run(scenario())
+
+
+def test_concurrent_commits_share_the_client(make_backend):
+    async def scenario():
+        backend = make_backend()
+        await backend.open()
+        await asyncio.gather(*(backend.commit([("sales", f"S{i}", sale(f"S{i}"))]) for i in range(50)))
+        assert len(await backend.load("sales")) == 50
+        assert backend.stats()["commits"]["entries"] == 50
+        await backend.close()
+
+    run(scenario())
+
+
+def test_reencrypt_moves_every_record_to_the_new_key(make_backend, cipher):
+    async def scenario():
+        backend = make_backend()
+        await backend.open()
+        await backend.commit([("sales", f"S{i}", sale(f"S{i}")) for i in range(7)])
+        new_key = Fernet.generate_key()
+        cipher.use_keys([new_key] + cipher.keys)
+        assert await backend.reencrypt("sales", batch_size=3) == 7
+        new_only = Fernet(new_key)
+        async for document in backend.db["sales"].find({}, None):
+            entry = json.loads(new_only.decrypt(bytes(document["data"])))
+            assert cipher.record_id(entry["key"]) == document["_id"]
+        # Record ids do not change with the key
+        assert cipher.record_id("S1") == RecordCipher([new_key], cipher.id_key).record_id("S1")
+        await backend.close()
+
+    run(scenario())
+
+
+def test_import_from_encrypted_files(make_backend, cipher, tmp_path):
+    shops = {SHOP_ID: {"shop_id": SHOP_ID, "name": "Test Shop", "users": []}}
+    item = {"id": "B1", "shop_id": SHOP_ID, "brand": "AGS", "stock_quantity": 4}
+    write_snapshot(shops, str(tmp_path / "shops.dat"), cipher)
+    source = EncryptedFileBackend(str(tmp_path), cipher, 0.001, 1024 * 1024, 1000)
+
+    async def scenario():
+        # Inventory only exists as a journal until its first compaction
+        await source.commit([("inventory", "B1", item)])
+        assert not (tmp_path / "inventory.dat").exists()
+
+        backend = make_backend()
+        await backend.open()
+        await import_from_encrypted_files(backend, source)
+        assert await backend.load("shops") == shops
+        assert await backend.load("inventory") == {"B1": item}
+        for store in DATA_STORES:
+            if store not in ("shops", "inventory"):
+                assert await backend.is_empty(store)
+
+        # The import runs once: emptying a collection never brings the files back
+        await backend.commit([("shops", SHOP_ID, None), ("inventory", "B1", None)])
+        await import_from_encrypted_files(backend, source)
+        assert await backend.load("shops") == {}
+        assert await backend.load("inventory") == {}
+        await backend.close()
+
+    run(scenario())
@@ -0,0 +1,76 @@
+"""
+Tests for recording sales, in particular that a multi-line cart is all or nothing.
+"""
+
+import asyncio
+
+import httpx
+
+from tests.conftest import SHOP_ID, add_item, run
+
+
+def cart(*lines, **fields):
+    return {"items": [{"battery_id": battery_id, "quantity_sold": quantity, "unit_price": 150.0} for battery_id, quantity in lines], **fields}
+
+
+def stock(client):
+    return {item["id"]: item["stock_quantity"] for item in client.get(f"/api/shops/{SHOP_ID}/inventory").json()["inventory"]}
+
+
+def test_cart_records_every_line_under_one_receipt(server, client):
+    first, second = add_item(client, 5), add_item(client, 2, model="NS70")
+    response = client.post(f"/api/shops/{SHOP_ID}/sales/batch", json=cart((first["id"], 2), (second["id"], 2), customer_name="Ali"))
+    assert response.status_code == 200
+    sales, receipt = response.json()["sales"], response.json()["receipt"]
+    assert len(sales) == 2
+    assert {sale["receipt_id"] for sale in sales} == {receipt["sale"]["id"]}
+    assert receipt["sale"]["quantity_sold"] == 4
+    assert receipt["sale"]["total_amount"] == 600.0
+    assert stock(client) == {first["id"]: 3, second["id"]: 0}
+
+    # Both lines and both stock changes are durable
+    stored = run(server.storage_backend.load(server.INVENTORY_STORE))
+    assert {item_id: item["stock_quantity"] for item_id, item in stored.items()} == {first["id"]: 3, second["id"]: 0}
+    assert set(run(server.storage_backend.load(server.SALES_STORE))) == {sale["id"] for sale in sales}
+
+
+def test_cart_with_one_short_line_changes_nothing(server, client):
+    first, second = add_item(client, 5), add_item(client, 1, model="NS70")
+    before = client.get(f"/api/shops/{SHOP_ID}/dashboard").json()
+
+    response = client.post(f"/api/shops/{SHOP_ID}/sales/batch", json=cart((first["id"], 2), (second["id"], 2), ("missing", 1)))
+    assert response.status_code == 400
+    assert response.json()["detail"]["errors"] == [
+        {"battery_id": second["id"], "detail": "Insufficient stock", "requested": 2, "available": 1},
+        {"battery_id": "missing", "detail": "Battery item not found"}
+    ]
+    assert stock(client) == {first["id"]: 5, second["id"]: 1}
+    assert client.get(f"/api/shops/{SHOP_ID}/sales").json()["sales"] == []
+    assert client.get(f"/api/shops/{SHOP_ID}/dashboard").json() == before
+    assert run(server.storage_backend.load(server.SALES_STORE)) == {}
+
+
+def test_lines_for_the_same_battery_are_checked_together(client):
+    item = add_item(client, 3)
+    response = client.post(f"/api/shops/{SHOP_ID}/sales/batch", json=cart((item["id"], 2), (item["id"], 2)))
+    assert response.status_code == 400
+    assert response.json()["detail"]["errors"][0]["requested"] == 4
+    assert stock(client) == {item["id"]: 3}
+
+
+def test_concurrent_carts_never_oversell(server, client):
+    first, second = add_item(client, 3), add_item(client, 3, model="NS70")
+
+    async def checkout():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as http:
+            # Opposite line orders, so carts also contend for the locks in both directions
+            return await asyncio.gather(*(
+                http.post(f"/api/shops/{SHOP_ID}/sales/batch", json=cart(*lines))
+                for lines in [((first["id"], 1), (second["id"], 1)), ((second["id"], 1), (first["id"], 1))] * 4
+            ))
+
+    statuses = [response.status_code for response in run(checkout())]
+    assert statuses.count(200) == 3
+    assert statuses.count(400) == 5
+    assert stock(client) == {first["id"]: 0, second["id"]: 0}
+    assert len(run(server.storage_backend.load(server.SALES_STORE))) == 6
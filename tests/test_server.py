@@ -0,0 +1,37 @@
+"""
+Tests for the server's in-memory state around storage: indexes kept in step with saves.
+"""
+
+import pytest
+
+from tests.conftest import SHOP_ID, run
+
+
+def test_failed_commit_leaves_indexes_and_shop_cache_as_they_were(server):
+    async def failing_commit(changes):
+        raise OSError("disk full")
+
+    run(server.save_record(server.LICENSES_STORE, "MBM-1", {"plan": "basic", "used": False}))
+    shop_config = run(server.load_shop_config(SHOP_ID))
+    server.storage_backend.commit = failing_commit
+
+    with pytest.raises(OSError):
+        run(server.save_records(
+            (server.LICENSES_STORE, "MBM-1", {"plan": "basic", "used": True}),
+            (server.SHOPS_STORE, "SHOP-NEW", {"shop_id": "SHOP-NEW", "users": []}),
+            (server.SHOPS_STORE, SHOP_ID, {**shop_config, "shop_name": "Renamed"})
+        ))
+
+    assert server.license_index[server.cipher.record_id("MBM-1")] == {"plan": "basic", "used": False}
+    assert not server.shop_exists("SHOP-NEW")
+    del server.storage_backend.commit
+    assert run(server.load_shop_config(SHOP_ID))["shop_name"] == "Test Shop"
+
+
+def test_record_versions_are_only_kept_for_shops(server):
+    run(server.save_records(
+        (server.INVENTORY_STORE, "B1", {"id": "B1", "shop_id": SHOP_ID}),
+        (server.SALES_STORE, "S1", {"id": "S1", "shop_id": SHOP_ID}),
+        (server.LICENSES_STORE, "MBM-1", {"plan": "basic", "used": False})
+    ))
+    assert set(server.record_versions) == {(server.SHOPS_STORE, SHOP_ID)}
@@ -0,0 +1,170 @@
+"""
+Tests for the SQLite storage backend.
+"""
+
+import asyncio
+import json
+import sqlite3
+
+import pytest
+from cryptography.fernet import Fernet
+
+from storage import write_snapshot
+from storage_backends import DATA_STORES, EncryptedFileBackend, SQLiteBackend, import_from_encrypted_files
+from tests.conftest import SHOP_ID, run
+
+
+@pytest.fixture
+def make_backend(cipher, tmp_path):
+    """Returns a factory of backends that all open the same fresh database."""
+    backends = []
+
+    def make():
+        backend = SQLiteBackend(str(tmp_path / "murick.db"), cipher, 0.001)
+        backends.append(backend)
+        return backend
+
+    yield make
+
+    for backend in backends:
+        backend.executor.shutdown(wait=True)
+
+
+def sale(sale_id, battery_id="B1", sale_date="2026-01-15T10:00:00"):
+    return {
+        "id": sale_id, "shop_id": SHOP_ID, "battery_id": battery_id, "quantity_sold": 1,
+        "sale_price": 150.0, "total_amount": 150.0, "profit": 50.0, "sale_date": sale_date
+    }
+
+
+def test_commit_and_load_round_trip(make_backend):
+    async def scenario():
+        backend = make_backend()
+        item = {"id": "B1", "shop_id": SHOP_ID, "brand": "AGS", "stock_quantity": 4}
+        await backend.commit([("inventory", "B1", item), ("sales", "S1", sale("S1"))])
+        await backend.close()
+
+        # A new connection sees everything the first one committed
+        reopened = make_backend()
+        assert await reopened.load("inventory") == {"B1": item}
+        assert await reopened.load("sales") == {"S1": sale("S1")}
+        assert await reopened.load("shops") == {}
+        await reopened.close()
+
+    run(scenario())
+
+
+def test_commit_replaces_and_deletes(make_backend):
+    async def scenario():
+        backend = make_backend()
+        await backend.commit([("licenses", "K1", {"key": "K1", "used": False}), ("licenses", "K2", {"key": "K2", "used": False})])
+        await backend.commit([("licenses", "K1", {"key": "K1", "used": True}), ("licenses", "K2", None)])
+        assert await backend.load("licenses") == {"K1": {"key": "K1", "used": True}}
+        assert await backend.is_empty("licenses") is False
+        assert await backend.is_empty("recovery_codes") is True
+        await backend.close()
+
+    run(scenario())
+
+
+def test_public_fields_and_single_record_loads(make_backend, cipher):
+    async def scenario():
+        backend = make_backend()
+        await backend.commit([
+            ("licenses", "MBM-1", {"plan": "basic", "used": False, "created_date": "2026-01-01"}),
+            ("licenses", "MBM-2", {"plan": "premium", "used": True, "shop_id": SHOP_ID})
+        ])
+        public = await backend.load_public("licenses")
+        assert public == {
+            cipher.record_id("MBM-1"): {"plan": "basic", "used": False},
+            cipher.record_id("MBM-2"): {"plan": "premium", "used": True}
+        }
+        # Stored as 0 and 1, read back as bools
+        assert public[cipher.record_id("MBM-1")]["used"] is False
+        assert public[cipher.record_id("MBM-2")]["used"] is True
+        assert await backend.load_record("licenses", "MBM-2") == {"plan": "premium", "used": True, "shop_id": SHOP_ID}
+        assert await backend.load_record("licenses", "MBM-3") is None
+        await backend.close()
+
+    run(scenario())
+
+
+def test_records_are_encrypted_and_indexed_fields_plain(make_backend, cipher, tmp_path):
+    async def scenario():
+        backend = make_backend()
+        await backend.commit([("sales", "S1", sale("S1", battery_id="B7")), ("licenses", "MBM-1", {"plan": "basic", "used": False})])
+        await backend.close()
+
+    run(scenario())
+    connection = sqlite3.connect(str(tmp_path / "murick.db"))
+    record_id, shop_id, battery_id, sale_date, data = connection.execute(
+        "SELECT id, shop_id, battery_id, sale_date, data FROM sales"
+    ).fetchone()
+    assert (record_id, shop_id, battery_id, sale_date) == (cipher.record_id("S1"), SHOP_ID, "B7", "2026-01-15T10:00:00")
+    assert b"total_amount" not in data
+    assert json.loads(cipher.decrypt(data)) == {"key": "S1", "value": sale("S1", battery_id="B7")}
+    # License keys are only stored encrypted
+    assert connection.execute("SELECT id FROM licenses").fetchone()[0] == cipher.record_id("MBM-1")
+    connection.close()
+
+
+def test_concurrent_commits_share_a_transaction(make_backend):
+    async def scenario():
+        backend = make_backend()
+        await asyncio.gather(*(backend.commit([("sales", f"S{i}", sale(f"S{i}"))]) for i in range(50)))
+        assert len(await backend.load("sales")) == 50
+        assert backend.stats()["group_commit"]["entries"] == 50
+        assert backend.stats()["group_commit"]["batches"] < 50
+        await backend.close()
+
+    run(scenario())
+
+
+def test_reencrypt_moves_every_record_to_the_new_key(make_backend, cipher, tmp_path):
+    async def scenario():
+        backend = make_backend()
+        await backend.commit([("sales", f"S{i}", sale(f"S{i}")) for i in range(7)])
+        new_key = Fernet.generate_key()
+        cipher.use_keys([new_key] + cipher.keys)
+        assert await backend.reencrypt("sales", batch_size=3) == 7
+        await backend.close()
+
+    run(scenario())
+    new_only = Fernet(cipher.keys[0])
+    connection = sqlite3.connect(str(tmp_path / "murick.db"))
+    rows = connection.execute("SELECT id, data FROM sales").fetchall()
+    assert len(rows) == 7
+    for record_id, data in rows:
+        entry = json.loads(new_only.decrypt(data))
+        assert cipher.record_id(entry["key"]) == record_id
+    connection.close()
+
+
+def test_import_from_encrypted_files(make_backend, cipher, tmp_path):
+    shops = {SHOP_ID: {"shop_id": SHOP_ID, "name": "Test Shop", "users": []}}
+    item = {"id": "B1", "shop_id": SHOP_ID, "brand": "AGS", "stock_quantity": 4}
+    (tmp_path / "files").mkdir()
+    write_snapshot(shops, str(tmp_path / "files" / "shops.dat"), cipher)
+    source = EncryptedFileBackend(str(tmp_path / "files"), cipher, 0.001, 1024 * 1024, 1000)
+
+    async def scenario():
+        # Inventory only exists as a journal until its first compaction
+        await source.commit([("inventory", "B1", item)])
+
+        backend = make_backend()
+        await import_from_encrypted_files(backend, source)
+        assert await backend.load("shops") == shops
+        assert await backend.load("inventory") == {"B1": item}
+        for store in DATA_STORES:
+            if store not in ("shops", "inventory"):
+                assert await backend.is_empty(store)
+        assert await backend.has_migration("import_from_encrypted_files")
+
+        # The import runs once: emptying a table never brings the files back
+        await backend.commit([("shops", SHOP_ID, None), ("inventory", "B1", None)])
+        await import_from_encrypted_files(backend, source)
+        assert await backend.load("shops") == {}
+        assert await backend.load("inventory") == {}
+        await backend.close()
+
+    run(scenario())
@@ -0,0 +1,232 @@
+"""
+Crash-safety tests for the encrypted file storage: journal replay, torn writes,
+falling back to the previous generation, group commit, compaction and key rotation.
+"""
+
+import asyncio
+import builtins
+import json
+import os
+import time
+from datetime import datetime
+
+import pytest
+from cryptography.fernet import Fernet
+
+import storage
+import storage_backends
+from storage import (
+    RECORDS_HEADER, RecordCipher, GroupCommitJournal, StoreCorruptedError, compact_store, finish_key_rotation,
+    journal_needs_compaction, journal_path, load_cipher, load_store, previous_journal_path, previous_snapshot_path,
+    stage_key_rotation, write_snapshot
+)
+from storage_backends import EncryptedFileBackend
+from tests.conftest import SHOP_ID, run
+
+
+@pytest.fixture
+def filename(tmp_path):
+    return str(tmp_path / "inventory.dat")
+
+
+def item(item_id, stock=4):
+    return {"id": item_id, "shop_id": SHOP_ID, "brand": "AGS", "stock_quantity": stock}
+
+
+async def append(cipher, filename, *changes, window_seconds=0.001):
+    """Commits each (key, record) change through a journal and returns it for its stats."""
+    journal = GroupCommitJournal(cipher, window_seconds)
+    await asyncio.gather(*(journal.commit([(filename, key, record, ())]) for key, record in changes))
+    return journal
+
+
+def test_journal_is_replayed_over_the_snapshot(cipher, filename):
+    write_snapshot({"B1": item("B1"), "B2": item("B2")}, filename, cipher)
+    run(append(cipher, filename, ("B1", item("B1", stock=9)), ("B2", None), ("B3", item("B3"))))
+    assert load_store(filename, cipher) == {"B1": item("B1", stock=9), "B3": item("B3")}
+
+
+def test_datetimes_are_stored_in_iso_format(cipher, filename):
+    added = datetime(2026, 1, 15, 10, 30, 5, 120000)
+    run(append(cipher, filename, ("B1", {**item("B1"), "date_added": added})))
+    assert load_store(filename, cipher)["B1"]["date_added"] == "2026-01-15T10:30:05.120000"
+
+
+def test_torn_journal_tail_is_skipped(cipher, filename):
+    run(append(cipher, filename, ("B1", item("B1")), ("B2", item("B2"))))
+    # A crash in the middle of an append leaves half a line behind
+    with open(journal_path(filename), 'ab') as f:
+        f.write(b'{"id": "0f3a", "op": "set", "entry": "gAAAA')
+    assert load_store(filename, cipher) == {"B1": item("B1"), "B2": item("B2")}
+
+
+def test_truncated_snapshot_falls_back_to_the_previous_generation(cipher, filename):
+    write_snapshot({"B1": item("B1")}, filename, cipher)
+    run(append(cipher, filename, ("B2", item("B2")), ("B1", None)))
+    expected = load_store(filename, cipher)
+    run(compact_store(filename, cipher))
+    assert os.path.exists(previous_snapshot_path(filename))
+    assert os.path.exists(previous_journal_path(filename))
+
+    with open(filename, 'r+b') as f:
+        f.truncate(os.path.getsize(filename) // 2)
+    assert load_store(filename, cipher) == expected == {"B2": item("B2")}
+
+
+def test_unreadable_store_raises_store_corrupted_error(cipher, filename):
+    write_snapshot({"B1": item("B1")}, filename, cipher)
+    # Encrypted with a key the cipher does not hold, and no previous generation to fall back to
+    write_snapshot({"B1": item("B1")}, filename + ".other", RecordCipher.from_key(Fernet.generate_key()))
+    os.replace(filename + ".other", filename)
+    with pytest.raises(StoreCorruptedError):
+        load_store(filename, cipher)
+
+    # Both generations damaged
+    write_snapshot({"B2": item("B2")}, filename, cipher)
+    for path in (filename, previous_snapshot_path(filename)):
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 10)
+    with pytest.raises(StoreCorruptedError):
+        load_store(filename, cipher)
+
+
+def test_concurrent_commits_share_one_batch_and_fsync(cipher, filename):
+    journal = run(append(cipher, filename, *((f"B{i}", item(f"B{i}")) for i in range(20)), window_seconds=0.05))
+    assert journal.stats["batches"] == 1
+    assert journal.stats["entries"] == 20
+    assert journal.stats["fsyncs"] == 1
+    assert journal.stats["largest_batch"] == 20
+    assert len(load_store(filename, cipher)) == 20
+
+
+def test_compaction_keeps_the_latest_state(cipher, filename):
+    write_snapshot({"B1": item("B1"), "B2": item("B2")}, filename, cipher)
+    run(append(cipher, filename, *((f"B{i % 3}", item(f"B{i % 3}", stock=i)) for i in range(10))))
+    run(append(cipher, filename, ("B2", None)))
+    expected = load_store(filename, cipher)
+
+    stats = run(compact_store(filename, cipher))
+    assert stats["records"] == len(expected) == 2
+    assert not os.path.exists(journal_path(filename))
+    assert load_store(filename, cipher) == expected
+
+    # Appends after the compaction land in a fresh journal on top of the new snapshot
+    run(append(cipher, filename, ("B4", item("B4"))))
+    assert load_store(filename, cipher) == {**expected, "B4": item("B4")}
+
+
+def test_compaction_never_drops_a_batch_that_is_being_appended(cipher, filename, monkeypatch):
+    write_snapshot({"B1": item("B1")}, filename, cipher)
+    run(append(cipher, filename, ("B2", item("B2"))))
+
+    def slow_open(path, mode='r', *args, **kwargs):
+        f = builtins.open(path, mode, *args, **kwargs)
+        if mode == 'ab':
+            # The batch has the journal open; a compaction starting now must wait for it
+            time.sleep(0.1)
+        return f
+
+    monkeypatch.setattr(storage, "open", slow_open, raising=False)
+
+    async def scenario():
+        journal = GroupCommitJournal(cipher, 0.001)
+        commit = asyncio.ensure_future(journal.commit([(filename, "B3", item("B3"), ())]))
+        await asyncio.sleep(0.05)
+        await compact_store(filename, cipher, writer=journal)
+        await commit
+
+    run(scenario())
+    assert load_store(filename, cipher) == {"B1": item("B1"), "B2": item("B2"), "B3": item("B3")}
+
+
+def test_whole_store_snapshots_are_rewritten_per_record_on_open(cipher, tmp_path):
+    licenses = {f"MBM-{i}": {"plan": "basic", "used": i == 0} for i in range(3)}
+    filename = str(tmp_path / "licenses.dat")
+    # The format before records had their own lines: one token over the whole store
+    with open(filename, 'wb') as f:
+        f.write(cipher.encrypt(json.dumps(licenses).encode('utf-8')))
+    assert journal_needs_compaction(filename, 1024 * 1024, 1000)
+
+    async def scenario():
+        backend = EncryptedFileBackend(str(tmp_path), cipher, 0.001, 1024 * 1024, 1000)
+        await backend.open()
+        with open(filename, 'rb') as f:
+            assert f.read(len(RECORDS_HEADER)) == RECORDS_HEADER
+        assert not journal_needs_compaction(filename, 1024 * 1024, 1000)
+        assert await backend.load_public("licenses") == {
+            cipher.record_id(key): {"plan": "basic", "used": record["used"]} for key, record in licenses.items()
+        }
+        # Every record can now be read from its own line
+        assert len(backend.locations["licenses"]) == 3
+        assert await backend.load_record("licenses", "MBM-0") == licenses["MBM-0"]
+        assert backend.location_misses == 0
+        assert await backend.load("licenses") == licenses
+
+    run(scenario())
+
+
+def test_records_appended_while_a_store_is_scanned_are_located(cipher, tmp_path, monkeypatch):
+    def slow_locate_records(*args):
+        found = storage.locate_records(*args)
+        # The scan runs in a worker thread; the event loop keeps committing meanwhile
+        time.sleep(0.1)
+        return found
+
+    monkeypatch.setattr(storage_backends, "locate_records", slow_locate_records)
+
+    async def scenario():
+        backend = EncryptedFileBackend(str(tmp_path), cipher, 0.001, 1024 * 1024, 1000)
+        await backend.commit([("inventory", "B1", item("B1")), ("inventory", "B2", item("B2"))])
+        scan = asyncio.ensure_future(backend.load_public("inventory"))
+        await asyncio.sleep(0.02)
+        await backend.commit([("inventory", "B1", item("B1", stock=9)), ("inventory", "B2", None)])
+        assert not scan.done()
+        await scan
+        assert await backend.load_record("inventory", "B1") == item("B1", stock=9)
+        assert await backend.load_record("inventory", "B2") is None
+        assert set(backend.locations["inventory"]) == {cipher.record_id("B1")}
+
+    run(scenario())
+
+
+def test_rotation_interrupted_between_stage_and_finish_reads_every_record(cipher, tmp_path):
+    key_file = str(tmp_path / "encryption.key")
+    old_key, new_key = cipher.keys[0], Fernet.generate_key()
+    with open(key_file, 'wb') as f:
+        f.write(old_key)
+    licenses = {f"MBM-{i}": {"plan": "basic", "used": False} for i in range(4)}
+
+    async def before_crash():
+        backend = EncryptedFileBackend(str(tmp_path), load_cipher(key_file), 0.001, 1024 * 1024, 1000)
+        await backend.commit([("licenses", key, record) for key, record in list(licenses.items())[:2]])
+        await backend.reencrypt("licenses")  # a compaction, so the old key is in a snapshot and .prev
+        await backend.commit([("licenses", "MBM-2", licenses["MBM-2"])])
+        stage_key_rotation(key_file, new_key, backend.cipher)
+        await backend.commit([("licenses", "MBM-3", licenses["MBM-3"])])
+        return backend.cipher.record_id("MBM-0")
+
+    record_id = run(before_crash())
+
+    async def after_restart():
+        # The process died before re-encrypting: records under both keys must still load
+        restarted = load_cipher(key_file)
+        assert restarted.keys == [new_key, old_key]
+        assert restarted.record_id("MBM-0") == record_id
+        backend = EncryptedFileBackend(str(tmp_path), restarted, 0.001, 1024 * 1024, 1000)
+        assert await backend.load("licenses") == licenses
+        assert set(await backend.load_public("licenses")) == {restarted.record_id(key) for key in licenses}
+        assert await backend.load_record("licenses", "MBM-2") == licenses["MBM-2"]
+
+        assert await backend.reencrypt("licenses") == 4
+        finish_key_rotation(key_file, restarted)
+
+    run(after_restart())
+
+    finished = load_cipher(key_file)
+    assert finished.keys == [new_key]
+    assert finished.record_id("MBM-0") == record_id
+    filename = str(tmp_path / "licenses.dat")
+    assert load_store(filename, finished, ("plan", "used")) == licenses
+    # Nothing, not even the previous generation, is left under the old key
+    with pytest.raises(StoreCorruptedError):
+        load_store(filename, RecordCipher([old_key], finished.id_key), ("plan", "used"))
@@ -0,0 +1,78 @@
+"""
+Tests for delta sync: changes after a sequence, or a full reset when a delta is not possible.
+"""
+
+import sys
+
+from fastapi.testclient import TestClient
+
+from tests.conftest import SHOP_ID, add_item, run
+
+
+def sync(client, since):
+    response = client.get(f"/api/shops/{SHOP_ID}/sync", params={"since": since})
+    assert response.status_code == 200
+    return response.json()
+
+
+def ids(records):
+    return sorted(record["id"] for record in records)
+
+
+def test_first_sync_is_a_reset_with_every_record(client):
+    items = [add_item(client, 3), add_item(client, 4, model="NS70")]
+    payload = sync(client, 0)
+    assert payload["reset"] is True
+    assert ids(payload["inventory"]["upserts"]) == ids(items)
+    assert payload["inventory"]["deletes"] == payload["sales"]["upserts"] == payload["sales"]["deletes"] == []
+
+
+def test_later_syncs_only_carry_the_changes(client):
+    kept, changed, deleted = add_item(client, 3), add_item(client, 4, model="NS70"), add_item(client, 5, model="NS80")
+    seq = sync(client, 0)["seq"]
+
+    client.put(f"/api/shops/{SHOP_ID}/inventory/{changed['id']}", json={**changed, "selling_price": 175.0})
+    client.delete(f"/api/shops/{SHOP_ID}/inventory/{deleted['id']}")
+    sale = client.post(f"/api/shops/{SHOP_ID}/sales", json={
+        "battery_id": kept["id"], "quantity_sold": 1, "unit_price": 150.0, "total_amount": 150.0
+    }).json()["sale"]
+
+    payload = sync(client, seq)
+    assert payload["reset"] is False
+    assert payload["seq"] > seq
+    upserts = {item["id"]: item for item in payload["inventory"]["upserts"]}
+    assert sorted(upserts) == ids([kept, changed])
+    assert upserts[changed["id"]]["selling_price"] == 175.0
+    assert upserts[kept["id"]]["stock_quantity"] == 2
+    assert payload["inventory"]["deletes"] == [deleted["id"]]
+    assert ids(payload["sales"]["upserts"]) == [sale["id"]]
+
+    # Nothing has changed since the last sync
+    assert sync(client, payload["seq"]) == {
+        "seq": payload["seq"], "reset": False,
+        "inventory": {"upserts": [], "deletes": []}, "sales": {"upserts": [], "deletes": []}
+    }
+
+
+def test_a_sequence_the_server_never_issued_gets_a_reset(client):
+    item = add_item(client, 3)
+    payload = sync(client, sync(client, 0)["seq"] + 1000)
+    assert payload["reset"] is True
+    assert ids(payload["inventory"]["upserts"]) == [item["id"]]
+
+
+def test_clients_synced_before_a_restart_get_a_reset(server, client):
+    items = [add_item(client, 3), add_item(client, 4, model="NS70")]
+    client.delete(f"/api/shops/{SHOP_ID}/inventory/{items[1]['id']}")
+    seq = sync(client, 0)["seq"]
+
+    # A new process: the stores are read back from disk and sequences start again from the clock
+    sys.modules.pop("server")
+    import server as restarted
+    run(restarted.load_data_stores())
+    payload = sync(TestClient(restarted.app), seq)
+    assert payload["reset"] is True
+    assert payload["seq"] > seq
+    # Records loaded from storage are part of the reset; the delete left nothing behind
+    assert ids(payload["inventory"]["upserts"]) == [items[0]["id"]]
+    assert payload["inventory"]["deletes"] == []